@@ -2,6 +2,8 @@
 
 import gradio as gr
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from pathlib import Path
 
 # --- THIẾT LẬP ĐƯỜNG DẪN ---
@@ -11,12 +13,19 @@ sys.path.append(str(project_root))
 
 # --- BƯỚC 1: XÂY DỰNG DATABASE (NẾU CẦN THIẾT) ---
 # Import và chạy hàm build_chroma_db trước khi làm bất cứ điều gì khác.
-# Hàm này sẽ tự kiểm tra và chỉ xây dựng DB nếu nó chưa tồn tại.
+# Hàm này đồng bộ tăng dần: chỉ embedding lại các tài liệu mới hoặc đã thay đổi.
+# Khi đã có phiên bản index được promote, app không đồng bộ dữ liệu lúc khởi động: phiên bản
+# mới được build ở tiến trình riêng bằng scripts/build_index_version.py, và RetrievalSystem
+# tự chuyển sang khi nó được promote mà không cần khởi động lại app.
 from scripts.build_database import build_chroma_db
-build_chroma_db()
+from src.chatbot.index_registry import read_pointer
+if read_pointer() is None:
+    build_chroma_db()
 
 # --- BƯỚC 2: KHỞI TẠO RAG PIPELINE ---
 from src.chatbot.pipeline import RAGPipeline
+from src.chatbot.config import ADMISSION_ENABLED, ADMISSION_GRADIO_CONCURRENCY, REQUEST_DEADLINE_SECONDS
+from src.chatbot.cancellation import CancellationToken, RequestCancelled
 
 pipeline = None # Khai báo biến pipeline toàn cục
 try:
@@ -30,17 +39,74 @@ except Exception as e:
 
 
 # --- BƯỚC 3: LOGIC XỬ LÝ CHAT ---
-def chat_response_function(message, history):
+# get_answer chạy trong thread riêng để hàm chat có thể yield định kỳ: Gradio đóng generator
+# (GeneratorExit) khi người dùng đóng tab, và khi đó request được huỷ thay vì sinh tiếp.
+POLL_SECONDS = 0.5
+answer_executor = ThreadPoolExecutor(thread_name_prefix="chat-answer")
+active_requests = {} # session_id -> CancellationToken của request đang chạy
+active_requests_lock = threading.Lock()
+
+
+def _start_request(session_id, token: CancellationToken):
+    """Ghi nhận request mới của phiên; request cũ còn chạy (vd: bấm "Gửi lại") bị huỷ."""
+    if not session_id:
+        return
+    with active_requests_lock:
+        previous = active_requests.get(session_id)
+        active_requests[session_id] = token
+    if previous is not None:
+        previous.cancel("superseded")
+
+
+def _finish_request(session_id, token: CancellationToken):
+    with active_requests_lock:
+        if active_requests.get(session_id) is token:
+            del active_requests[session_id]
+
+
+def chat_response_function(message, history, request: gr.Request):
     """
     Hàm này được Gradio gọi mỗi khi người dùng gửi một tin nhắn.
+    Mỗi tab trình duyệt có một session riêng để câu hỏi nối tiếp tái sử dụng
+    các tài liệu của lượt trước.
     """
     if pipeline is None:
         # Trả về thông báo lỗi nếu pipeline không khởi tạo được
-        return "Xin lỗi, chatbot hiện đang gặp sự cố kỹ thuật. Vui lòng thử lại sau."
-        
+        yield "Xin lỗi, chatbot hiện đang gặp sự cố kỹ thuật. Vui lòng thử lại sau."
+        return
+
+    session_id = request.session_hash if request else None
+    if session_id and not history:
+        # Cuộc trò chuyện mới: không dùng lại tài liệu của cuộc trò chuyện trước
+        pipeline.sessions.clear(session_id)
+
     # Gọi pipeline để lấy kết quả (bao gồm câu trả lời và nguồn)
-    result = pipeline.get_answer(message)
+    token = CancellationToken(REQUEST_DEADLINE_SECONDS)
+    _start_request(session_id, token)
+    future = answer_executor.submit(pipeline.get_answer, message, session_id=session_id, cancel_token=token)
+    try:
+        while True:
+            try:
+                result = future.result(timeout=POLL_SECONDS)
+                break
+            except FutureTimeoutError:
+                yield "⏳ Đang tìm câu trả lời..."
+    except GeneratorExit:
+        # Người dùng đã đóng tab hoặc rời trang: dừng request (LLM dừng ở token kế tiếp)
+        token.cancel("client_disconnected")
+        raise
+    except RequestCancelled:
+        # Đã có request mới hơn của cùng phiên thay thế request này
+        return
+    finally:
+        _finish_request(session_id, token)
+
     bot_response = result['answer']
+    if result.get('partial'):
+        bot_response += "\n\n*⏱️ Câu trả lời chưa đầy đủ do xử lý quá thời gian cho phép.*"
+    if result.get('tier', 'full') != 'full':
+        # Admission control đã giảm tải: cho người dùng biết câu trả lời ở chế độ rút gọn
+        bot_response += f"\n\n*⚡ Hệ thống đang có nhiều người hỏi, câu trả lời được tạo ở chế độ rút gọn ({result['tier']}).*"
     
     # Lấy thông tin nguồn và định dạng nó
     sources = result.get('sources', [])
@@ -50,8 +116,8 @@ def chat_response_function(message, history):
         for i, source in enumerate(sources):
             source_preview = source.replace('\n', ' ').strip()
             bot_response += f"\n1. *{source_preview[:150]}...*"
-            
-    return bot_response
+
+    yield bot_response
 
 # --- BƯỚC 4: TẠO GIAO DIỆN VỚI GRADIO ---
 chatbot_interface = gr.ChatInterface(
@@ -82,4 +148,8 @@ chatbot_interface = gr.ChatInterface(
 
 # --- BƯỚC 5: CHẠY ỨNG DỤNG ---
 if __name__ == "__main__":
+    if ADMISSION_ENABLED:
+        # Cho nhiều request vào pipeline cùng lúc để admission control thấy được hàng đợi và giảm tải;
+        # lượt sinh bằng LLM vẫn được giới hạn bởi ADMISSION_GENERATE_CONCURRENCY
+        chatbot_interface.queue(default_concurrency_limit=ADMISSION_GRADIO_CONCURRENCY)
     chatbot_interface.launch()
\ No newline at end of file
@@ -45,7 +45,8 @@ def run_interactive_chatbot():
             print("\n[🤖 BOT]: ⏳ Đang suy nghĩ...")
 
             # Gọi pipeline để lấy kết quả
-            result = pipeline.get_answer(question)
+            # Dùng một session cố định để câu hỏi nối tiếp tái sử dụng tài liệu của lượt trước
+            result = pipeline.get_answer(question, session_id="cli")
             answer = result['answer']
             sources = result['sources']
 
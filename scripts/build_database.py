@@ -1,7 +1,9 @@
 # scripts/build_database.py
 
 import chromadb
+import hashlib
 import json
+import os
 import sys
 from pathlib import Path
 
@@ -9,93 +11,269 @@ from pathlib import Path
 project_root = Path(__file__).resolve().parent.parent
 sys.path.append(str(project_root))
 
-from sentence_transformers import SentenceTransformer
 from src.chatbot.config import (
     PROCESSED_DATA_DIR,
+    VECTOR_STORE_DIR,
     CHROMA_PATH,
     COLLECTION_NAME,
-    EMBEDDING_MODEL_NAME,
-    DEVICE
+    CHUNK_MAX_TOKENS
 )
+from src.chatbot.embedding_cache import get_embedding_cache
+from src.chatbot.backends import load_embedder, load_token_counter, embedding_model_id
+from src.chatbot.chunking import chunk_document, chunk_documents
+from src.chatbot.document_store import DocumentStore, iter_documents, write_document_store
+from src.chatbot.index_registry import document_store_path
 
-def build_chroma_db():
-    """
-    Hàm này đọc các file dữ liệu đã xử lý, embedding chúng,
-    và import vào ChromaDB.
-    Nó sẽ kiểm tra trước để không xây dựng lại nếu database đã tồn tại.
-    """
-    # Bước 1: Kiểm tra xem DB và collection đã tồn tại chưa
-    if CHROMA_PATH.exists():
-        client = chromadb.PersistentClient(path=str(CHROMA_PATH))
-        try:
-            # Nếu lấy được collection mà không báo lỗi, nghĩa là nó đã tồn tại
-            if client.get_collection(name=COLLECTION_NAME):
-                print(f"✅ Cơ sở dữ liệu ChromaDB và collection '{COLLECTION_NAME}' đã tồn tại. Bỏ qua bước xây dựng.")
-                return # Thoát khỏi hàm, không làm gì thêm
-        except ValueError:
-            # Lỗi này có nghĩa là collection chưa tồn tại, chúng ta sẽ tiếp tục để tạo nó
-            print(f"   -> Database tồn tại nhưng collection '{COLLECTION_NAME}' chưa có. Bắt đầu tạo...")
-            pass
-    
-    # Nếu thư mục DB chưa tồn tại, hoặc collection chưa có, bắt đầu xây dựng
-    print("--- 🏗️ Bắt đầu xây dựng cơ sở dữ liệu ChromaDB ---")
-    
-    # Bước 2: Tải mô hình embedding
-    print(f"1. Đang tải Embedding Model: '{EMBEDDING_MODEL_NAME}'...")
-    embedder = SentenceTransformer(EMBEDDING_MODEL_NAME, device=DEVICE)
-
-    # Bước 3: Tải tất cả các tài liệu từ các file JSON đã làm giàu
-    all_docs = []
-    enriched_files = [
-        "majors_data_enriched.json",
-        "faculty_enriched.json",
-        "awards_enriched.json"
-    ]
-    print("2. Đang đọc các file dữ liệu đã làm giàu...")
-    for filename in enriched_files:
+ENRICHED_FILES = [
+    "majors_data_enriched.jsonl",
+    "faculty_enriched.jsonl",
+    "awards_enriched.jsonl"
+]
+BATCH_SIZE = 64
+
+
+def load_enriched_documents() -> list:
+    """Đọc tất cả tài liệu từ các kho JSONL đã làm giàu (bỏ qua id trùng lặp)."""
+    docs_by_id = {}
+    for filename in ENRICHED_FILES:
         file_path = PROCESSED_DATA_DIR / filename
-        if not file_path.exists():
+        count = 0
+        try:
+            for doc in iter_documents(file_path):
+                if doc['id'] in docs_by_id:
+                    print(f"   [Cảnh báo] Tài liệu trùng id '{doc['id']}', giữ bản ghi cuối cùng.")
+                docs_by_id[doc['id']] = doc
+                count += 1
+        except FileNotFoundError:
             print(f"   [Cảnh báo] Không tìm thấy file {file_path}, bỏ qua.")
             continue
-            
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            all_docs.extend(data)
-            print(f"   -> Đã đọc {len(data)} tài liệu từ {filename}.")
-    
+        print(f"   -> Đã đọc {count} tài liệu từ {filename}.")
+    return list(docs_by_id.values())
+
+
+def clean_metadata(metadata: dict) -> dict:
+    """Chuyển list -> string, None -> '' để tương thích với ChromaDB"""
+    cleaned = {}
+    for key, value in metadata.items():
+        if value is None or value == "Không có dữ liệu":
+            cleaned[key] = ""
+        elif isinstance(value, list):
+            cleaned[key] = ", ".join(map(str, value))
+        else:
+            cleaned[key] = value
+    return cleaned
+
+
+def document_hash(doc: dict) -> str:
+    """Hash nội dung + metadata của tài liệu để phát hiện thay đổi."""
+    payload = json.dumps(
+        {"content": doc['content'], "metadata": doc.get('metadata', {})},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def manifest_path(collection_name: str) -> Path:
+    return VECTOR_STORE_DIR / f"{collection_name}_manifest.json"
+
+
+def load_manifest(collection_name: str) -> dict:
+    """Đọc manifest (id -> hash nội dung) của collection, trả về None nếu chưa có."""
+    path = manifest_path(collection_name)
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(collection_name: str, doc_hashes: dict, doc_chunks: dict):
+    """Ghi manifest (hash và danh sách id chunk của từng tài liệu) một cách nguyên tử."""
+    path = manifest_path(collection_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "collection": collection_name,
+            "embedding_model": embedding_model_id(),
+            "chunk_max_tokens": CHUNK_MAX_TOKENS,
+            "documents": doc_hashes,
+            "chunks": doc_chunks
+        }, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def manifest_is_compatible(manifest: dict) -> bool:
+    """Manifest chỉ dùng lại được khi cùng mô hình embedding và cùng cấu hình chunking."""
+    return (
+        manifest is not None
+        and manifest.get("embedding_model") == embedding_model_id()
+        and manifest.get("chunk_max_tokens") == CHUNK_MAX_TOKENS
+        and "chunks" in manifest
+    )
+
+
+def write_collection_store(store_path: Path, all_docs: list, new_chunks: dict):
+    """
+    Ghi kho tài liệu của collection: mỗi tài liệu gốc một dòng, kèm danh sách nội dung
+    các chunk khi tài liệu bị chia (để RetrievalSystem lấy nội dung chunk và tài liệu gốc
+    mà không cần ChromaDB trả về documents). Chunk của tài liệu không đổi được chép từ kho cũ.
+    """
+    old_store = DocumentStore.open_if_exists(store_path)
+    count_tokens = None
+
+    def records():
+        nonlocal count_tokens
+        for doc in all_docs:
+            if doc['id'] in new_chunks:
+                chunks = [c['content'] for c in new_chunks[doc['id']]]
+            else:
+                previous = old_store.get(doc['id']) if old_store is not None else None
+                if previous is not None and previous['content'] == doc['content']:
+                    chunks = previous.get('chunks', [doc['content']])
+                else:
+                    # Kho cũ chưa có (index build trước khi có kho tài liệu): chia chunk lại
+                    if count_tokens is None:
+                        count_tokens = load_token_counter()
+                    chunks = [c['content'] for c in chunk_document(doc, count_tokens)]
+            record = {"id": doc['id'], "content": doc['content'], "metadata": doc.get('metadata', {})}
+            if len(chunks) > 1:
+                record["chunks"] = chunks
+            yield record
+
+    try:
+        return write_document_store(store_path, records())
+    finally:
+        if old_store is not None:
+            old_store.close()
+
+
+def collection_exists(client, collection_name: str) -> bool:
+    try:
+        client.get_collection(name=collection_name)
+        return True
+    except Exception:
+        # ValueError (chromadb cũ) hoặc NotFoundError (chromadb mới)
+        return False
+
+
+def collection_matches_manifest(client, collection_name: str, manifest: dict) -> bool:
+    """
+    Số chunk trong collection phải bằng số chunk ghi trong manifest. Manifest và kho tài liệu nằm
+    ngoài thư mục ChromaDB, nên khi thư mục này bị xoá (cách reset thường dùng) chúng vẫn còn.
+    """
+    try:
+        count = client.get_collection(name=collection_name).count()
+    except Exception:
+        # ValueError (chromadb cũ) hoặc NotFoundError (chromadb mới)
+        return False
+    return count == sum(len(chunk_ids) for chunk_ids in manifest["chunks"].values())
+
+
+def build_chroma_db(collection_name: str = COLLECTION_NAME, chroma_path: Path = CHROMA_PATH):
+    """
+    Hàm này đọc các file dữ liệu đã xử lý và đồng bộ chúng vào ChromaDB
+    một cách tăng dần: chỉ chia chunk, embedding (bằng embedder đang cấu hình) và upsert
+    các tài liệu mới hoặc đã thay đổi, đồng thời xoá các tài liệu không còn tồn tại.
+    Mỗi bản ghi trong collection là một chunk, metadata `parent_id` trỏ về tài liệu gốc.
+    Trạng thái được lưu trong manifest (id -> hash nội dung, id -> các id chunk).
+    Trả về True nếu collection đã được đồng bộ thành công.
+    """
+    print(f"--- 🏗️ Đồng bộ cơ sở dữ liệu ChromaDB (collection '{collection_name}') ---")
+
+    # Bước 1: Tải tất cả các tài liệu từ các file JSON đã làm giàu
+    print("1. Đang đọc các file dữ liệu đã làm giàu...")
+    all_docs = load_enriched_documents()
     if not all_docs:
         print("[LỖI] Không có tài liệu nào để import. Dừng lại.")
-        return
+        return False
+    print(f"   -> Tổng cộng có {len(all_docs)} tài liệu.")
 
-    print(f"   -> Tổng cộng có {len(all_docs)} tài liệu để import.")
+    # Bước 2: So sánh với manifest để tìm các thay đổi
+    client = chromadb.PersistentClient(path=str(chroma_path))
+    manifest = load_manifest(collection_name)
+    compatible = manifest_is_compatible(manifest)
+    if compatible and not collection_matches_manifest(client, collection_name, manifest):
+        print("   -> Collection trong ChromaDB không khớp với manifest (vd: thư mục ChromaDB đã bị xoá).")
+        compatible = False
+    if not compatible:
+        # Không biết collection hiện có được embedding/chia chunk thế nào -> xây dựng lại toàn bộ
+        if collection_exists(client, collection_name):
+            print("   -> Chưa có manifest hoặc mô hình embedding/cấu hình chunking đã thay đổi. Xây dựng lại toàn bộ collection...")
+            client.delete_collection(name=collection_name)
+        indexed_hashes, indexed_chunks = {}, {}
+    else:
+        indexed_hashes, indexed_chunks = manifest["documents"], manifest["chunks"]
 
-    # Bước 4: Chuẩn bị dữ liệu cho ChromaDB
-    ids = [doc['id'] for doc in all_docs]
-    documents = [doc['content'] for doc in all_docs]
-    metadatas = [doc['metadata'] for doc in all_docs]
+    current_hashes = {doc['id']: document_hash(doc) for doc in all_docs}
+    changed_docs = [doc for doc in all_docs if indexed_hashes.get(doc['id']) != current_hashes[doc['id']]]
+    removed_ids = [doc_id for doc_id in indexed_hashes if doc_id not in current_hashes]
 
-    # Bước 5: Tạo client, collection, và thêm dữ liệu
-    print("3. Đang tạo collection và import dữ liệu vào ChromaDB (có thể mất vài phút)...")
-    client = chromadb.PersistentClient(path=str(CHROMA_PATH))
     collection = client.get_or_create_collection(
-        name=COLLECTION_NAME,
-        # (Tùy chọn) Metadata để chỉ định mô hình embedding đã sử dụng
-        metadata={"embedding_model": EMBEDDING_MODEL_NAME}
+        name=collection_name,
+        # Metadata để chỉ định mô hình embedding đã sử dụng
+        metadata={"embedding_model": embedding_model_id()}
     )
-    
-    # Thêm dữ liệu theo từng batch nhỏ để tránh quá tải bộ nhớ trên các môi trường yếu
-    batch_size = 64
-    for i in range(0, len(ids), batch_size):
-        end_index = i + batch_size
-        print(f"   -> Đang import batch từ {i} đến {end_index-1}...")
-        collection.add(
-            ids=ids[i:end_index],
-            documents=documents[i:end_index],
-            metadatas=metadatas[i:end_index]
-        )
-    
-    print(f"--- ✅ Xây dựng và import dữ liệu vào collection '{COLLECTION_NAME}' hoàn tất! ---")
+
+    store_path = document_store_path(chroma_path, collection_name)
+    print(f"2. Thay đổi: {len(changed_docs)} tài liệu mới/cập nhật, {len(removed_ids)} tài liệu bị xoá.")
+    if not changed_docs and not removed_ids and store_path.exists():
+        print(f"✅ Collection '{collection_name}' đã được cập nhật mới nhất. Bỏ qua bước xây dựng.")
+        return True
+
+    # Bước 3: Chia chunk các tài liệu mới/đã thay đổi theo ngân sách token
+    new_chunks = {}
+    if changed_docs:
+        print(f"3. Đang chia chunk (tối đa {CHUNK_MAX_TOKENS} token/chunk)...")
+        new_chunks = chunk_documents(changed_docs, load_token_counter())
+        n_chunks = sum(len(chunks) for chunks in new_chunks.values())
+        print(f"   -> {len(changed_docs)} tài liệu -> {n_chunks} chunk.")
+
+    doc_chunks = {doc_id: indexed_chunks.get(doc_id, []) for doc_id in current_hashes}
+    doc_chunks.update({doc_id: [c['id'] for c in chunks] for doc_id, chunks in new_chunks.items()})
+
+    # Bước 4: Xoá chunk của tài liệu đã bị xoá và chunk thừa của tài liệu bị thu ngắn
+    stale_ids = [chunk for doc_id in removed_ids for chunk in indexed_chunks.get(doc_id, [doc_id])]
+    for doc_id in new_chunks:
+        stale_ids.extend(set(indexed_chunks.get(doc_id, [])) - set(doc_chunks[doc_id]))
+    for i in range(0, len(stale_ids), BATCH_SIZE):
+        collection.delete(ids=stale_ids[i:i + BATCH_SIZE])
+
+    # Bước 5: Embedding (qua cache trên đĩa) và upsert chunk của các tài liệu mới hoặc đã thay đổi
+    changed_chunks = [chunk for chunks in new_chunks.values() for chunk in chunks]
+    if changed_chunks:
+        cache = get_embedding_cache(embedding_model_id())
+        embedder = None
+
+        def encode_missing(texts):
+            # Chỉ tải mô hình khi có văn bản chưa nằm trong cache
+            nonlocal embedder
+            if embedder is None:
+                print(f"   -> Đang tải Embedding Model: '{embedding_model_id()}'...")
+                embedder = load_embedder()
+            return embedder.encode(texts, batch_size=BATCH_SIZE, convert_to_numpy=True)
+
+        print("4. Đang embedding và upsert dữ liệu vào ChromaDB...")
+        for i in range(0, len(changed_chunks), BATCH_SIZE):
+            batch = changed_chunks[i:i + BATCH_SIZE]
+            documents = [doc['content'] for doc in batch]
+            embeddings = cache.get_or_compute(documents, encode_missing)
+            collection.upsert(
+                ids=[doc['id'] for doc in batch],
+                embeddings=embeddings.tolist(),
+                documents=documents,
+                metadatas=[clean_metadata(doc.get('metadata', {})) for doc in batch]
+            )
+            print(f"   -> Đã upsert {min(i + BATCH_SIZE, len(changed_chunks))}/{len(changed_chunks)} chunk.")
+
+    # Bước 6: Ghi kho tài liệu (JSONL + chỉ mục offset) phục vụ nội dung cho reranker và prompt
+    n_stored = write_collection_store(store_path, all_docs, new_chunks)
+    print(f"5. Đã ghi {n_stored} tài liệu vào kho {store_path.name}.")
+
+    # Bước 7: Ghi manifest sau khi đồng bộ thành công
+    save_manifest(collection_name, current_hashes, doc_chunks)
+    print(f"--- ✅ Đồng bộ collection '{collection_name}' hoàn tất! ---")
+    return True
 
 # Cho phép chạy file này độc lập để test
 if __name__ == '__main__':
-    build_chroma_db()
\ No newline at end of file
+    build_chroma_db()
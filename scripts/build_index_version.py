@@ -0,0 +1,148 @@
+# scripts/build_index_version.py
+
+import argparse
+import json
+import shutil
+import sys
+from pathlib import Path
+
+# Thêm thư mục gốc vào Python Path để có thể import từ src và scripts
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import chromadb
+
+from src.chatbot.config import (
+    EVAL_SET_PATH,
+    EVAL_TOP_K,
+    INDEX_VALIDATION_MIN_HIT_RATE,
+    INDEX_VERSIONS_DIR,
+    INDEX_VERSIONS_TO_KEEP
+)
+from src.chatbot.embedding_cache import get_embedding_cache
+from src.chatbot.backends import load_embedder, embedding_model_id
+from src.chatbot import index_registry
+from scripts.build_database import build_chroma_db, manifest_path
+
+
+def validate_version(version_name: str) -> dict:
+    """Đo Hit Rate@EVAL_TOP_K của phiên bản index trên evaluation_set.json."""
+    with open(EVAL_SET_PATH, 'r', encoding='utf-8') as f:
+        eval_data = json.load(f)
+
+    cache = get_embedding_cache(embedding_model_id())
+    embedder = None
+
+    def encode_missing(texts):
+        nonlocal embedder
+        if embedder is None:
+            embedder = load_embedder()
+        return embedder.encode(texts, batch_size=64, convert_to_numpy=True)
+
+    query_embeddings = cache.get_or_compute([item['query'] for item in eval_data], encode_missing)
+
+    client = chromadb.PersistentClient(path=str(index_registry.version_chroma_path(version_name)))
+    collection = client.get_collection(name=version_name)
+    results = collection.query(query_embeddings=query_embeddings.tolist(), n_results=EVAL_TOP_K, include=["metadatas"])
+
+    # Index chứa chunk: so sánh theo id tài liệu gốc
+    hits = sum(
+        1 for item, ids, metadatas in zip(eval_data, results['ids'], results['metadatas'])
+        if item['expected_doc_id'] in {(m or {}).get('parent_id', i) for i, m in zip(ids, metadatas)}
+    )
+    hit_rate = hits / len(eval_data) if eval_data else 0.0
+    return {
+        "hit_rate_at_k": hit_rate,
+        "top_k": EVAL_TOP_K,
+        "n_queries": len(eval_data),
+        "passed": hit_rate >= INDEX_VALIDATION_MIN_HIT_RATE
+    }
+
+
+def prune_versions():
+    """Xoá các phiên bản cũ, giữ lại INDEX_VERSIONS_TO_KEEP bản mới nhất và các bản còn trong con trỏ."""
+    pointer = index_registry.read_pointer() or {}
+    protected = {entry["collection"] for entry in [pointer.get("current")] + pointer.get("history", []) if entry}
+    protected.update(index_registry.list_versions()[:INDEX_VERSIONS_TO_KEEP])
+    for version_name in index_registry.list_versions():
+        if version_name not in protected:
+            print(f"   -> Xoá phiên bản cũ: {version_name}")
+            shutil.rmtree(INDEX_VERSIONS_DIR / version_name)
+            # Manifest của build_database nằm ở VECTOR_STORE_DIR, không nằm trong thư mục phiên bản
+            manifest_path(version_name).unlink(missing_ok=True)
+
+
+def build_new_version(promote: bool) -> bool:
+    """Build một phiên bản index mới trong thư mục riêng, kiểm tra chất lượng rồi promote."""
+    version_name = index_registry.new_version_name()
+    chroma_path = index_registry.version_chroma_path(version_name)
+    print(f"--- 🏗️ Đang build phiên bản index mới: {version_name} ---")
+
+    # Server vẫn phục vụ phiên bản hiện tại trong lúc build (thư mục ChromaDB tách biệt)
+    if not build_chroma_db(collection_name=version_name, chroma_path=chroma_path):
+        print("[LỖI] Build phiên bản index thất bại.")
+        return False
+
+    print(f"--- 🔎 Đang kiểm tra phiên bản '{version_name}' trên {EVAL_SET_PATH.name} ---")
+    validation = validate_version(version_name)
+    print(f"   -> Hit Rate@{validation['top_k']}: {validation['hit_rate_at_k']:.2%} "
+          f"(ngưỡng: {INDEX_VALIDATION_MIN_HIT_RATE:.2%})")
+    if not validation["passed"]:
+        print(f"[LỖI] Phiên bản '{version_name}' không đạt ngưỡng chất lượng, không promote.")
+        return False
+
+    if promote:
+        index_registry.promote(version_name, validation)
+        print(f"✅ Đã chuyển alias sang '{version_name}'. Server sẽ tự động sử dụng phiên bản mới.")
+        prune_versions()
+    else:
+        print(f"✅ Phiên bản '{version_name}' hợp lệ. Chạy 'promote {version_name}' để đưa vào sử dụng.")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quản lý các phiên bản index ChromaDB.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build, kiểm tra và promote một phiên bản mới.")
+    build_parser.add_argument("--no-promote", action="store_true", help="Chỉ build và kiểm tra, không chuyển alias.")
+
+    promote_parser = subparsers.add_parser("promote", help="Chuyển alias sang một phiên bản đã build.")
+    promote_parser.add_argument("version")
+    promote_parser.add_argument("--skip-validation", action="store_true")
+
+    subparsers.add_parser("rollback", help="Quay lại phiên bản trước đó.")
+    subparsers.add_parser("list", help="Liệt kê các phiên bản đã build.")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        ok = build_new_version(promote=not args.no_promote)
+        sys.exit(0 if ok else 1)
+
+    elif args.command == "promote":
+        validation = None
+        if not args.skip_validation:
+            validation = validate_version(args.version)
+            if not validation["passed"]:
+                print(f"[LỖI] Hit Rate@{validation['top_k']} = {validation['hit_rate_at_k']:.2%} thấp hơn ngưỡng.")
+                sys.exit(1)
+        index_registry.promote(args.version, validation)
+        print(f"✅ Đã chuyển alias sang '{args.version}'.")
+
+    elif args.command == "rollback":
+        previous = index_registry.rollback()
+        if previous is None:
+            print("[LỖI] Không có phiên bản trước đó để rollback.")
+            sys.exit(1)
+        print(f"✅ Đã rollback về phiên bản '{previous}'.")
+
+    elif args.command == "list":
+        _, active_name = index_registry.get_active_index()
+        for version_name in index_registry.list_versions():
+            marker = "*" if version_name == active_name else " "
+            print(f" {marker} {version_name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# scripts/build_sft_dataset.py
+
+import hashlib
+import json
+import sys
+import time
+from pathlib import Path
+
+# Thêm thư mục gốc vào Python Path để import config
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from transformers import AutoTokenizer
+from src.chatbot.config import PROCESSED_DATA_DIR, LLM_MODEL_NAME, SFT_DATASET_DIR, SFT_MAX_SEQ_LENGTH
+from src.chatbot.sft_dataset import IGNORE_INDEX, MANIFEST_NAME, write_packed_split
+
+# --- CẤU HÌNH ---
+SPLITS = {
+    "train": PROCESSED_DATA_DIR / "qa.jsonl",
+    "eval": PROCESSED_DATA_DIR / "eval.jsonl"
+}
+
+
+def manifest_paths():
+    return [SFT_DATASET_DIR / split / MANIFEST_NAME for split in SPLITS]
+
+
+def file_sha256(path: Path) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def tokenize_example(tokenizer, messages):
+    """
+    Áp chat template của Phi-3 cho một hội thoại và tokenize. Loss chỉ tính trên câu trả lời
+    của assistant (kể cả token kết thúc <|end|>): mọi token của phần prompt (system, user,
+    '<|assistant|>') có nhãn IGNORE_INDEX.
+    """
+    prompt_ids = tokenizer.apply_chat_template(messages[:-1], tokenize=True, add_generation_prompt=True)
+    full_ids = tokenizer.apply_chat_template(messages, tokenize=True)
+    if full_ids[:len(prompt_ids)] != prompt_ids:
+        raise ValueError("Chat template không giữ nguyên phần prompt khi thêm câu trả lời; không thể tạo loss mask.")
+    labels = [IGNORE_INDEX] * len(prompt_ids) + full_ids[len(prompt_ids):]
+    return full_ids, labels
+
+
+def build_split(tokenizer, split: str, source_path: Path, max_length: int) -> dict:
+    examples, skipped = [], 0
+    with open(source_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            ids, labels = tokenize_example(tokenizer, json.loads(line)["messages"])
+            # Cắt bớt sẽ làm mất câu trả lời (nằm ở cuối), nên bỏ hẳn mẫu quá dài
+            if len(ids) > max_length:
+                skipped += 1
+                continue
+            examples.append((ids, labels))
+
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    return write_packed_split(SFT_DATASET_DIR / split, examples, max_length, pad_token_id, {
+        "split": split,
+        "source": source_path.name,
+        "source_sha256": file_sha256(source_path),
+        "tokenizer": LLM_MODEL_NAME,
+        "skipped_too_long": skipped,
+    })
+
+
+def main(max_length: int = SFT_MAX_SEQ_LENGTH):
+    print("--- Bắt đầu tạo dữ liệu SFT đã tokenize và ghép chuỗi ---")
+    start = time.perf_counter()
+    print(f"1. Đang tải tokenizer: '{LLM_MODEL_NAME}'...")
+    tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_NAME)
+
+    for split, source_path in SPLITS.items():
+        if not source_path.exists():
+            print(f"[Cảnh báo] Không tìm thấy file {source_path.name}, bỏ qua split '{split}'.")
+            continue
+        print(f"2. Đang xử lý {source_path.name} -> {SFT_DATASET_DIR / split}...")
+        manifest = build_split(tokenizer, split, source_path, max_length)
+        print(f"   -> {manifest['n_examples']} mẫu ({manifest['n_tokens']} token, {manifest['n_loss_tokens']} token tính loss) "
+              f"ghép thành {manifest['n_sequences']} chuỗi x {max_length} token, lấp đầy {manifest['fill_ratio']:.1%}.")
+        if manifest["skipped_too_long"]:
+            print(f"   -> [Cảnh báo] Bỏ qua {manifest['skipped_too_long']} mẫu dài hơn {max_length} token.")
+
+    print(f"\n--- ✅ Hoàn tất trong {time.perf_counter() - start:.1f}s! ---")
+
+
+if __name__ == "__main__":
+    main()
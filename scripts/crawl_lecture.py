@@ -1,47 +1,168 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options # Thêm import này
-from bs4 import BeautifulSoup
-import pandas as pd
+# scripts/crawl_lecture.py
+
+import argparse
+import asyncio
+import csv
+import gzip
+import hashlib
+import json
+import os
 import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
 
-# ----- Cải tiến: Thêm Options cho Chrome để tăng tính ổn định -----
-chrome_options = Options()
-# chrome_options.add_argument("--headless") # Bỏ comment dòng này nếu bạn muốn chạy ẩn, không hiện trình duyệt
-chrome_options.add_argument("--start-maximized")
-chrome_options.add_argument("--disable-extensions")
-chrome_options.add_argument("--disable-gpu")
-chrome_options.add_argument("--no-sandbox")
-chrome_options.add_argument("--disable-dev-shm-usage")
-# Tùy chọn để tránh bị phát hiện là bot
-chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-chrome_options.add_experimental_option('useAutomationExtension', False)
-# Giảm bớt log không cần thiết trên console
-chrome_options.add_argument('--log-level=3') 
-
-# Khởi tạo webdriver với các tùy chọn đã thiết lập
-driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-
-url = "https://duytan.edu.vn/tuyen-sinh"
-driver.get(url)
-
-# ----- XỬ LÝ POP-UP -----
-try:
-    close_button_main = WebDriverWait(driver, 15).until(
-        EC.element_to_be_clickable((By.CSS_SELECTOR, "div.vex-close"))
-    )
-    close_button_main.click()
-    print("✅ Đã đóng pop-up quảng cáo chính.")
-    time.sleep(1)
-except Exception as e:
-    print("ℹ️ Không tìm thấy pop-up quảng cáo chính hoặc nó không xuất hiện.")
+import aiohttp
+from bs4 import BeautifulSoup
 
-# ----- ĐIỀU HƯỚNG TỚI TRANG NGÀNH NGHỀ -----
 try:
+    # Selenium chỉ cần cho trang danh sách ngành (được sinh bằng JavaScript)
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.chrome.options import Options
+except ImportError:
+    webdriver = None
+
+project_root = Path(__file__).resolve().parent.parent
+
+# --- CẤU HÌNH MẶC ĐỊNH ---
+BASE_URL = "https://duytan.edu.vn"
+INDEX_PATH = "/tuyen-sinh"
+DETAIL_PAGE_PREFIX = "/tuyen-sinh/Page/"
+OUTPUT_PATH = "tat_ca_chuyen_nganh_final.csv"  # .csv hoặc .jsonl, ghi tăng dần
+HTTP_CACHE_DIR = project_root / "data" / "crawl_cache"  # ETag/Last-Modified của trang đã tải
+SNAPSHOT_DIR = project_root / "data" / "crawl_snapshots"  # HTML thô (gzip) + manifest checkpoint
+CONCURRENCY = 8             # Số request chi tiết đồng thời
+REQUESTS_PER_SECOND = 4.0   # Giới hạn tốc độ cho mỗi host
+REQUEST_TIMEOUT = 20
+MAX_RETRIES = 3
+USER_AGENT = "Mozilla/5.0 (compatible; DTU-Chatbot-Crawler/1.0)"
+
+COLUMNS = [
+    "Trường", "Bậc đào tạo", "Ngành", "Mã ngành",
+    "Tên chuyên ngành", "Mã chuyên ngành", "Tổ hợp môn",
+    "Mô tả", "Link chi tiết"
+]
+
+
+# ------------------ PARSE (không phụ thuộc cách tải trang) ------------------
+
+def parse_index(html: str, base_url: str = BASE_URL) -> List[dict]:
+    """Đọc trang 'NGÀNH NGHỀ ĐÀO TẠO': trả về danh sách {truong, bac_dao_tao, nganh, link}."""
+    soup = BeautifulSoup(html, "html.parser")
+    entries = []
+    for block in soup.select(".nganhnghe-wp"):
+        truong = block.select_one(".name-box .name-title").get_text(strip=True)
+        for accordion in block.select(".accordion__item"):
+            bac_dao_tao = accordion.select_one(".nganhnghe-list-header").get_text(strip=True)
+            for li in accordion.select("ul li a"):
+                link = li.get("href")
+                if not link:
+                    continue
+                if link.startswith("/"):
+                    link = base_url + link
+                entries.append({
+                    "truong": truong,
+                    "bac_dao_tao": bac_dao_tao,
+                    "nganh": li.get_text(strip=True),
+                    "link": link
+                })
+    return entries
+
+
+def parse_detail(html: str, entry: dict, base_url: str = BASE_URL) -> Optional[List[list]]:
+    """
+    Đọc trang chi tiết một ngành: mã ngành, tổ hợp môn (dòng 3 của bảng) và các khối
+    "Mã chuyên ngành:" kèm đoạn mô tả ngay sau. Trả về None nếu trang không có nội dung.
+    """
+    sub_soup = BeautifulSoup(html, "html.parser")
+    box = sub_soup.select_one("div.box_news_detail")
+    if not box:
+        return None
+
+    truong, bac_dao_tao, nganh = entry["truong"], entry["bac_dao_tao"], entry["nganh"]
+    ma_nganh = ""
+    to_hop = ""
+    table = box.select_one("table")
+    if table:
+        data_row = table.select_one("tr:nth-of-type(3)")
+        if data_row:
+            cols = data_row.select("td")
+            if len(cols) >= 3:
+                ma_nganh_tag = cols[1].select_one("strong")
+                if ma_nganh_tag:
+                    ma_nganh = ma_nganh_tag.get_text(strip=True)
+                else:
+                    ma_nganh = cols[1].get_text(strip=True).split("(")[0]
+                to_hop = cols[2].get_text(" ", strip=True)
+
+    desc_blocks = box.find_all(['p', 'div'], string=lambda t: t and "Mã chuyên ngành:" in t)
+    if not desc_blocks:
+        return [[truong, bac_dao_tao, nganh, ma_nganh, "", "", to_hop, "", entry["link"]]]
+
+    rows = []
+    for blk in desc_blocks:
+        text = blk.get_text(" ", strip=True)
+        ten_cn = text.split("(")[0].replace("*", "").strip()
+        ma_cn = text.split("Mã chuyên ngành:")[-1].replace(")", "").strip()
+
+        mo_ta_tag = blk.find_next_sibling("p")
+        mo_ta = mo_ta_tag.get_text(" ", strip=True) if mo_ta_tag else ""
+
+        link_detail = ""
+        if mo_ta_tag:
+            a_tag = mo_ta_tag.find("a")
+            if a_tag and a_tag.has_attr("href"):
+                href = a_tag["href"]
+                link_detail = href if href.startswith("http") else f"{base_url}{DETAIL_PAGE_PREFIX}{href}"
+
+        rows.append([truong, bac_dao_tao, nganh, ma_nganh, ten_cn, ma_cn, to_hop, mo_ta, link_detail])
+    return rows
+
+
+# ------------------ SELENIUM ------------------
+
+def create_driver():
+    if webdriver is None:
+        raise RuntimeError("Chưa cài selenium/webdriver-manager; dùng --index-source http cho trang tĩnh.")
+    # ----- Cải tiến: Thêm Options cho Chrome để tăng tính ổn định -----
+    chrome_options = Options()
+    # chrome_options.add_argument("--headless") # Bỏ comment dòng này nếu bạn muốn chạy ẩn, không hiện trình duyệt
+    chrome_options.add_argument("--start-maximized")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    # Tùy chọn để tránh bị phát hiện là bot
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    # Giảm bớt log không cần thiết trên console
+    chrome_options.add_argument('--log-level=3')
+    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+
+
+def open_index_with_selenium(driver, base_url: str) -> str:
+    """Mở trang tuyển sinh, đóng pop-up và điều hướng tới danh sách ngành; trả về HTML."""
+    driver.get(base_url + INDEX_PATH)
+
+    # ----- XỬ LÝ POP-UP -----
+    try:
+        close_button_main = WebDriverWait(driver, 15).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, "div.vex-close"))
+        )
+        close_button_main.click()
+        print("✅ Đã đóng pop-up quảng cáo chính.")
+        time.sleep(1)
+    except Exception:
+        print("ℹ️ Không tìm thấy pop-up quảng cáo chính hoặc nó không xuất hiện.")
+
+    # ----- ĐIỀU HƯỚNG TỚI TRANG NGÀNH NGHỀ -----
     print("Đang tìm và click vào mục 'NGÀNH NGHỀ ĐÀO TẠO'...")
     nganh_nghe_link = WebDriverWait(driver, 10).until(
         EC.element_to_be_clickable((By.LINK_TEXT, "NGÀNH NGHỀ ĐÀO TẠO"))
@@ -52,107 +173,417 @@ try:
         EC.presence_of_element_located((By.CSS_SELECTOR, ".nganhnghe-wp"))
     )
     print("✅ Trang danh sách ngành nghề đã tải xong.")
-except Exception as e:
-    print(f"❌ Lỗi: Không thể click vào mục 'NGÀNH NGHỀ ĐÀO TẠO'. {e}")
-    driver.quit()
-    exit()
-
-soup = BeautifulSoup(driver.page_source, "html.parser")
-data = []
-
-# ------------------ B1: Crawl danh sách ngành ------------------
-for block in soup.select(".nganhnghe-wp"):
-    truong = block.select_one(".name-box .name-title").get_text(strip=True)
-    for accordion in block.select(".accordion__item"):
-        bac_dao_tao = accordion.select_one(".nganhnghe-list-header").get_text(strip=True)
-        for li in accordion.select("ul li a"):
-            nganh = li.get_text(strip=True)
-            link = li.get("href")
-            if link and link.startswith("/"):
-                link = "https://duytan.edu.vn" + link
-            
-            if not link:
-                continue
+    return driver.page_source
+
 
-            # ------------------ B2: Crawl chi tiết ngành ------------------
-            try:
-                driver.get(link)
+def crawl_details_selenium(driver, entries: List[dict], base_url: str, store: "SnapshotStore",
+                           run_id: str, writer: "RowWriter", done: Dict[str, str]):
+    """Chế độ cũ: mở lần lượt từng trang chi tiết bằng trình duyệt."""
+    for entry in entries:
+        try:
+            if entry["link"] in done:
+                html = store.get(done[entry["link"]])
+            else:
+                driver.get(entry["link"])
                 # Tăng thời gian chờ lên 20 giây để xử lý các trang tải chậm
                 WebDriverWait(driver, 20).until(
                     EC.presence_of_element_located((By.CSS_SELECTOR, "div.box_news_detail"))
                 )
-                sub_soup = BeautifulSoup(driver.page_source, "html.parser")
-                box = sub_soup.select_one("div.box_news_detail")
-                
-                # Logic lấy dữ liệu vẫn giữ nguyên vì nó đã đủ linh hoạt
-                # để xử lý các trang không có bảng hoặc không có chuyên ngành
-                if not box:
-                    print(f"❌ Không tìm thấy box_news_detail: {link}")
-                    continue
+                html = driver.page_source
+                store.checkpoint(run_id, "detail", entry["link"], store.put(html))
+            rows = parse_detail(html, entry, base_url)
+            if rows is None:
+                print(f"❌ Không tìm thấy box_news_detail: {entry['link']}")
+                continue
+            writer.write_rows(rows)
+        except Exception as e:
+            # Lỗi này giờ chủ yếu sẽ là TimeoutException nếu trang tải quá lâu
+            print(f"⚠️ Lỗi khi crawl chi tiết hoặc timeout: {entry['link']}, {e}")
 
-                ma_nganh = ""
-                to_hop = ""
-                table = box.select_one("table")
-                if table:
-                    data_row = table.select_one("tr:nth-of-type(3)")
-                    if data_row:
-                        cols = data_row.select("td")
-                        if len(cols) >= 3:
-                            ma_nganh_tag = cols[1].select_one("strong")
-                            if ma_nganh_tag:
-                                ma_nganh = ma_nganh_tag.get_text(strip=True)
-                            else:
-                                ma_nganh = cols[1].get_text(strip=True).split("(")[0]
-                            to_hop = cols[2].get_text(" ", strip=True)
-
-                desc_blocks = box.find_all(['p', 'div'], string=lambda t: t and "Mã chuyên ngành:" in t)
-                
-                if not desc_blocks:
-                    data.append([
-                        truong, bac_dao_tao, nganh, ma_nganh,
-                        "", "", to_hop, "", link
-                    ])
-                    continue
 
-                for blk in desc_blocks:
-                    text = blk.get_text(" ", strip=True)
-                    ten_cn = text.split("(")[0].replace("*", "").strip()
+# ------------------ SNAPSHOT + GHI KẾT QUẢ ------------------
+
+def snapshot_path(snapshot_dir: Path, digest: str) -> Path:
+    return Path(snapshot_dir) / "objects" / digest[:2] / f"{digest}.html.gz"
+
+
+class SnapshotStore:
+    """
+    Kho HTML thô đã tải, đánh địa chỉ theo nội dung: mỗi trang được nén gzip tại
+    objects/<2 ký tự đầu>/<sha256>.html.gz, trang không đổi giữa các lần crawl chỉ lưu
+    một lần. manifest.jsonl được nối thêm một dòng mỗi khi tải xong một trang: đó là
+    checkpoint để chạy tiếp sau sự cố (--resume) và để dựng lại kết quả không cần mạng (--reparse).
+    """
+    def __init__(self, root: Path = SNAPSHOT_DIR):
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.manifest_path = self.root / "manifest.jsonl"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        # Tiến trình bị dừng giữa lúc ghi có thể để lại dòng cuối dở dang: xuống dòng để không ghi đè lên nó
+        if self.manifest_path.exists() and self.manifest_path.stat().st_size:
+            with open(self.manifest_path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+    def _object_path(self, digest: str) -> Path:
+        return snapshot_path(self.root, digest)
+
+    def put(self, html: str) -> str:
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_suffix(".gz.tmp")
+            tmp_path.write_bytes(gzip.compress(data, compresslevel=6))
+            os.replace(tmp_path, path)
+        return digest
+
+    def has(self, digest: str) -> bool:
+        return self._object_path(digest).exists()
+
+    def get(self, digest: str) -> str:
+        return gzip.decompress(self._object_path(digest).read_bytes()).decode("utf-8")
+
+    def checkpoint(self, run_id: str, kind: str, url: str, digest: str):
+        record = {"run": run_id, "kind": kind, "url": url, "sha256": digest, "fetched_at": time.time()}
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def load_run(self, run_id: Optional[str] = None) -> Optional[dict]:
+        """
+        Đọc manifest của lần crawl `run_id` (mặc định: lần gần nhất). Trả về
+        {"run", "index_url", "index", "pages": {url: sha256}} hoặc None nếu chưa có.
+        """
+        records = []
+        if self.manifest_path.exists():
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                for line in f:
                     try:
-                        ma_cn = text.split("Mã chuyên ngành:")[-1].replace(")", "").strip()
-                    except:
-                        ma_cn = ""
-                    
-                    mo_ta_tag = blk.find_next_sibling("p")
-                    mo_ta = mo_ta_tag.get_text(" ", strip=True) if mo_ta_tag else ""
-                    
-                    link_detail = ""
-                    if mo_ta_tag:
-                        a_tag = mo_ta_tag.find("a")
-                        if a_tag and a_tag.has_attr("href"):
-                            href = a_tag["href"]
-                            if not href.startswith("http"):
-                                link_detail = f"https://duytan.edu.vn/tuyen-sinh/Page/{href}"
-                            else:
-                                link_detail = href
-                    
-                    data.append([
-                        truong, bac_dao_tao, nganh, ma_nganh,
-                        ten_cn, ma_cn, to_hop, mo_ta, link_detail
-                    ])
-
-            except Exception as e:
-                # Lỗi này giờ chủ yếu sẽ là TimeoutException nếu trang tải quá lâu
-                print(f"⚠️ Lỗi khi crawl chi tiết hoặc timeout: {link}, {e}")
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # dòng bị cắt dở
+        if run_id is None:
+            if not records:
+                return None
+            run_id = records[-1]["run"]
+        run = {"run": run_id, "index_url": None, "index": None, "pages": {}}
+        for record in records:
+            if record["run"] != run_id:
                 continue
+            if record["kind"] == "index":
+                run["index_url"], run["index"] = record["url"], record["sha256"]
+            else:
+                run["pages"][record["url"]] = record["sha256"]
+        return run if run["index"] or run["pages"] else None
 
-driver.quit()
 
-# ------------------ B3: Xuất dữ liệu ------------------
-df = pd.DataFrame(data, columns=[
-    "Trường", "Bậc đào tạo", "Ngành", "Mã ngành",
-    "Tên chuyên ngành", "Mã chuyên ngành", "Tổ hợp môn",
-    "Mô tả", "Link chi tiết"
-])
-df.drop_duplicates(inplace=True)
-df.to_excel("tat_ca_chuyen_nganh_final.xlsx", index=False, engine="openpyxl")
-print(" Đã crawl xong, lưu file tat_ca_chuyen_nganh_final.xlsx")
\ No newline at end of file
+class RowWriter:
+    """
+    Ghi kết quả tăng dần ra CSV (utf-8-sig, mở được bằng Excel) hoặc JSONL (theo đuôi
+    file) và flush sau mỗi trang, nên dừng giữa chừng vẫn giữ được phần đã crawl. Bỏ dòng trùng.
+    """
+    def __init__(self, output_path: str):
+        self.path = Path(output_path)
+        self.is_jsonl = self.path.suffix == ".jsonl"
+        self._file = open(self.path, "w", encoding="utf-8" if self.is_jsonl else "utf-8-sig", newline="")
+        self._seen = set()
+        self.count = 0
+        if not self.is_jsonl:
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(COLUMNS)
+
+    def write_rows(self, rows: List[list]):
+        for row in rows:
+            key = tuple(row)
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            if self.is_jsonl:
+                self._file.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n")
+            else:
+                self._csv.writerow(row)
+            self.count += 1
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# ------------------ HTTP BẤT ĐỒNG BỘ ------------------
+
+class HttpCache:
+    """
+    Cache cho request có điều kiện: mỗi URL giữ ETag/Last-Modified của lần tải trước
+    và sha256 của nội dung trong SnapshotStore; các header được gửi lại dưới dạng
+    If-None-Match/If-Modified-Since, máy chủ trả 304 thì dùng lại snapshot cũ.
+    """
+    def __init__(self, cache_dir: Path, store: SnapshotStore):
+        self.dir = Path(cache_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.store = store
+
+    def _meta_path(self, url: str) -> Path:
+        return self.dir / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json"
+
+    def _load_meta(self, url: str) -> Optional[dict]:
+        meta_path = self._meta_path(url)
+        if not meta_path.exists():
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return meta if meta.get("sha256") and self.store.has(meta["sha256"]) else None
+
+    def conditional_headers(self, url: str) -> dict:
+        meta = self._load_meta(url)
+        headers = {}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def load(self, url: str) -> str:
+        return self.store.get(self._load_meta(url)["sha256"])
+
+    def save(self, url: str, body: str, etag: Optional[str], last_modified: Optional[str]):
+        meta = {"url": url, "etag": etag, "last_modified": last_modified, "sha256": self.store.put(body)}
+        meta_path = self._meta_path(url)
+        tmp_meta = meta_path.with_suffix(".json.tmp")
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_meta, meta_path)
+
+
+class HostRateLimiter:
+    """Giới hạn số request mỗi giây cho từng host (các request được giãn đều theo thời gian)."""
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_slot = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, url: str):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def fetch_page(session: aiohttp.ClientSession, url: str, cache: HttpCache,
+                     limiter: HostRateLimiter, stats: dict) -> str:
+    """Tải một trang với request có điều kiện, thử lại với backoff khi lỗi mạng hoặc 5xx."""
+    for attempt in range(1, MAX_RETRIES + 1):
+        await limiter.wait(url)
+        try:
+            async with session.get(url, headers=cache.conditional_headers(url)) as response:
+                if response.status == 304:
+                    stats["not_modified"] += 1
+                    return cache.load(url)
+                if response.status >= 500:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status
+                    )
+                response.raise_for_status()
+                body = await response.text()
+                cache.save(url, body, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                stats["downloaded"] += 1
+                return body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Lỗi 4xx (vd 404) không tự khỏi khi thử lại
+            is_client_error = isinstance(e, aiohttp.ClientResponseError) and e.status < 500
+            if is_client_error or attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+
+
+async def crawl_details_async(entries: List[dict], base_url: str, concurrency: int,
+                              requests_per_second: float, cache: HttpCache, run_id: str,
+                              writer: RowWriter, done: Dict[str, str]):
+    """
+    Tải song song các trang chi tiết (tối đa `concurrency` request cùng lúc), lưu snapshot,
+    ghi checkpoint và parse. Kết quả được ghi ngay theo đúng thứ tự trang danh sách.
+    Trang đã có trong `done` (checkpoint của lần chạy bị dừng) được đọc lại từ snapshot.
+    """
+    store = cache.store
+    limiter = HostRateLimiter(requests_per_second)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"downloaded": 0, "not_modified": 0, "resumed": 0, "failed": 0}
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency)
+    finished, next_to_write = {}, 0
+
+    def emit(position: int, rows: List[list]):
+        # Trang xong trước được giữ lại cho tới khi mọi trang đứng trước nó đã được ghi
+        nonlocal next_to_write
+        finished[position] = rows
+        while next_to_write in finished:
+            writer.write_rows(finished.pop(next_to_write))
+            next_to_write += 1
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector,
+                                     headers={"User-Agent": USER_AGENT}) as session:
+        async def crawl_one(position, entry):
+            if entry["link"] in done:
+                stats["resumed"] += 1
+                html = store.get(done[entry["link"]])
+            else:
+                async with semaphore:
+                    try:
+                        html = await fetch_page(session, entry["link"], cache, limiter, stats)
+                    except Exception as e:
+                        stats["failed"] += 1
+                        print(f"⚠️ Lỗi khi tải trang chi tiết: {entry['link']}, {e}")
+                        emit(position, [])
+                        return
+                store.checkpoint(run_id, "detail", entry["link"], store.put(html))
+            rows = parse_detail(html, entry, base_url)
+            if rows is None:
+                print(f"❌ Không tìm thấy box_news_detail: {entry['link']}")
+            emit(position, rows or [])
+
+        await asyncio.gather(*(crawl_one(i, entry) for i, entry in enumerate(entries)))
+
+    print(f"   -> Tải mới: {stats['downloaded']}, không đổi (304): {stats['not_modified']}, "
+          f"từ checkpoint: {stats['resumed']}, lỗi: {stats['failed']}")
+
+
+async def fetch_index_http(base_url: str, cache: HttpCache) -> str:
+    """Tải trang danh sách bằng HTTP thường (máy chủ thử nghiệm hoặc bản HTML tĩnh)."""
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout, headers={"User-Agent": USER_AGENT}) as session:
+        stats = {"downloaded": 0, "not_modified": 0}
+        return await fetch_page(session, base_url + INDEX_PATH, cache, HostRateLimiter(0), stats)
+
+
+# ------------------ PARSE LẠI TỪ SNAPSHOT ------------------
+
+def _parse_snapshot(task) -> List[list]:
+    """Chạy trong tiến trình con: giải nén một snapshot và parse."""
+    snapshot_dir, digest, entry, base_url = task
+    if digest is None:
+        return []
+    html = gzip.decompress(snapshot_path(snapshot_dir, digest).read_bytes())
+    return parse_detail(html.decode("utf-8"), entry, base_url) or []
+
+
+def reparse(snapshot_dir: Path, output_path: str, run_id: Optional[str] = None,
+            workers: Optional[int] = None) -> int:
+    """
+    Dựng lại kết quả từ snapshot của một lần crawl mà không gửi request nào: trang danh
+    sách được parse lại (để áp dụng cả bản sửa của parse_index), các trang chi tiết được
+    parse song song trên nhiều tiến trình. Trả về số dòng đã ghi.
+    """
+    start = time.perf_counter()
+    store = SnapshotStore(snapshot_dir)
+    run = store.load_run(run_id)
+    if run is None or run["index"] is None:
+        raise FileNotFoundError(f"Không có snapshot trang danh sách cho lần crawl '{run_id or 'gần nhất'}' trong {snapshot_dir}.")
+
+    base_url = run["index_url"][:-len(INDEX_PATH)]
+    entries = parse_index(store.get(run["index"]), base_url)
+    tasks = [(str(store.root), run["pages"].get(entry["link"]), entry, base_url) for entry in entries]
+    missing = sum(1 for task in tasks if task[1] is None)
+    print(f"✅ Lần crawl {run['run']}: {len(entries)} ngành, {len(entries) - missing} trang có snapshot.")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, RowWriter(output_path) as writer:
+        # pool.map trả kết quả theo đúng thứ tự đầu vào
+        for rows in pool.map(_parse_snapshot, tasks, chunksize=8):
+            writer.write_rows(rows)
+    print(f" Đã parse lại {writer.count} dòng trong {time.perf_counter() - start:.1f}s, lưu file {output_path}")
+    return writer.count
+
+
+# ------------------ MAIN ------------------
+
+def crawl(mode: str, index_source: str, base_url: str, output_path: str,
+          concurrency: int, requests_per_second: float, cache_dir: Path,
+          snapshot_dir: Path = SNAPSHOT_DIR, resume: bool = False) -> int:
+    """Crawl toàn bộ và ghi kết quả tăng dần vào `output_path`; trả về số dòng đã ghi."""
+    start = time.perf_counter()
+    store = SnapshotStore(snapshot_dir)
+    cache = HttpCache(cache_dir, store)
+
+    previous = store.load_run() if resume else None
+    if previous is not None:
+        run_id, done = previous["run"], previous["pages"]
+        print(f"ℹ️ Chạy tiếp lần crawl {run_id}: {len(done)} trang chi tiết đã có checkpoint.")
+    else:
+        run_id, done = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}", {}
+
+    driver = None
+    try:
+        # ------------------ B1: Crawl danh sách ngành ------------------
+        if previous is not None and previous["index"]:
+            index_html = store.get(previous["index"])
+        else:
+            if mode == "selenium" or index_source == "selenium":
+                driver = create_driver()
+                index_html = open_index_with_selenium(driver, base_url)
+            else:
+                index_html = asyncio.run(fetch_index_http(base_url, cache))
+            store.checkpoint(run_id, "index", base_url + INDEX_PATH, store.put(index_html))
+        entries = parse_index(index_html, base_url)
+        print(f"✅ Tìm thấy {len(entries)} ngành trên trang danh sách.")
+
+        # ------------------ B2: Crawl chi tiết ngành + B3: ghi kết quả ------------------
+        with RowWriter(output_path) as writer:
+            if mode == "selenium":
+                if driver is None:
+                    driver = create_driver()
+                crawl_details_selenium(driver, entries, base_url, store, run_id, writer, done)
+            else:
+                # Trình duyệt không còn cần thiết cho các trang chi tiết (HTML tĩnh)
+                if driver is not None:
+                    driver.quit()
+                    driver = None
+                asyncio.run(crawl_details_async(entries, base_url, concurrency, requests_per_second,
+                                                cache, run_id, writer, done))
+    finally:
+        if driver is not None:
+            driver.quit()
+
+    print(f" Đã crawl xong {writer.count} dòng trong {time.perf_counter() - start:.1f}s, lưu file {output_path}")
+    return writer.count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Crawl danh sách ngành và chuyên ngành từ trang tuyển sinh DTU.")
+    parser.add_argument("--mode", choices=["async", "selenium"], default="async",
+                        help="async: Selenium chỉ cho trang danh sách, trang chi tiết tải song song bằng HTTP; "
+                             "selenium: mở lần lượt mọi trang bằng trình duyệt (chế độ cũ).")
+    parser.add_argument("--index-source", choices=["selenium", "http"], default="selenium",
+                        help="Cách lấy trang danh sách ở chế độ async ('http' cho máy chủ thử nghiệm).")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--output", default=OUTPUT_PATH, help="File kết quả (.csv hoặc .jsonl).")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Số request/giây tối đa cho mỗi host.")
+    parser.add_argument("--cache-dir", type=Path, default=HTTP_CACHE_DIR)
+    parser.add_argument("--snapshot-dir", type=Path, default=SNAPSHOT_DIR)
+    parser.add_argument("--resume", action="store_true",
+                        help="Chạy tiếp lần crawl gần nhất: không tải lại các trang đã có checkpoint.")
+    parser.add_argument("--reparse", action="store_true",
+                        help="Không crawl: dựng lại kết quả từ snapshot (sau khi sửa parser).")
+    parser.add_argument("--run", default=None, help="Lần crawl dùng cho --reparse (mặc định: gần nhất).")
+    parser.add_argument("--workers", type=int, default=None, help="Số tiến trình cho --reparse.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.reparse:
+        reparse(args.snapshot_dir, args.output, args.run, args.workers)
+    else:
+        crawl(args.mode, args.index_source, args.base_url.rstrip("/"), args.output,
+              args.concurrency, args.rate, args.cache_dir, args.snapshot_dir, args.resume)
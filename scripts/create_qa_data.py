@@ -1,24 +1,38 @@
 import json
+import os
 import random
 import sys
+from itertools import islice
 from pathlib import Path
 
+import numpy as np
+
 # Thêm thư mục gốc vào Python Path để import config
 project_root = Path(__file__).resolve().parent.parent
 sys.path.append(str(project_root))
 
 from src.chatbot.config import PROCESSED_DATA_DIR
+from src.chatbot.document_store import DocumentStore, iter_documents
+from src.chatbot.embedding_cache import get_embedding_cache
+from src.chatbot.backends import load_embedder, embedding_model_id
 
 # --- CẤU HÌNH ---
-INPUT_FILES = [
-    "majors_data_enriched.json",
-    "faculty_enriched.json",
-    "awards_enriched.json"
-]
+# Kho tài liệu đã làm giàu -> loại nguồn
+INPUT_FILES = {
+    "majors_data_enriched.jsonl": "major",
+    "faculty_enriched.jsonl": "faculty",
+    "awards_enriched.jsonl": "award"
+}
 OUTPUT_TRAIN_PATH = PROCESSED_DATA_DIR / "qa.jsonl"
 OUTPUT_EVAL_PATH = PROCESSED_DATA_DIR / "eval.jsonl"
 NUM_NEGATIVE_SAMPLES_PER_DOC = 4  # số câu hỏi tiêu cực mỗi tài liệu
+HARD_NEGATIVE_POOL = 8  # chọn câu hỏi tiêu cực từ 8 tài liệu gần nhất (theo embedding)
+DUPLICATE_SIMILARITY = 0.98  # tài liệu giống hệt (cosine >= ngưỡng) không dùng làm tiêu cực
+SIMILARITY_BLOCK_SIZE = 1024  # số dòng của ma trận tương đồng tính mỗi lần
+EMBED_BATCH_SIZE = 64
+EMBED_BLOCK_SIZE = 1024  # số tài liệu được đọc và embedding mỗi lần
 EVAL_RATIO = 0.1  # 10% dữ liệu cho eval
+SEED = 42
 
 # --- TEMPLATE CỐ ĐỊNH ---
 SYSTEM_PROMPT = "Bạn là một trợ lý AI hữu ích của trường Đại học Duy Tân. Hãy trả lời câu hỏi chỉ dựa trên thông tin được cung cấp trong phần 'Context'."
@@ -83,17 +97,67 @@ def generate_positive_examples(doc):
     return examples
 
 # === Sinh dữ liệu tiêu cực ===
-def generate_negative_example(current_doc, all_docs):
-    other_doc = random.choice(all_docs)
-    while other_doc['id'] == current_doc['id']:
-        other_doc = random.choice(all_docs)
+def embed_documents(docs):
+    """
+    Embedding nội dung tài liệu (qua cache trên đĩa, chỉ tải mô hình khi cần), đã chuẩn hoá L2.
+    `docs` được đọc lần lượt theo từng khối EMBED_BLOCK_SIZE tài liệu, chỉ giữ lại ma trận embedding.
+    """
+    cache = get_embedding_cache(embedding_model_id())
+    embedder = None
+
+    def encode_missing(texts):
+        nonlocal embedder
+        if embedder is None:
+            print(f"   -> Đang tải Embedding Model: '{embedding_model_id()}'...")
+            embedder = load_embedder()
+        return embedder.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True)
+
+    docs = iter(docs)
+    blocks = []
+    while True:
+        texts = [doc['content'] for doc in islice(docs, EMBED_BLOCK_SIZE)]
+        if not texts:
+            break
+        blocks.append(cache.get_or_compute(texts, encode_missing))
+    vectors = np.vstack(blocks)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
 
-    positive_examples_from_other = generate_positive_examples(other_doc)
-    if not positive_examples_from_other:
-        return None
+def find_hard_negative_candidates(embeddings, has_questions, pool_size=HARD_NEGATIVE_POOL):
+    """
+    Với mỗi tài liệu, trả về chỉ số của tối đa `pool_size` tài liệu gần nhất theo cosine
+    (gần nhất trước), bỏ qua chính nó, các bản gần như trùng lặp và tài liệu không có câu hỏi.
+    Ma trận tương đồng được tính theo từng khối dòng để giới hạn bộ nhớ.
+    """
+    n = len(embeddings)
+    pool_size = min(pool_size, n - 1)
+    candidates = []
+    for start in range(0, n, SIMILARITY_BLOCK_SIZE):
+        block = embeddings[start:start + SIMILARITY_BLOCK_SIZE] @ embeddings.T
+        rows = np.arange(len(block))
+        block[rows, rows + start] = -np.inf
+        block[block >= DUPLICATE_SIMILARITY] = -np.inf
+        block[:, ~has_questions] = -np.inf
+        top = np.argpartition(-block, pool_size - 1, axis=1)[:, :pool_size]
+        order = np.argsort(-np.take_along_axis(block, top, axis=1), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        for row, neighbors in zip(block, top):
+            candidates.append([int(j) for j in neighbors if np.isfinite(row[j])])
+    return candidates
 
-    question, _ = random.choice(positive_examples_from_other)
-    return (question, NEGATIVE_ANSWER)
+def generate_negative_examples(doc_index, candidates, question_banks, rng):
+    """
+    Lấy câu hỏi của các tài liệu gần nhất làm câu hỏi tiêu cực cho tài liệu `doc_index`.
+    Bỏ các câu hỏi mà tài liệu hiện tại cũng sinh ra (câu hỏi chung chung mà context này trả lời được).
+    """
+    own_questions = {q for q, _ in question_banks[doc_index]}
+    neighbors = rng.sample(candidates[doc_index], min(NUM_NEGATIVE_SAMPLES_PER_DOC, len(candidates[doc_index])))
+    negatives = []
+    for j in neighbors:
+        options = [q for q, _ in question_banks[j] if q not in own_questions]
+        if options:
+            negatives.append((rng.choice(options), NEGATIVE_ANSWER))
+    return negatives
 
 # === Format dữ liệu chuẩn cho LLM ===
 def create_message_format(context, question, answer):
@@ -105,67 +169,116 @@ def create_message_format(context, question, answer):
         ]
     }
 
-# === MAIN ===
-def main():
-    print("--- Bắt đầu quá trình tạo dữ liệu fine-tune ---")
-    
-    all_docs = []
-    source_mapping = {
-        "majors_data_enriched.json": "major",
-        "faculty_enriched.json": "faculty",
-        "awards_enriched.json": "award"
-    }
+def parse_message_format(example):
+    """Ngược lại với create_message_format: trả về (context, question, answer) của một mẫu qa.jsonl/eval.jsonl."""
+    user_content = example["messages"][1]["content"]
+    context_part, question = user_content.split("\n\nDựa vào Context trên, hãy trả lời câu hỏi sau: ", 1)
+    context = context_part[len("Context:\n'''\n"):-len("\n'''")]
+    return context, question, example["messages"][2]["content"]
+
+def write_shuffled(src_path, dst_path, rng):
+    """
+    Ghi các dòng của `src_path` vào `dst_path` theo thứ tự ngẫu nhiên (theo `rng`) mà không nạp
+    cả file: chỉ giữ offset của từng dòng. Tránh để các mẫu của cùng một tài liệu nằm liền nhau.
+    """
+    offsets = []
+    with open(src_path, 'rb') as f:
+        position = 0
+        for line in f:
+            offsets.append(position)
+            position += len(line)
+    rng.shuffle(offsets)
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        for offset in offsets:
+            src.seek(offset)
+            dst.write(src.readline())
 
-    print("1. Đang tải tất cả các tài liệu đã được làm giàu...")
-    for filename, source_type in source_mapping.items():
+# === ĐỌC KHO TÀI LIỆU ===
+def open_corpus():
+    """
+    Mở các kho tài liệu đã làm giàu. Trả về (danh sách id, hàm lấy tài liệu theo id);
+    tài liệu được đọc từ mmap khi cần (metadata có thêm `source_type`), không nạp cả kho.
+    """
+    doc_ids, source_types, stores, legacy_docs = [], {}, {}, {}
+    for filename, source_type in INPUT_FILES.items():
+        path = PROCESSED_DATA_DIR / filename
+        store = DocumentStore.open_if_exists(path)
         try:
-            with open(PROCESSED_DATA_DIR / filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for item in data:
-                    item['metadata']['source_type'] = source_type
-                all_docs.extend(data)
+            if store is not None:
+                ids = store.ids()
+            else:
+                # Định dạng cũ dạng mảng JSON (chưa chạy lại enrich_all_data.py): nạp vào bộ nhớ
+                docs = {doc['id']: doc for doc in iter_documents(path)}
+                legacy_docs.update(docs)
+                ids = list(docs)
         except FileNotFoundError:
             print(f"[Cảnh báo] Không tìm thấy file {filename}, bỏ qua.")
-            
-    if not all_docs:
+            continue
+        for doc_id in ids:
+            if doc_id not in source_types:
+                doc_ids.append(doc_id)
+            source_types[doc_id] = source_type
+            if store is not None:
+                stores[doc_id] = store
+
+    def get_doc(doc_id):
+        doc = stores[doc_id].get(doc_id) if doc_id in stores else dict(legacy_docs[doc_id])
+        doc['metadata'] = {**doc.get('metadata', {}), 'source_type': source_types[doc_id]}
+        return doc
+
+    return doc_ids, get_doc
+
+# === MAIN ===
+def main(seed=SEED):
+    print("--- Bắt đầu quá trình tạo dữ liệu fine-tune ---")
+    rng = random.Random(seed)
+
+    print("1. Đang mở các kho tài liệu đã được làm giàu...")
+    doc_ids, get_doc = open_corpus()
+    if len(doc_ids) < 2:
         print("[LỖI] Không có dữ liệu để xử lý. Dừng lại.")
         return
 
-    print(f"   -> Đã tải thành công {len(all_docs)} tài liệu.")
+    print(f"   -> Có {len(doc_ids)} tài liệu.")
 
-    print("2. Đang sinh các cặp câu hỏi-đáp (Q&A)...")
-    qa_pairs = []
-    for doc in all_docs:
-        context = doc['content']
-        
-        for question, answer in generate_positive_examples(doc):
-            qa_pairs.append(create_message_format(context, question, answer))
-
-        for _ in range(NUM_NEGATIVE_SAMPLES_PER_DOC):
-            neg = generate_negative_example(doc, all_docs)
-            if neg:
-                q, a = neg
-                qa_pairs.append(create_message_format(context, q, a))
-                
-    print(f"   -> Đã tạo ra tổng cộng {len(qa_pairs)} mẫu dữ liệu.")
-
-    random.shuffle(qa_pairs)
-
-    split_idx = int(len(qa_pairs) * (1 - EVAL_RATIO))
-    train_data = qa_pairs[:split_idx]
-    eval_data = qa_pairs[split_idx:]
-
-    print(f"   -> Train set: {len(train_data)} mẫu")
-    print(f"   -> Eval set: {len(eval_data)} mẫu")
-
-    with open(OUTPUT_TRAIN_PATH, 'w', encoding='utf-8') as f:
-        for pair in train_data:
-            f.write(json.dumps(pair, ensure_ascii=False) + '\n')
-
-    with open(OUTPUT_EVAL_PATH, 'w', encoding='utf-8') as f:
-        for pair in eval_data:
-            f.write(json.dumps(pair, ensure_ascii=False) + '\n')
-            
+    # Mỗi tài liệu chỉ sinh bộ câu hỏi một lần; bộ này dùng cho cả mẫu tích cực lẫn tiêu cực.
+    # Tài liệu được đọc lại từ kho ở mỗi lượt thay vì giữ cả kho trong bộ nhớ.
+    question_banks = [generate_positive_examples(get_doc(doc_id)) for doc_id in doc_ids]
+
+    print("2. Đang tìm tài liệu gần nhất để lấy câu hỏi tiêu cực khó...")
+    embeddings = embed_documents(get_doc(doc_id) for doc_id in doc_ids)
+    has_questions = np.array([bool(bank) for bank in question_banks])
+    candidates = find_hard_negative_candidates(embeddings, has_questions)
+
+    print("3. Đang sinh và ghi các cặp câu hỏi-đáp (Q&A)...")
+    counts = {"train": 0, "eval": 0, "negative": 0}
+    outputs = [OUTPUT_TRAIN_PATH, OUTPUT_EVAL_PATH]
+    # Mẫu được ghi theo thứ tự tài liệu vào file tạm, rồi xáo trộn (theo seed) vào file tạm thứ hai
+    tmp_paths = [path.with_suffix(".jsonl.tmp") for path in outputs]
+    shuffled_paths = [path.with_suffix(".jsonl.shuffled") for path in outputs]
+    try:
+        with open(tmp_paths[0], 'w', encoding='utf-8') as f_train, open(tmp_paths[1], 'w', encoding='utf-8') as f_eval:
+            for i, doc_id in enumerate(doc_ids):
+                context = get_doc(doc_id)['content']
+                negatives = generate_negative_examples(i, candidates, question_banks, rng)
+                counts["negative"] += len(negatives)
+                for question, answer in question_banks[i] + negatives:
+                    split = "eval" if rng.random() < EVAL_RATIO else "train"
+                    f = f_eval if split == "eval" else f_train
+                    f.write(json.dumps(create_message_format(context, question, answer), ensure_ascii=False) + '\n')
+                    counts[split] += 1
+        for tmp_path, shuffled_path in zip(tmp_paths, shuffled_paths):
+            write_shuffled(tmp_path, shuffled_path, rng)
+        for shuffled_path, path in zip(shuffled_paths, outputs):
+            os.replace(shuffled_path, path)
+    finally:
+        # Không để lại file tạm, kể cả khi quá trình sinh bị lỗi giữa chừng
+        for path in tmp_paths + shuffled_paths:
+            path.unlink(missing_ok=True)
+
+    print(f"   -> Đã tạo ra tổng cộng {counts['train'] + counts['eval']} mẫu dữ liệu ({counts['negative']} mẫu tiêu cực).")
+    print(f"   -> Train set: {counts['train']} mẫu")
+    print(f"   -> Eval set: {counts['eval']} mẫu")
     print("\n--- ✅ Hoàn tất! Đã tạo qa.jsonl (train) và eval.jsonl (eval). ---")
 
 if __name__ == "__main__":
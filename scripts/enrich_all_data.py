@@ -1,18 +1,25 @@
 import json
-import os
+import sys
+from pathlib import Path
+
+# Thêm thư mục gốc vào Python Path để import config
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.chatbot.config import PROCESSED_DATA_DIR
+from src.chatbot.document_store import write_document_store
 
 # --- CẤU HÌNH ĐƯỜNG DẪN ---
-# Chạy script này từ thư mục gốc của dự án
-PROCESSED_DATA_DIR = "data/processed"
 INPUT_FILES = {
     "majors": "majors.json",
     "faculty": "faculty.json",
     "awards": "awards.json"
 }
+# Đầu ra là kho tài liệu JSONL (kèm chỉ mục offset .idx.json) để đọc tuần tự/truy cập ngẫu nhiên
 OUTPUT_FILES = {
-    "majors": "majors_data_enriched.json",
-    "faculty": "faculty_enriched.json",
-    "awards": "awards_enriched.json"
+    "majors": "majors_data_enriched.jsonl",
+    "faculty": "faculty_enriched.jsonl",
+    "awards": "awards_enriched.jsonl"
 }
 
 # --- CÁC HÀM LÀM GIÀU NỘI DUNG ---
@@ -61,37 +68,40 @@ def enrich_award_content(item):
     content += f"Chi tiết: {item['content']}."
     return content
 
-def main():
-    """Hàm chính để xử lý tất cả các file."""
-    enrichment_functions = {
-        "majors": enrich_major_content,
-        "faculty": enrich_faculty_content,
-        "awards": enrich_award_content
-    }
+ENRICHMENT_FUNCTIONS = {
+    "majors": enrich_major_content,
+    "faculty": enrich_faculty_content,
+    "awards": enrich_award_content
+}
 
-    for key, input_filename in INPUT_FILES.items():
-        input_path = os.path.join(PROCESSED_DATA_DIR, input_filename)
-        output_path = os.path.join(PROCESSED_DATA_DIR, OUTPUT_FILES[key])
+def enrich_dataset(key):
+    """Làm giàu nội dung cho một bộ dữ liệu ("majors", "faculty" hoặc "awards")."""
+    input_path = PROCESSED_DATA_DIR / INPUT_FILES[key]
+    output_path = PROCESSED_DATA_DIR / OUTPUT_FILES[key]
 
-        print(f"\n--- Đang xử lý file: {input_path} ---")
-        try:
-            with open(input_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            print(f"[LỖI] Không tìm thấy file: {input_path}. Bỏ qua.")
-            continue
-            
-        enriched_data = []
+    print(f"\n--- Đang xử lý file: {input_path} ---")
+    try:
+        with open(input_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        print(f"[LỖI] Không tìm thấy file: {input_path}. Bỏ qua.")
+        return False
+        
+    def enriched_items():
         for item in data:
             new_item = item.copy()
-            new_item['content'] = enrichment_functions[key](item)
-            enriched_data.append(new_item)
-            
-        print(f"Đã làm giàu nội dung cho {len(enriched_data)} mục.")
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(enriched_data, f, ensure_ascii=False, indent=2)
-        print(f"Đã lưu file mới vào: {output_path}")
+            new_item['content'] = ENRICHMENT_FUNCTIONS[key](item)
+            yield new_item
+
+    count = write_document_store(output_path, enriched_items())
+    print(f"Đã làm giàu nội dung cho {count} mục.")
+    print(f"Đã lưu file mới vào: {output_path}")
+    return True
+
+def main():
+    """Hàm chính để xử lý tất cả các file."""
+    for key in INPUT_FILES:
+        enrich_dataset(key)
 
     print("\n--- HOÀN TẤT QUÁ TRÌNH LÀM GIÀU DỮ LIỆU ---")
 
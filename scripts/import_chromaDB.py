@@ -1,53 +1,253 @@
+# scripts/import_chromaDB.py
+
+import argparse
 import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# Thêm thư mục gốc vào Python Path để có thể import từ src và scripts
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
 import chromadb
-from sentence_transformers import SentenceTransformer
-
-DATA_FILES = [
-    "data/processed/majors_data_enriched.json",
-    "data/processed/faculty_enriched.json",
-    "data/processed/awards_enriched.json",
-]
-COLLECTION_NAME = "tuyensinh"
-
-# Load model embedding
-embedder = SentenceTransformer("keepitreal/vietnamese-sbert")
-
-# Kết nối ChromaDB (persistent: lưu DB trên ổ cứng)
-chroma_client = chromadb.PersistentClient(path="data/vector_store/chroma_db")
-collection = chroma_client.get_or_create_collection(COLLECTION_NAME)
-
-def embed_text(text: str):
-    return embedder.encode([text])[0].tolist()
-
-def clean_metadata(metadata: dict):
-    """Chuyển list -> string, None -> '' để tương thích với ChromaDB"""
-    cleaned = {}
-    for key, value in metadata.items():
-        if value is None or value == "Không có dữ liệu":
-            cleaned[key] = ""
-        elif isinstance(value, list):
-            cleaned[key] = ", ".join(map(str, value))
-        else:
-            cleaned[key] = value
-    return cleaned
-
-# Import dữ liệu
-for file_path in DATA_FILES:
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    for record in data:
-        text = record["content"]
-        embedding = embed_text(text)
-        metadata = clean_metadata(record["metadata"])
-
-        collection.add(
-            ids=[record["id"]],
-            embeddings=[embedding],
-            documents=[text],
-            metadatas=[metadata],
-        )
-
-    print(f"Imported {file_path}")
-
-print("Dữ liệu đã import xong vào ChromaDB (persisted at data/chroma_db)")
+
+from src.chatbot.config import (
+    PROCESSED_DATA_DIR,
+    VECTOR_STORE_DIR,
+    CHROMA_PATH,
+    COLLECTION_NAME,
+    CHUNK_MAX_TOKENS,
+    DEVICE
+)
+from src.chatbot.embedding_cache import get_embedding_cache
+from src.chatbot.backends import load_embedder, load_token_counter, embedding_model_id
+from src.chatbot.chunking import chunk_document
+from src.chatbot.document_store import DocumentStoreWriter, iter_documents
+from src.chatbot.index_registry import document_store_path
+from scripts.build_database import (
+    ENRICHED_FILES,
+    collection_exists,
+    clean_metadata,
+    document_hash,
+    load_manifest,
+    manifest_is_compatible,
+    save_manifest
+)
+
+try:
+    import resource  # Không có trên Windows
+except ImportError:
+    resource = None
+
+# --- CẤU HÌNH MẶC ĐỊNH ---
+SORT_WINDOW = 8192          # Số bản ghi được gom lại và sắp xếp theo độ dài trước khi encode
+ENCODE_BATCH_SIZE = 256
+DEFAULT_WRITE_BATCH_SIZE = 4096
+CHECKPOINT_PATH = VECTOR_STORE_DIR / "import_checkpoint.json"
+
+
+def iter_records():
+    """Đọc tuần tự từng kho tài liệu và trả về từng bản ghi (không giữ toàn bộ dữ liệu trong bộ nhớ)."""
+    for filename in ENRICHED_FILES:
+        file_path = PROCESSED_DATA_DIR / filename
+        print(f"-> Đang import các bản ghi từ {filename}")
+        try:
+            yield from iter_documents(file_path)
+        except FileNotFoundError:
+            print(f"[Cảnh báo] Không tìm thấy file {file_path}, bỏ qua.")
+
+
+def iter_chunks(records, count_tokens, doc_hashes: dict, doc_chunks: dict, store_writer: DocumentStoreWriter):
+    """
+    Chia từng bản ghi thành các chunk; hash và danh sách chunk của bản ghi gốc được ghi
+    vào hai dict, bản ghi gốc (kèm nội dung các chunk) được ghi vào kho tài liệu của collection.
+    """
+    for record in records:
+        chunks = chunk_document(record, count_tokens)
+        doc_hashes[record["id"]] = document_hash(record)
+        doc_chunks[record["id"]] = [c["id"] for c in chunks]
+        stored = {"id": record["id"], "content": record["content"], "metadata": record.get("metadata", {})}
+        if len(chunks) > 1:
+            stored["chunks"] = [c["content"] for c in chunks]
+        store_writer.add(stored)
+        yield from chunks
+
+
+def iter_windows(records, window_size: int):
+    """Gom bản ghi thành các cửa sổ, mỗi cửa sổ được sắp xếp theo độ dài nội dung."""
+    window = []
+    for record in records:
+        window.append(record)
+        if len(window) >= window_size:
+            yield sorted(window, key=lambda r: len(r["content"]))
+            window = []
+    if window:
+        yield sorted(window, key=lambda r: len(r["content"]))
+
+
+def load_checkpoint(reset: bool) -> set:
+    """Đọc danh sách id đã import từ lần chạy bị gián đoạn trước đó."""
+    if reset or not CHECKPOINT_PATH.exists():
+        return set()
+    with open(CHECKPOINT_PATH, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if (checkpoint.get("collection") != COLLECTION_NAME
+            or checkpoint.get("embedding_model") != embedding_model_id()
+            or checkpoint.get("chunk_max_tokens") != CHUNK_MAX_TOKENS):
+        return set()
+    return set(checkpoint["done_ids"])
+
+
+def save_checkpoint(done_ids: set):
+    CHECKPOINT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = CHECKPOINT_PATH.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "collection": COLLECTION_NAME,
+            "embedding_model": embedding_model_id(),
+            "chunk_max_tokens": CHUNK_MAX_TOKENS,
+            "done_ids": sorted(done_ids)
+        }, f, ensure_ascii=False)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+
+def peak_memory_mb() -> float:
+    """Bộ nhớ RSS cao nhất của tiến trình (MB), None nếu hệ điều hành không hỗ trợ."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_import(processes: int, encode_batch_size: int, write_batch_size: int, reset: bool):
+    start_time = time.perf_counter()
+
+    print(f"1. Đang tải Embedding Model: '{embedding_model_id()}'...")
+    embedder = load_embedder()
+    cache = get_embedding_cache(embedding_model_id())
+    pool = None
+    # Backend nhẹ (vd "hashing") không có pool đa tiến trình của SentenceTransformer
+    if processes > 1 and hasattr(embedder, "start_multi_process_pool"):
+        print(f"   -> Khởi tạo {processes} tiến trình encode...")
+        pool = embedder.start_multi_process_pool(target_devices=[DEVICE] * processes)
+
+    client = chromadb.PersistentClient(path=str(CHROMA_PATH))
+    done_ids = load_checkpoint(reset)
+    if done_ids:
+        print(f"   -> Tiếp tục từ checkpoint: đã import {len(done_ids)} bản ghi trước đó.")
+
+    manifest = load_manifest(COLLECTION_NAME)
+    compatible = manifest_is_compatible(manifest)
+    # Checkpoint hợp lệ nghĩa là collection hiện có do lần import dang dở này tạo ra, không xoá
+    if not compatible and not done_ids and collection_exists(client, COLLECTION_NAME):
+        # Giống build_database: không biết collection hiện có được embedding/chia chunk thế nào -> xây dựng lại
+        print("   -> Chưa có manifest hoặc mô hình embedding/cấu hình chunking đã thay đổi. Xoá collection cũ...")
+        client.delete_collection(name=COLLECTION_NAME)
+    collection = client.get_or_create_collection(
+        name=COLLECTION_NAME,
+        metadata={"embedding_model": embedding_model_id()}
+    )
+    # ChromaDB giới hạn số bản ghi trong một lần ghi
+    max_batch_size = getattr(client, "get_max_batch_size", lambda: write_batch_size)()
+    write_batch_size = min(write_batch_size, max_batch_size)
+
+    count_tokens = load_token_counter()
+    imported_hashes, imported_chunks = {}, {}
+    n_imported = 0
+    n_skipped = 0
+    encode_seconds = 0.0
+    write_seconds = 0.0
+
+    print("2. Đang encode và ghi dữ liệu vào ChromaDB...")
+    store_writer = DocumentStoreWriter(document_store_path(CHROMA_PATH, COLLECTION_NAME))
+    try:
+        chunks = iter_chunks(iter_records(), count_tokens, imported_hashes, imported_chunks, store_writer)
+        for window in iter_windows(chunks, SORT_WINDOW):
+            pending = [r for r in window if r["id"] not in done_ids]
+            n_skipped += len(window) - len(pending)
+            if not pending:
+                continue
+
+            def encode_missing(texts):
+                if pool is not None:
+                    return embedder.encode_multi_process(texts, pool, batch_size=encode_batch_size)
+                return embedder.encode(texts, batch_size=encode_batch_size, convert_to_numpy=True)
+
+            # Chỉ encode các văn bản chưa có trong cache embedding dùng chung
+            t0 = time.perf_counter()
+            embeddings = cache.get_or_compute([r["content"] for r in pending], encode_missing)
+            encode_seconds += time.perf_counter() - t0
+
+            for i in range(0, len(pending), write_batch_size):
+                batch = pending[i:i + write_batch_size]
+                t0 = time.perf_counter()
+                collection.upsert(
+                    ids=[r["id"] for r in batch],
+                    embeddings=embeddings[i:i + write_batch_size].tolist(),
+                    documents=[r["content"] for r in batch],
+                    metadatas=[clean_metadata(r["metadata"]) for r in batch],
+                )
+                write_seconds += time.perf_counter() - t0
+
+                for r in batch:
+                    done_ids.add(r["id"])
+                n_imported += len(batch)
+                save_checkpoint(done_ids)
+
+            elapsed = time.perf_counter() - start_time
+            print(f"   -> {n_imported} chunk, {len(imported_hashes)} tài liệu "
+                  f"({n_imported / elapsed:.1f} chunks/s, {len(imported_hashes) / elapsed:.1f} docs/s)")
+    except BaseException:
+        store_writer.abort()
+        raise
+    finally:
+        if pool is not None:
+            embedder.stop_multi_process_pool(pool)
+    store_writer.close()
+
+    # Cập nhật manifest của build_database để lần đồng bộ tăng dần sau không embedding lại
+    doc_hashes = manifest["documents"] if compatible else {}
+    doc_chunks = manifest["chunks"] if compatible else {}
+    # Tài liệu đã thay đổi có thể có ít chunk hơn trước: xoá các chunk cũ không còn dùng
+    stale_ids = [
+        chunk_id for doc_id, chunk_ids in imported_chunks.items()
+        for chunk_id in set(doc_chunks.get(doc_id, [])) - set(chunk_ids)
+    ]
+    for i in range(0, len(stale_ids), write_batch_size):
+        collection.delete(ids=stale_ids[i:i + write_batch_size])
+    doc_hashes.update(imported_hashes)
+    doc_chunks.update(imported_chunks)
+    save_manifest(COLLECTION_NAME, doc_hashes, doc_chunks)
+    CHECKPOINT_PATH.unlink(missing_ok=True)
+
+    elapsed = time.perf_counter() - start_time
+    peak_mb = peak_memory_mb()
+    print("\n" + "=" * 50)
+    print(f"Đã import {n_imported} chunk từ {len(imported_hashes)} tài liệu (bỏ qua {n_skipped} chunk đã có trong checkpoint).")
+    print(f"Tổng thời gian: {elapsed:.1f}s | Encode: {encode_seconds:.1f}s | Ghi ChromaDB: {write_seconds:.1f}s")
+    if n_imported:
+        print(f"Throughput: {n_imported / elapsed:.1f} chunks/s, {len(imported_hashes) / elapsed:.1f} docs/s "
+              f"(encode: {n_imported / max(encode_seconds, 1e-9):.1f} chunks/s)")
+    if peak_mb is not None:
+        print(f"Bộ nhớ cao nhất (peak RSS): {peak_mb:.0f} MB")
+    print("=" * 50)
+    print(f"Dữ liệu đã import xong vào ChromaDB (persisted at {CHROMA_PATH})")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import hàng loạt dữ liệu đã làm giàu vào ChromaDB.")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Số tiến trình encode song song (hữu ích trên CPU nhiều nhân).")
+    parser.add_argument("--encode-batch-size", type=int, default=ENCODE_BATCH_SIZE)
+    parser.add_argument("--write-batch-size", type=int, default=DEFAULT_WRITE_BATCH_SIZE)
+    parser.add_argument("--reset", action="store_true",
+                        help="Bỏ qua checkpoint và import lại toàn bộ.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_import(args.processes, args.encode_batch_size, args.write_batch_size, args.reset)
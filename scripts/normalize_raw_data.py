@@ -0,0 +1,390 @@
+# scripts/normalize_raw_data.py
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+# Thêm thư mục gốc vào Python Path để import config
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.chatbot.config import RAW_DATA_DIR, PROCESSED_DATA_DIR
+
+# --- CẤU HÌNH ĐƯỜNG DẪN ---
+RAW_FILES = {
+    "faculty": "duytan_lecturers.csv",
+    "majors": "majors_index.csv",
+    "awards": "awards.csv"
+}
+# Trùng với INPUT_FILES của enrich_all_data.py
+OUTPUT_FILES = {
+    "faculty": "faculty.json",
+    "majors": "majors.json",
+    "awards": "awards.json"
+}
+
+FACULTY_NAMES = {
+    "CNTT": "CNTT",
+    "XayDung": "Xây Dựng",
+    "KTN&XH": "KTN&XH",
+    "TiengAnh": "Tiếng Anh",
+    "Luat": "Luật",
+    "Duoc": "Dược"
+}
+# Học vị viết đầy đủ -> viết tắt (dạng đang dùng trong dữ liệu đã xử lý, vd: "ThS. Nguyễn Quốc Lâm")
+DEGREE_ABBREVIATIONS = {
+    "giáo sư": "GS.",
+    "phó giáo sư": "PGS.",
+    "tiến sĩ": "TS.",
+    "thạc sĩ": "ThS.",
+    "cao học": "ThS.",
+    "kỹ sư": "KS.",
+    "cử nhân": "CN."
+}
+DEGREE_PREFIXES = {
+    "gs": "GS.", "pgs": "PGS.", "pgs.ts": "PGS.TS.", "ts": "TS.",
+    "ths": "ThS.", "th.s": "ThS.", "ch": "ThS.", "ks": "KS.", "cn": "CN."
+}
+PREFIX_PATTERN = r"(?:PGS\.\s?TS|GS\.\s?TS|PGS|GS|TS|ThS|Th\.s|CH|KS|CN)\.?"
+
+# --- CÁC BIỂU THỨC TÁCH THÔNG TIN GIẢNG VIÊN ---
+# Dạng thẻ đầy đủ (CNTT): "TS Võ Nhân Văn Trình độ: Tiến sĩ Chức vụ: Trưởng khoa Địa chỉ: ... Email: ..."
+CARD_WITH_LEVEL = (
+    rf"^(?P<prefix>{PREFIX_PATTERN})\s+(?P<name>.+?)\s+Trình độ:\s*(?P<level>.+?)"
+    r"\s+Chức vụ:\s*(?P<position>.+?)(?:\s+Địa chỉ:.*?)?(?:\s+Email:\s*(?P<email>\S+@\S+))?$"
+)
+# Dạng thẻ rút gọn (KTN&XH, Luật, Tiếng Anh): "Tên Học hàm/Học vị: Thạc sĩ Chức vụ: Trưởng khoa Xem thêm"
+CARD_WITH_TITLE = (
+    r"^(?P<name>[^:]+?)\s+Học hàm/Học vị:\s*(?P<level>.+?)"
+    r"\s+Chức vụ:\s*(?P<position>.+?)(?:\s+Xem thêm)?$"
+)
+# Dạng mỗi trường một dòng (Xây Dựng): "ThS. Nguyễn Quốc Lâm", "Chức vụ: ...", "Học vị: ...", "Email: ..."
+NAME_LINE = rf"^(?P<prefix>{PREFIX_PATTERN})\s+(?P<name>[^:\d@]{{3,60}})$"
+FIELD_LINE = r"^(?P<field>Chức vụ|Học vị|Học hàm/Học vị|Email):\s*(?P<value>.+)$"
+
+
+def identity_key(*parts) -> str:
+    return "|".join(str(p).strip().lower() for p in parts)
+
+
+def stable_id(kind: str, *parts) -> str:
+    """Id ổn định giữa các lần chạy: không đổi khi thứ tự dòng trong CSV thay đổi."""
+    return f"{kind}_{hashlib.sha1(identity_key(*parts).encode('utf-8')).hexdigest()[:12]}"
+
+
+def squash_whitespace(series: pd.Series) -> pd.Series:
+    """Gộp mọi khoảng trắng/xuống dòng/ký tự điều khiển thành một dấu cách."""
+    return (
+        series.fillna("").astype(str)
+        .str.replace(r"[\x00-\x1f]+", " ", regex=True)
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+    )
+
+
+def abbreviate_degree(prefix: pd.Series, level: pd.Series) -> pd.Series:
+    """Học vị viết tắt: ưu tiên tiền tố trước tên, nếu không có thì suy ra từ học vị viết đầy đủ."""
+    from_prefix = prefix.str.lower().str.replace(r"[\s.]+$", "", regex=True).str.replace(" ", "").map(DEGREE_PREFIXES)
+    from_level = level.str.lower().str.strip().map(DEGREE_ABBREVIATIONS)
+    return from_prefix.fillna(from_level).fillna("")
+
+
+# --- CHUẨN HOÁ TỪNG BỘ DỮ LIỆU ---
+
+def normalize_faculty(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tách `info` thành học vị, họ tên, chức vụ, email bằng các phép toán theo cột.
+    Các dòng menu/điều hướng ("myDTU", "Tuyển dụng", ...) không khớp mẫu nào nên bị loại.
+    """
+    info = squash_whitespace(df["info"])
+    faculty = df["faculty"].fillna("").astype(str).str.strip()
+    email_col = df["email"].fillna("").astype(str).str.strip()
+
+    # 1. Thẻ đầy đủ trên một dòng
+    card_a = info.str.extract(CARD_WITH_LEVEL)
+    card_b = info.str.extract(CARD_WITH_TITLE)
+    cards = card_a.combine_first(card_b.assign(prefix=np.nan, email=np.nan))
+
+    # 2. Dòng tên đứng riêng, các trường nằm ở các dòng ngay sau đó
+    name_line = info.str.extract(NAME_LINE)
+    is_start = cards["name"].notna() | name_line["name"].notna()
+    # Mỗi thẻ là một nhóm: từ dòng bắt đầu đến trước dòng bắt đầu kế tiếp (không vượt qua ranh giới khoa)
+    group = is_start.cumsum().where(faculty.eq(faculty.shift()) | is_start)
+    group = group.where(group.gt(0))
+
+    fields = info.str.extract(FIELD_LINE).assign(group=group).dropna(subset=["group", "field"])
+    fields["field"] = fields["field"].replace({"Học hàm/Học vị": "Học vị"})
+    fields = fields.drop_duplicates(subset=["group", "field"]).pivot(index="group", columns="field", values="value")
+    fields = fields.reindex(columns=["Chức vụ", "Học vị", "Email"])
+
+    starts = pd.DataFrame({
+        "group": group[is_start],
+        "faculty": faculty[is_start],
+        "prefix": cards["prefix"].fillna(name_line["prefix"])[is_start],
+        "name": cards["name"].fillna(name_line["name"])[is_start],
+        "level": cards["level"][is_start],
+        "position": cards["position"][is_start],
+        "email": cards["email"].fillna(email_col.replace("", np.nan))[is_start],
+    })
+    merged = starts.join(fields, on="group")
+    merged["level"] = merged["level"].fillna(merged["Học vị"]).fillna("")
+    merged["position"] = merged["position"].fillna(merged["Chức vụ"]).fillna("")
+    # Một ô email có thể chứa nhiều địa chỉ, chỉ giữ địa chỉ đầu tiên
+    merged["email"] = (
+        merged["email"].fillna(merged["Email"]).fillna("")
+        .str.extract(r"([\w.+-]+@[\w-]+(?:\.[\w-]+)+)", expand=False).fillna("")
+    )
+
+    out = pd.DataFrame({
+        "degree": abbreviate_degree(merged["prefix"].fillna(""), merged["level"]),
+        "name": merged["name"].str.strip(" .,:"),
+        "position": merged["position"].str.strip(" .,:"),
+        "faculty": merged["faculty"].map(FACULTY_NAMES).fillna(merged["faculty"]),
+        "email": merged["email"],
+    })
+    # Loại dòng có "tên" thực ra là tiêu đề/menu: tên người Việt có từ 2 đến 6 từ, không có chữ in hoa toàn bộ
+    words = out["name"].str.count(" ") + 1
+    out = out[words.between(2, 6) & out["name"].ne(out["name"].str.upper())]
+
+    # Cùng một người xuất hiện nhiều lần trên trang: giữ bản ghi đầy đủ thông tin nhất
+    completeness = out[["degree", "position", "email"]].ne("").sum(axis=1)
+    out = (
+        out.assign(_completeness=completeness, _key=out["faculty"] + "|" + out["name"].str.lower())
+        .sort_values("_completeness", ascending=False, kind="stable")
+        .drop_duplicates(subset="_key")
+        .sort_index()
+        .drop(columns=["_completeness", "_key"])
+    )
+    out["id"] = [stable_id("faculty", f, n) for f, n in zip(out["faculty"], out["name"])]
+    return out.reset_index(drop=True)
+
+
+def normalize_majors(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Chỉ giữ các trang giới thiệu ngành ("Ngành ..."), bỏ trang tin tức/sitemap và các trường
+    `major` ghép bằng dấu ';' khổng lồ; mã ngành lấy từ cột `major_code` hoặc từ nội dung trang.
+    """
+    title = squash_whitespace(df["page_title"])
+    url = squash_whitespace(df["url"])
+    is_major_page = (
+        title.str.match(r"^Ngành\s")
+        & ~title.str.contains("đào tạo - ", regex=False)
+        & url.str.contains(r"/Page/Education(?:Detail)?\.aspx\?id=", regex=True)
+    )
+    df = df[is_major_page]
+    title = title[is_major_page]
+    url = url[is_major_page]
+
+    major_text = squash_whitespace(df["major"])
+    code = (
+        squash_whitespace(df["major_code"]).str.extract(r"(\d{7})", expand=False)
+        .fillna(major_text.str.extract(r"\b(7\d{6})\b", expand=False))
+        .fillna("")
+    )
+    specializations = squash_whitespace(df["specializations"])
+    spec_names = (
+        specializations.str.extractall(r"tại đây: ([^;]+?) \.")[0]
+        .groupby(level=0).agg(lambda s: list(dict.fromkeys(s)))
+    )
+    combos = (
+        squash_whitespace(df["subject_combinations"]).str.extractall(r"\b([A-DHKMNRSTVX]\d{2})\b")[0]
+        .groupby(level=0).agg(lambda s: sorted(set(s)))
+    )
+
+    out = pd.DataFrame({
+        "ten_nganh": title.str.replace(r"^Ngành\s+", "", regex=True),
+        "ma_nganh": code,
+        "to_hop_mon": combos.reindex(df.index),
+        "chuyen_nganh": spec_names.reindex(df.index),
+        "url": url,
+    })
+    out["to_hop_mon"] = out["to_hop_mon"].apply(lambda v: v if isinstance(v, list) else [])
+    out["chuyen_nganh"] = out["chuyen_nganh"].apply(lambda v: v if isinstance(v, list) else [])
+
+    # Một ngành có thể được crawl từ nhiều URL: giữ bản ghi có mã ngành
+    out = (
+        out.assign(_key=out["ten_nganh"].str.lower(), _has_code=out["ma_nganh"].ne(""))
+        .sort_values("_has_code", ascending=False, kind="stable")
+        .drop_duplicates(subset="_key")
+        .sort_index()
+        .drop(columns=["_key", "_has_code"])
+    )
+    out["id"] = [stable_id("major", name) for name in out["ten_nganh"]]
+    return out.reset_index(drop=True)
+
+
+def normalize_awards(df: pd.DataFrame) -> pd.DataFrame:
+    """Tiêu đề giải thưởng, năm (năm cuối cùng xuất hiện trong tiêu đề, vd 'URAP 2023-2024' -> 2024) và mô tả."""
+    title = squash_whitespace(df["giải or top"])
+    content = squash_whitespace(df["content"])
+    year = pd.to_numeric(title.str.extract(r".*\b((?:19|20)\d{2})\b", expand=False), errors="coerce")
+
+    out = pd.DataFrame({"title": title, "year": year.astype("Int64"), "content": content})
+    out = out[out["title"].ne("")].drop_duplicates(subset=["title", "content"])
+    out["id"] = [stable_id("award", t, c) for t, c in zip(out["title"], out["content"])]
+    return out.reset_index(drop=True)
+
+
+# --- CHUYỂN THÀNH BẢN GHI {id, content, metadata} ---
+
+def iter_faculty_records(df: pd.DataFrame) -> Iterable[dict]:
+    for row in df.itertuples(index=False):
+        metadata = {
+            "degree": row.degree,
+            "name": row.name,
+            "position": row.position or "Không có dữ liệu",
+            "faculty": row.faculty,
+            "email": row.email or "Không có dữ liệu"
+        }
+        content = f"{row.degree} {row.name}, {metadata['position']}, Khoa {row.faculty}.".strip()
+        yield {"id": row.id, "content": content, "metadata": metadata}
+
+
+def iter_major_records(df: pd.DataFrame) -> Iterable[dict]:
+    for row in df.itertuples(index=False):
+        content = f"Ngành {row.ten_nganh}" + (f" (mã ngành {row.ma_nganh})" if row.ma_nganh else "") + "."
+        if row.chuyen_nganh:
+            content += f" Các chuyên ngành: {', '.join(row.chuyen_nganh)}."
+        yield {
+            "id": row.id,
+            "content": content,
+            "metadata": {
+                "ten_nganh": row.ten_nganh,
+                "ma_nganh": row.ma_nganh,
+                "to_hop_mon": row.to_hop_mon,
+                "chuyen_nganh": row.chuyen_nganh,
+                "url": row.url
+            }
+        }
+
+
+def iter_award_records(df: pd.DataFrame) -> Iterable[dict]:
+    for row in df.itertuples(index=False):
+        yield {
+            "id": row.id,
+            "content": row.content,
+            "metadata": {"title": row.title, "year": None if pd.isna(row.year) else int(row.year)}
+        }
+
+
+def write_json_array(path: Path, records: Iterable[dict]) -> int:
+    """Ghi lần lượt từng bản ghi thành một mảng JSON (file tạm rồi os.replace)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    count = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for record in records:
+            if count:
+                f.write(",\n")
+            f.write(json.dumps(record, ensure_ascii=False))
+            count += 1
+        f.write("\n]\n")
+    os.replace(tmp_path, path)
+    return count
+
+
+NORMALIZERS = {
+    "faculty": (normalize_faculty, iter_faculty_records),
+    "majors": (normalize_majors, iter_major_records),
+    "awards": (normalize_awards, iter_award_records)
+}
+
+# Các trường xác định một bản ghi (cùng các trường dùng cho stable_id), đọc từ bản ghi {id, content, metadata}
+RECORD_IDENTITY = {
+    "faculty": lambda r: identity_key(r["metadata"].get("faculty", ""), r["metadata"].get("name", "")),
+    "majors": lambda r: identity_key(r["metadata"].get("ten_nganh", "")),
+    "awards": lambda r: identity_key(r["metadata"].get("title", ""), r.get("content", ""))
+}
+
+
+def load_existing_ids(key: str, path: Path) -> Optional[dict]:
+    """
+    Id của các bản ghi trong file đã xử lý hiện có (khoá nhận dạng -> id), để bản ghi cũ giữ nguyên
+    id (evaluation_set.json, manifest và index tham chiếu theo id). Trả về {} nếu chưa có file,
+    None nếu file không đọc được (vd: con trỏ Git LFS chưa được `git lfs pull`).
+    """
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+    except ValueError:
+        return None
+    existing = {}
+    for record in records:
+        existing.setdefault(RECORD_IDENTITY[key](record), record["id"])
+    return existing
+
+
+def normalize_dataset(key: str, allow_new_ids: bool = False) -> bool:
+    """
+    Chuẩn hoá một file CSV thô thành file JSON trong data/processed. Bản ghi đã có trong file
+    hiện tại giữ id cũ; chỉ bản ghi mới nhận id dạng stable_id.
+    """
+    input_path = RAW_DATA_DIR / RAW_FILES[key]
+    output_path = PROCESSED_DATA_DIR / OUTPUT_FILES[key]
+    if not input_path.exists():
+        print(f"[LỖI] Không tìm thấy file đầu vào: {input_path}")
+        return False
+
+    existing_ids = load_existing_ids(key, output_path)
+    if existing_ids is None:
+        if not allow_new_ids:
+            print(f"[LỖI] Không đọc được {output_path} (con trỏ Git LFS?) nên không giữ được id cũ. "
+                  "Chạy `git lfs pull`, hoặc dùng --allow-new-ids nếu chấp nhận id mới.")
+            return False
+        existing_ids = {}
+
+    normalize, to_records = NORMALIZERS[key]
+    start = time.perf_counter()
+    raw = pd.read_csv(input_path, dtype=str, encoding="utf-8-sig")
+    cleaned = normalize(raw)
+    n_kept = 0
+
+    def records():
+        nonlocal n_kept
+        for record in to_records(cleaned):
+            old_id = existing_ids.get(RECORD_IDENTITY[key](record))
+            if old_id is not None:
+                record["id"] = old_id
+                n_kept += 1
+            yield record
+
+    count = write_json_array(output_path, records())
+    elapsed = time.perf_counter() - start
+    print(f"   -> {RAW_FILES[key]}: {len(raw)} dòng thô -> {count} bản ghi, giữ id cũ cho {n_kept} "
+          f"({elapsed * 1000:.0f} ms) -> {output_path.name}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chuẩn hoá dữ liệu CSV thô thành data/processed/*.json.")
+    # Không dùng `choices`: một số phiên bản argparse kiểm tra cả danh sách rỗng với nargs="*"
+    parser.add_argument("datasets", nargs="*", metavar="{" + ",".join(NORMALIZERS) + "}",
+                        help="Các bộ dữ liệu cần chuẩn hoá (mặc định: tất cả).")
+    parser.add_argument("--allow-new-ids", action="store_true",
+                        help="Vẫn ghi khi không đọc được file hiện có (mọi bản ghi nhận id mới).")
+    args = parser.parse_args()
+
+    unknown = [key for key in args.datasets if key not in NORMALIZERS]
+    if unknown:
+        parser.error(f"bộ dữ liệu không hợp lệ: {', '.join(unknown)} (chọn trong {', '.join(NORMALIZERS)})")
+    datasets = args.datasets or list(NORMALIZERS)
+
+    print("--- 🧹 Bắt đầu chuẩn hoá dữ liệu thô ---")
+    ok = all([normalize_dataset(key, args.allow_new_ids) for key in datasets])
+    print("--- ✅ Hoàn tất! ---" if ok else "--- ⚠️ Có file không được chuẩn hoá ---")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
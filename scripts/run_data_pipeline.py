@@ -0,0 +1,251 @@
+# scripts/run_data_pipeline.py
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Callable, Iterable, List
+
+# Thêm thư mục gốc vào Python Path để có thể import từ src và scripts
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.chatbot.config import DATA_DIR, RAW_DATA_DIR, PROCESSED_DATA_DIR, COLLECTION_NAME, SFT_MAX_SEQ_LENGTH
+from scripts import normalize_raw_data
+from scripts.enrich_all_data import INPUT_FILES, OUTPUT_FILES, enrich_dataset
+from scripts.build_database import build_chroma_db, manifest_path
+from scripts.create_qa_data import OUTPUT_TRAIN_PATH, OUTPUT_EVAL_PATH, main as create_qa_data
+from scripts.build_sft_dataset import manifest_paths as sft_manifest_paths, main as build_sft_dataset
+
+PIPELINE_STATE_PATH = DATA_DIR / "pipeline_state.json"
+DEFAULT_TARGETS = ["build_index"]
+
+
+class Stage:
+    """
+    Một bước của pipeline dữ liệu với các file đầu vào/đầu ra được khai báo.
+    Kết quả được ghi nhớ theo hash nội dung của đầu vào: nếu đầu vào không đổi
+    và đầu ra vẫn còn nguyên, bước này được bỏ qua.
+    Các bước dùng chung một tài nguyên trong `resources` (vd: cache embedding, bộ nhớ của
+    embedder) không bao giờ chạy song song với nhau, dù không phụ thuộc nhau.
+    """
+    def __init__(self, name: str, inputs: List[Path], outputs: List[Path], run: Callable[[], object], version: str = "1",
+                 resources: Iterable[str] = ()):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.version = version  # Tăng khi logic của bước thay đổi để buộc chạy lại
+        self.resources = set(resources)
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_key(stage: Stage) -> str:
+    """Khoá ghi nhớ: tên + phiên bản của bước và hash nội dung của từng đầu vào."""
+    digest = hashlib.sha256(f"{stage.name}:{stage.version}".encode('utf-8'))
+    for path in stage.inputs:
+        digest.update(str(path.relative_to(project_root)).encode('utf-8'))
+        digest.update(file_hash(path).encode('utf-8') if path.exists() else b'<missing>')
+    return digest.hexdigest()
+
+
+def define_stages() -> List[Stage]:
+    """Khai báo các bước của pipeline dữ liệu và quan hệ đầu vào/đầu ra giữa chúng."""
+    stages = []
+    # CSV thô -> data/processed/*.json
+    for key in normalize_raw_data.RAW_FILES:
+        stages.append(Stage(
+            name=f"normalize_{key}",
+            inputs=[RAW_DATA_DIR / normalize_raw_data.RAW_FILES[key]],
+            outputs=[PROCESSED_DATA_DIR / normalize_raw_data.OUTPUT_FILES[key]],
+            run=lambda key=key: normalize_raw_data.normalize_dataset(key)
+        ))
+
+    # Mỗi bộ dữ liệu được làm giàu ở một bước riêng: sửa một giải thưởng không làm giàu lại 1.600 giảng viên
+    for key in INPUT_FILES:
+        stages.append(Stage(
+            name=f"enrich_{key}",
+            inputs=[PROCESSED_DATA_DIR / INPUT_FILES[key]],
+            outputs=[PROCESSED_DATA_DIR / OUTPUT_FILES[key]],
+            run=lambda key=key: enrich_dataset(key)
+        ))
+
+    enriched_outputs = [PROCESSED_DATA_DIR / OUTPUT_FILES[key] for key in INPUT_FILES]
+    stages.append(Stage(
+        name="build_index",
+        inputs=enriched_outputs,
+        outputs=[manifest_path(COLLECTION_NAME)],
+        run=build_chroma_db,
+        resources={"embedding_cache"}
+    ))
+    stages.append(Stage(
+        name="create_qa",
+        inputs=enriched_outputs,
+        outputs=[OUTPUT_TRAIN_PATH, OUTPUT_EVAL_PATH],
+        run=create_qa_data,
+        version="2",  # câu hỏi tiêu cực lấy từ tài liệu gần nhất theo embedding
+        resources={"embedding_cache"}
+    ))
+    stages.append(Stage(
+        name="build_sft",
+        inputs=[OUTPUT_TRAIN_PATH, OUTPUT_EVAL_PATH],
+        outputs=sft_manifest_paths(),
+        run=build_sft_dataset,
+        version=f"1-{SFT_MAX_SEQ_LENGTH}"  # đổi độ dài chuỗi thì phải ghép lại
+    ))
+    return stages
+
+
+def load_state() -> dict:
+    if not PIPELINE_STATE_PATH.exists():
+        return {}
+    with open(PIPELINE_STATE_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state: dict):
+    tmp_path = PIPELINE_STATE_PATH.with_suffix(".json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, PIPELINE_STATE_PATH)
+
+
+def is_up_to_date(stage: Stage, state: dict) -> bool:
+    """Bước được coi là mới nhất khi khoá không đổi và các đầu ra chưa bị sửa bên ngoài pipeline."""
+    record = state.get(stage.name)
+    if not record or record["key"] != stage_key(stage):
+        return False
+    for path in stage.outputs:
+        rel = str(path.relative_to(project_root))
+        if not path.exists() or record["outputs"].get(rel) != file_hash(path):
+            return False
+    return True
+
+
+def select_stages(stages: List[Stage], targets: List[str]) -> List[Stage]:
+    """Chọn các bước cần thiết để tạo ra các target (bao gồm các bước phía trước)."""
+    producers = {path: stage for stage in stages for path in stage.outputs}
+    by_name = {stage.name: stage for stage in stages}
+    selected = {}
+
+    def visit(stage: Stage):
+        if stage.name in selected:
+            return
+        for path in stage.inputs:
+            if path in producers:
+                visit(producers[path])
+        selected[stage.name] = stage
+
+    for target in targets:
+        if target not in by_name:
+            raise ValueError(f"Không có bước nào tên '{target}'. Các bước: {', '.join(by_name)}")
+        visit(by_name[target])
+    return list(selected.values())
+
+
+def run_pipeline(targets: List[str], force: List[str], dry_run: bool, workers: int) -> bool:
+    stages = select_stages(define_stages(), targets)
+    producers = {path: stage.name for stage in stages for path in stage.outputs}
+    upstream = {
+        stage.name: {producers[path] for path in stage.inputs if path in producers}
+        for stage in stages
+    }
+    state = load_state()
+
+    print(f"--- 🔁 Pipeline dữ liệu: {', '.join(s.name for s in stages)} ---")
+    done, failed, skipped = set(), set(), set()
+    pending = {stage.name: stage for stage in stages}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            # Đưa vào chạy (song song) mọi bước mà các bước phía trước đã xong
+            for name, stage in list(pending.items()):
+                if upstream[name] & failed:
+                    print(f"   [BỎ QUA] {name}: bước phía trước bị lỗi.")
+                    failed.add(name)
+                    del pending[name]
+                    continue
+                if not upstream[name] <= done:
+                    continue
+                busy = {r for s in running.values() for r in s.resources}
+                if stage.resources & busy:
+                    # Tài nguyên dùng chung đang bị bước khác giữ: chờ bước đó xong
+                    continue
+                del pending[name]
+                # Khoá được tính sau khi các bước phía trước đã ghi xong đầu ra: nếu đầu ra
+                # của chúng không đổi về nội dung thì bước này vẫn được bỏ qua
+                if name not in force and is_up_to_date(stage, state):
+                    print(f"   [CACHE] {name}: đầu vào không thay đổi.")
+                    skipped.add(name)
+                    done.add(name)
+                    continue
+                if dry_run:
+                    print(f"   [SẼ CHẠY] {name}")
+                    done.add(name)
+                    continue
+                print(f"   [CHẠY] {name}...")
+                running[executor.submit(_run_stage, stage)] = stage
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    elapsed = future.result()
+                except Exception as e:
+                    print(f"   [LỖI] {stage.name}: {e}")
+                    failed.add(stage.name)
+                    continue
+                state[stage.name] = {
+                    "key": stage_key(stage),
+                    "outputs": {str(p.relative_to(project_root)): file_hash(p) for p in stage.outputs},
+                    "finished_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                }
+                save_state(state)
+                done.add(stage.name)
+                print(f"   [XONG] {stage.name} ({elapsed:.1f}s)")
+
+    print(f"--- Kết quả: {len(done) - len(skipped)} bước đã chạy, {len(skipped)} bước dùng cache, {len(failed)} bước lỗi ---")
+    return not failed
+
+
+def _run_stage(stage: Stage) -> float:
+    start = time.perf_counter()
+    result = stage.run()
+    if result is False:
+        raise RuntimeError("bước trả về thất bại")
+    missing = [str(p) for p in stage.outputs if not p.exists()]
+    if missing:
+        raise RuntimeError(f"không tạo ra các file đầu ra: {', '.join(missing)}")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy pipeline dữ liệu với cache theo hash nội dung.")
+    parser.add_argument("--targets", nargs="+", default=DEFAULT_TARGETS,
+                        help=f"Các bước cần tạo ra (mặc định: {' '.join(DEFAULT_TARGETS)}; thêm 'create_qa' để sinh lại dữ liệu fine-tune, 'build_sft' để tokenize và ghép chuỗi cho train).")
+    parser.add_argument("--force", nargs="*", default=[], help="Buộc chạy lại các bước này dù đầu vào không đổi.")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ in ra các bước sẽ chạy.")
+    parser.add_argument("--workers", type=int, default=4, help="Số bước độc lập chạy song song.")
+    args = parser.parse_args()
+
+    ok = run_pipeline(args.targets, set(args.force), args.dry_run, args.workers)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# src/chatbot/adapters.py
+
+import threading
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BASE_ADAPTER = "base"  # Tên đặc biệt: model gốc, tắt mọi adapter
+
+
+class UnknownAdapterError(ValueError):
+    """Được raise khi request chọn một adapter chưa được tải."""
+    def __init__(self, name: str, available: List[str]):
+        super().__init__(f"Không có adapter '{name}'. Các adapter đang phục vụ: {', '.join(available)}.")
+        self.name = name
+
+
+def is_adapter_source(source) -> bool:
+    """Adapter có thể là thư mục cục bộ đã tồn tại hoặc id repo trên Hugging Face Hub ('user/repo')."""
+    if not source:
+        return False
+    source = str(source)
+    if Path(source).exists():
+        return True
+    return source.count("/") == 1 and not source.startswith((".", "/", "~"))
+
+
+def _size_mb(n_bytes: int) -> float:
+    return round(n_bytes / 1024 ** 2, 1)
+
+
+class MultiAdapterModel:
+    """
+    Một model gốc (đã lượng tử hoá) dùng chung cho nhiều LoRA adapter có tên, không merge.
+    Adapter đang hoạt động là trạng thái của model, nên mọi lượt sinh phải đi qua
+    `use(name)`: khoá được giữ suốt lượt sinh (một request, hoặc cả một batch cùng adapter).
+    """
+    def __init__(self, base_model, adapters: Dict[str, str], default: Optional[str] = None):
+        from peft import PeftModel
+        self.base_size = base_model.get_memory_footprint()
+        self.model = None
+        self.names = []
+        for name, source in adapters.items():
+            if not is_adapter_source(source):
+                print(f"   -> [Cảnh báo] Bỏ qua adapter '{name}': không tìm thấy '{source}'.")
+                continue
+            try:
+                print(f"   -> Đang gắn adapter '{name}' từ: '{source}'")
+                if self.model is None:
+                    self.model = PeftModel.from_pretrained(base_model, str(source), adapter_name=name)
+                else:
+                    self.model.load_adapter(str(source), adapter_name=name)
+                self.names.append(name)
+            except Exception as e:
+                print(f"   -> [Cảnh báo] Không tải được adapter '{name}': {e}")
+        if self.model is None:
+            raise RuntimeError("Không tải được adapter nào trong LORA_ADAPTERS.")
+        self.model.eval()
+        self.default = default if default in self.names else self.names[0]
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> List[str]:
+        return self.names + [BASE_ADAPTER]
+
+    def resolve(self, name: Optional[str]) -> str:
+        name = name or self.default
+        if name not in self.available:
+            raise UnknownAdapterError(name, self.available)
+        return name
+
+    @contextmanager
+    def use(self, name: Optional[str] = None):
+        """Kích hoạt adapter `name` (mặc định: adapter mặc định) trong suốt khối `with`."""
+        name = self.resolve(name)
+        with self._lock:
+            if name == BASE_ADAPTER:
+                with self.model.disable_adapter():
+                    yield self.model
+            else:
+                self.model.set_adapter(name)
+                yield self.model
+
+    def memory_report(self) -> dict:
+        """Bộ nhớ của model gốc và của từng adapter (MB), so với việc tải mỗi biến thể một model đầy đủ."""
+        adapter_bytes = {name: 0 for name in self.names}
+        for param_name, param in self.model.named_parameters():
+            for name in self.names:
+                if "lora_" in param_name and f".{name}." in param_name:
+                    adapter_bytes[name] += param.numel() * param.element_size()
+        total = self.base_size + sum(adapter_bytes.values())
+        return {
+            "mode": "multi",
+            "base_model_mb": _size_mb(self.base_size),
+            "adapters_mb": {name: _size_mb(n) for name, n in adapter_bytes.items()},
+            "total_mb": _size_mb(total),
+            "separate_models_mb": _size_mb(self.base_size * len(self.available)),
+        }
+
+
+class SingleModel:
+    """Chế độ "merge": một model (đã merge adapter hoặc model gốc), giao diện giống MultiAdapterModel."""
+    def __init__(self, model, adapter_name: str):
+        self.model = model
+        self.default = adapter_name
+        self.available = [adapter_name]
+
+    def resolve(self, name: Optional[str]) -> str:
+        name = name or self.default
+        if name != self.default:
+            raise UnknownAdapterError(name, self.available)
+        return name
+
+    def use(self, name: Optional[str] = None):
+        self.resolve(name)
+        return nullcontext(self.model)
+
+    def memory_report(self) -> dict:
+        size = _size_mb(self.model.get_memory_footprint())
+        return {"mode": "merge", "base_model_mb": size, "adapters_mb": {}, "total_mb": size, "separate_models_mb": size}
@@ -0,0 +1,143 @@
+# src/chatbot/admission.py
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import NamedTuple, Optional, Tuple
+
+from src.chatbot.config import (
+    ADMISSION_ENABLED,
+    ADMISSION_SLO_P95_MS,
+    ADMISSION_QUEUE_THRESHOLDS,
+    ADMISSION_LATENCY_WINDOW,
+    ADMISSION_ADJUST_SECONDS,
+    ADMISSION_RECOVERY_RATIO,
+    ADMISSION_SHALLOW_RETRIEVE,
+    ADMISSION_GENERATE_CONCURRENCY
+)
+from src.chatbot.tracing import tracer
+
+MIN_LATENCY_SAMPLES = 5  # Số request tối thiểu trong cửa sổ trước khi đổi mức theo độ trễ
+
+
+class ServiceTier(NamedTuple):
+    """Một mức phục vụ: độ sâu truy xuất, có tái xếp hạng hay không và cách tạo câu trả lời."""
+    name: str
+    n_retrieve: Optional[int]  # None: N_RETRIEVE_RESULTS
+    rerank: bool
+    answer_mode: str  # "generate" (LLM) | "extractive" (trích câu từ context) | "sources" (chỉ trả về nguồn)
+
+
+# Thứ tự giảm tải: mỗi mức bỏ bớt một phần tốn kém của mức trước
+SERVICE_TIERS: Tuple[ServiceTier, ...] = (
+    ServiceTier("full", None, True, "generate"),
+    ServiceTier("shallow", ADMISSION_SHALLOW_RETRIEVE, True, "generate"),
+    ServiceTier("no_rerank", ADMISSION_SHALLOW_RETRIEVE, False, "generate"),
+    ServiceTier("extractive", ADMISSION_SHALLOW_RETRIEVE, False, "extractive"),
+    ServiceTier("sources_only", ADMISSION_SHALLOW_RETRIEVE, False, "sources"),
+)
+FULL_TIER = SERVICE_TIERS[0]
+SOURCES_ONLY_TIER = SERVICE_TIERS[-1]
+
+
+def _p95(values) -> float:
+    ordered = sorted(values)
+    return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+class AdmissionController:
+    """
+    Chọn mức phục vụ cho mỗi request theo hai tín hiệu, lấy mức thấp hơn:
+    - Độ sâu hàng đợi: số request đang xử lý (kể cả request mới) so với `queue_thresholds`;
+      phản ứng ngay khi có đợt tăng đột ngột.
+    - Độ trễ gần đây: p95 của `latency_window` request gần nhất vượt SLO thì giảm một mức,
+      dưới `SLO * recovery_ratio` (hoặc không còn request) thì lên lại một mức. Mỗi lần đổi
+      cách nhau ít nhất `adjust_seconds` giây để tránh dao động.
+    Lượt sinh bằng LLM đi qua `generation_slot()`, nên request ở các mức không dùng LLM không
+    phải xếp hàng sau LLM. Khi tắt, mọi request được phục vụ ở mức "full" như trước.
+    """
+    def __init__(self, enabled: bool = ADMISSION_ENABLED, slo_p95_ms: float = ADMISSION_SLO_P95_MS,
+                 queue_thresholds: Tuple[int, ...] = ADMISSION_QUEUE_THRESHOLDS,
+                 latency_window: int = ADMISSION_LATENCY_WINDOW, adjust_seconds: float = ADMISSION_ADJUST_SECONDS,
+                 recovery_ratio: float = ADMISSION_RECOVERY_RATIO,
+                 generate_concurrency: int = ADMISSION_GENERATE_CONCURRENCY):
+        self.enabled = enabled
+        self.slo_p95_ms = slo_p95_ms
+        self.queue_thresholds = tuple(sorted(queue_thresholds))
+        self.adjust_seconds = adjust_seconds
+        self.recovery_ratio = recovery_ratio
+        self.in_flight = 0
+        self._latency_tier = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._last_adjust = time.monotonic()
+        self._lock = threading.Lock()
+        self._generation = threading.BoundedSemaphore(generate_concurrency)
+
+    @contextmanager
+    def admit(self):
+        """Nhận một request và trả về ServiceTier phục vụ nó; độ trễ được ghi lại khi khối `with` kết thúc."""
+        if not self.enabled:
+            yield FULL_TIER
+            return
+        with self._lock:
+            self.in_flight += 1
+            self._maybe_adjust(time.monotonic())
+            tier = SERVICE_TIERS[self._tier_index()]
+        tracer.count("admission_requests", tier=tier.name)
+        start = time.perf_counter()
+        try:
+            yield tier
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.in_flight -= 1
+                self._latencies.append(latency_ms)
+                self._maybe_adjust(time.monotonic())
+
+    def generation_slot(self):
+        """Giới hạn số lượt sinh bằng LLM chạy đồng thời (ADMISSION_GENERATE_CONCURRENCY)."""
+        if not self.enabled:
+            return nullcontext()
+        return self._generation
+
+    def _tier_index(self) -> int:
+        queue_tier = sum(self.in_flight >= threshold for threshold in self.queue_thresholds)
+        return min(max(queue_tier, self._latency_tier), len(SERVICE_TIERS) - 1)
+
+    def _maybe_adjust(self, now: float):
+        """Đổi mức theo độ trễ (gọi khi đang giữ `_lock`)."""
+        if now - self._last_adjust < self.adjust_seconds:
+            return
+        previous = self._latency_tier
+        if len(self._latencies) >= MIN_LATENCY_SAMPLES:
+            p95 = _p95(self._latencies)
+            if p95 > self.slo_p95_ms:
+                self._latency_tier = min(self._latency_tier + 1, len(SERVICE_TIERS) - 1)
+            elif p95 < self.slo_p95_ms * self.recovery_ratio:
+                self._latency_tier = max(self._latency_tier - 1, 0)
+        elif self._latency_tier > 0 and self.in_flight <= 1:
+            # Gần như không còn request: không có bằng chứng quá tải, lên lại một mức
+            p95 = None
+            self._latency_tier -= 1
+        else:
+            return
+        self._last_adjust = now
+        self._latencies.clear()
+        if self._latency_tier != previous:
+            p95_text = f"p95 {p95:.0f} ms" if p95 is not None else "không còn request"
+            print(f"🚦 Admission control: mức theo độ trễ {SERVICE_TIERS[previous].name} -> "
+                  f"{SERVICE_TIERS[self._latency_tier].name} ({p95_text}, SLO {self.slo_p95_ms:.0f} ms).")
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "tier": SERVICE_TIERS[self._tier_index()].name,
+                "latency_tier": SERVICE_TIERS[self._latency_tier].name,
+                "recent_p95_ms": round(_p95(self._latencies), 1) if self._latencies else None,
+                "slo_p95_ms": self.slo_p95_ms,
+            }
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,297 @@
+# src/chatbot/api_server.py
+
+import sys
+import json
+import asyncio
+import functools
+import contextvars
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Thêm thư mục gốc của dự án vào Python Path
+project_root = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(project_root))
+
+from aiohttp import web
+
+from src.chatbot.config import (
+    API_HOST,
+    API_PORT,
+    API_RETRIEVE_CONCURRENCY,
+    API_RETRIEVE_QUEUE_SIZE,
+    API_GENERATE_CONCURRENCY,
+    API_GENERATE_QUEUE_SIZE,
+    API_MAX_QUERY_CHARS,
+    API_RETRY_AFTER_SECONDS,
+    REQUEST_DEADLINE_SECONDS
+)
+from src.chatbot.tracing import tracer
+from src.chatbot.memory_manager import memory_manager
+from src.chatbot.admission import admission_controller
+from src.chatbot.cancellation import CancellationToken
+
+
+class StageOverloadedError(Exception):
+    """Được raise khi hàng đợi của một stage đã đầy."""
+    def __init__(self, stage_name: str):
+        super().__init__(f"Stage '{stage_name}' đang quá tải.")
+        self.stage_name = stage_name
+
+
+class StageLimiter:
+    """
+    Giới hạn số request đang xử lý của một stage (retrieve / generate).
+    Các lời gọi mô hình được chạy trong executor riêng của stage để không chặn
+    event loop; request vượt quá `concurrency + queue_size` bị từ chối ngay.
+    """
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"{name}-stage")
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._pending
+
+    async def run(self, func, *args, **kwargs):
+        """Chạy `func` trong executor của stage, raise StageOverloadedError nếu hàng đợi đầy."""
+        if self._pending >= self.concurrency + self.queue_size:
+            raise StageOverloadedError(self.name)
+
+        self._pending += 1
+        try:
+            # Chờ trong event loop (có thể huỷ được) thay vì trong hàng đợi của executor
+            with tracer.span(f"{self.name}_queue_wait"):
+                await self._semaphore.acquire()
+            try:
+                loop = asyncio.get_running_loop()
+                # run_in_executor không mang theo contextvars: chép context để span trong
+                # thread của executor được gắn vào trace của request
+                context = contextvars.copy_context()
+                return await loop.run_in_executor(
+                    self.executor, functools.partial(context.run, func, *args, **kwargs)
+                )
+            finally:
+                self._semaphore.release()
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- TRẠNG THÁI ỨNG DỤNG ---
+STATE_KEY = web.AppKey("state", dict)
+STAGES_KEY = web.AppKey("stages", dict)
+
+
+def _load_pipeline(app: web.Application):
+    """Tải RAGPipeline (chạy trong thread nền để /health trả lời được ngay)."""
+    # Import muộn để server khởi động nhanh và /health phản hồi trong lúc tải mô hình
+    from src.chatbot.pipeline import RAGPipeline
+
+    state = app[STATE_KEY]
+    try:
+        state["pipeline"] = RAGPipeline()
+        state["status"] = "ready"
+        print("✅ API server đã sẵn sàng nhận request!")
+    except Exception as e:
+        state["status"] = "error"
+        state["error"] = str(e)
+        print(f"[LỖI NGHIÊM TRỌNG] Không thể khởi tạo RAG Pipeline: {e}")
+
+
+async def _on_startup(app: web.Application):
+    app[STAGES_KEY] = {
+        "retrieve": StageLimiter("retrieve", API_RETRIEVE_CONCURRENCY, API_RETRIEVE_QUEUE_SIZE),
+        "generate": StageLimiter("generate", API_GENERATE_CONCURRENCY, API_GENERATE_QUEUE_SIZE),
+    }
+    loop = asyncio.get_running_loop()
+    app[STATE_KEY]["loader"] = loop.run_in_executor(None, _load_pipeline, app)
+
+
+async def _on_cleanup(app: web.Application):
+    for stage in app[STAGES_KEY].values():
+        stage.shutdown()
+
+
+# --- HÀM HỖ TRỢ ---
+def _json_error(status: int, message: str, headers: dict = None) -> web.Response:
+    return web.json_response({"error": message}, status=status, headers=headers)
+
+
+def _http_error(error_class, message: str, headers: dict = None) -> web.HTTPException:
+    """Tạo HTTPException với body JSON để raise từ các hàm hỗ trợ."""
+    return error_class(
+        text=json.dumps({"error": message}, ensure_ascii=False),
+        content_type="application/json",
+        headers=headers
+    )
+
+
+async def _read_query(request: web.Request) -> tuple:
+    """
+    Đọc và kiểm tra các trường `query`, `session_id`, `adapter` và `timeout_seconds` (tuỳ chọn)
+    trong body JSON. `timeout_seconds` chỉ rút ngắn được deadline REQUEST_DEADLINE_SECONDS.
+    """
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise _http_error(web.HTTPBadRequest, "Body phải là JSON hợp lệ.")
+
+    query = payload.get("query") if isinstance(payload, dict) else None
+    if not isinstance(query, str) or not query.strip():
+        raise _http_error(web.HTTPBadRequest, "Thiếu trường 'query'.")
+    if len(query) > API_MAX_QUERY_CHARS:
+        raise _http_error(web.HTTPBadRequest, f"Câu hỏi dài quá {API_MAX_QUERY_CHARS} ký tự.")
+
+    session_id = payload.get("session_id")
+    if session_id is not None and not isinstance(session_id, str):
+        raise _http_error(web.HTTPBadRequest, "Trường 'session_id' phải là chuỗi.")
+
+    adapter = payload.get("adapter")
+    if adapter is not None and not isinstance(adapter, str):
+        raise _http_error(web.HTTPBadRequest, "Trường 'adapter' phải là chuỗi.")
+
+    timeout = payload.get("timeout_seconds", REQUEST_DEADLINE_SECONDS)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+        raise _http_error(web.HTTPBadRequest, "Trường 'timeout_seconds' phải là số dương.")
+    return query.strip(), session_id, adapter, min(timeout, REQUEST_DEADLINE_SECONDS)
+
+
+def _get_ready_pipeline(request: web.Request):
+    if request.app[STATE_KEY]["status"] != "ready":
+        raise _http_error(
+            web.HTTPServiceUnavailable,
+            "Chatbot đang khởi động, vui lòng thử lại sau.",
+            headers={"Retry-After": str(API_RETRY_AFTER_SECONDS)}
+        )
+    return request.app[STATE_KEY]["pipeline"]
+
+
+def _overloaded(e: StageOverloadedError) -> web.Response:
+    return _json_error(
+        429,
+        f"Hệ thống đang quá tải ở bước '{e.stage_name}', vui lòng thử lại sau.",
+        headers={"Retry-After": str(API_RETRY_AFTER_SECONDS)}
+    )
+
+
+# --- ENDPOINTS ---
+async def health(request: web.Request) -> web.Response:
+    """Readiness probe: 200 khi các mô hình đã tải xong, 503 khi đang tải hoặc lỗi."""
+    state = request.app[STATE_KEY]
+    stages = request.app[STAGES_KEY]
+    body = {
+        "status": state["status"],
+        "in_flight": {name: stage.in_flight for name, stage in stages.items()},
+    }
+    # Không đọc thông tin adapter khi LLM đang bị gỡ: health probe không được kéo LLM trở lại bộ nhớ
+    if state["status"] == "ready" and memory_manager.is_loaded("llm"):
+        llm = state["pipeline"].llm
+        body["adapters"] = {"available": list(llm.available), "default": llm.default}
+    if memory_manager.enabled:
+        body["memory"] = memory_manager.report()
+    if admission_controller.enabled:
+        body["admission"] = admission_controller.report()
+    if state["status"] == "error":
+        body["error"] = state["error"]
+    return web.json_response(body, status=200 if state["status"] == "ready" else 503)
+
+
+async def retrieve(request: web.Request) -> web.Response:
+    """Trả về các tài liệu đã được truy xuất và tái xếp hạng cho câu hỏi."""
+    with tracer.span("http_retrieve") as span:
+        query, session_id, _, timeout = await _read_query(request)
+        pipeline = _get_ready_pipeline(request)
+        cancel_token = CancellationToken(timeout)
+
+        try:
+            docs = await request.app[STAGES_KEY]["retrieve"].run(
+                pipeline.get_context, query, session_id, cancel_token=cancel_token
+            )
+        except StageOverloadedError as e:
+            span.set(status=429)
+            return _overloaded(e)
+        except asyncio.CancelledError:
+            # Client đã ngắt kết nối: dừng phần việc còn lại trong thread của executor
+            cancel_token.cancel("client_disconnected")
+            raise
+
+        span.set(status=200)
+        return web.json_response({"query": query, "documents": docs})
+
+
+async def answer(request: web.Request) -> web.Response:
+    """Trả về câu trả lời của LLM cùng với các nguồn đã dùng."""
+    with tracer.span("http_answer") as span:
+        query, session_id, adapter, timeout = await _read_query(request)
+        pipeline = _get_ready_pipeline(request)
+        stages = request.app[STAGES_KEY]
+        cancel_token = CancellationToken(timeout)
+
+        try:
+            # Khi LLM đã bị gỡ, kiểm tra adapter có thể tải lại cả model: chạy trong executor của
+            # stage generate để không chặn event loop (và /health, /metrics) trong lúc tải
+            adapter = await stages["generate"].run(pipeline.resolve_adapter, adapter)
+        except ValueError as e:  # UnknownAdapterError (không import ở đây để server khởi động nhanh)
+            span.set(status=400)
+            return _json_error(400, str(e))
+        except StageOverloadedError as e:
+            span.set(status=429)
+            return _overloaded(e)
+
+        try:
+            # Mức phục vụ được chọn theo tải hiện tại (luôn là "full" khi tắt ADMISSION_ENABLED)
+            with pipeline.admission.admit() as tier:
+                docs = await stages["retrieve"].run(pipeline.get_context, query, session_id, tier, cancel_token)
+                if tier.answer_mode == "generate":
+                    result = await stages["generate"].run(
+                        pipeline.answer_from_docs, query, docs, adapter, tier, cancel_token
+                    )
+                else:
+                    # Trích câu hoặc chỉ trả về nguồn: không tốn LLM nên không xếp hàng ở stage generate
+                    result = pipeline.answer_from_docs(query, docs, adapter, tier, cancel_token)
+        except StageOverloadedError as e:
+            span.set(status=429)
+            return _overloaded(e)
+        except asyncio.CancelledError:
+            # Client đã ngắt kết nối (hoặc hết thời gian chờ): LLM dừng ở token kế tiếp thay vì sinh hết câu trả lời
+            cancel_token.cancel("client_disconnected")
+            span.set(status="cancelled")
+            raise
+
+        span.set(status=200, adapter=adapter, tier=result["tier"])
+        return web.json_response({"query": query, "adapter": adapter, **result})
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """Histogram thời gian theo span và các counter (token, cache) ở định dạng văn bản của Prometheus."""
+    return web.Response(
+        text=tracer.render_metrics(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+def create_app() -> web.Application:
+    """Tạo ứng dụng aiohttp với các route /health, /metrics, /retrieve và /answer."""
+    app = web.Application(client_max_size=64 * 1024)
+    app[STATE_KEY] = {"status": "loading"}
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    app.add_routes([
+        web.get("/health", health),
+        web.get("/metrics", metrics),
+        web.post("/retrieve", retrieve),
+        web.post("/answer", answer),
+    ])
+    return app
+
+
+if __name__ == "__main__":
+    print(f"--- 🚀 Đang khởi động API server tại http://{API_HOST}:{API_PORT} ---")
+    # handler_cancellation: huỷ handler khi client ngắt kết nối để dừng request đang chạy
+    web.run_app(create_app(), host=API_HOST, port=API_PORT, handler_cancellation=True)
@@ -0,0 +1,292 @@
+# src/chatbot/backends.py
+
+import hashlib
+import re
+import unicodedata
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.chatbot.config import (
+    EMBEDDING_BACKEND, RERANKER_BACKEND, GENERATOR_BACKEND,
+    EMBEDDING_MODEL_NAME, RERANKER_MODEL_NAME, LLM_MODEL_NAME, DEVICE,
+    LORA_ADAPTER_PATH, LORA_SERVING_MODE, LORA_ADAPTERS, DEFAULT_ADAPTER,
+    HASHING_EMBEDDING_DIM, EXTRACTIVE_MIN_OVERLAP
+)
+
+# Các backend "hf" tải mô hình từ Hugging Face Hub (import thư viện nặng khi cần);
+# các backend còn lại là bản thay thế nhẹ, tất định, chạy offline trong vài giây.
+WORD_PATTERN = re.compile(r"\w+")
+NOT_FOUND_ANSWER = "Xin lỗi, tôi không tìm thấy thông tin này trong tài liệu được cung cấp."
+
+
+def _words(text: str) -> List[str]:
+    return WORD_PATTERN.findall(unicodedata.normalize("NFC", text).lower())
+
+
+def _stable_hash(feature: str) -> int:
+    # hash() của Python thay đổi theo tiến trình; embedding phải giống nhau giữa các lần chạy
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# --- EMBEDDER ---
+class HashingEmbedder:
+    """
+    Embedding dạng "hashing trick": từ đơn và cặp từ liền nhau được băm vào `dim` chiều
+    (kèm dấu ±), trọng số log(1 + tần suất), chuẩn hoá L2. Cùng giao diện `encode` với SentenceTransformer.
+    """
+    def __init__(self, dim: int = HASHING_EMBEDDING_DIM):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        words = _words(text)
+        counts = {}
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            counts[feature] = counts.get(feature, 0) + 1
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in counts.items():
+            h = _stable_hash(feature)
+            vector[h % self.dim] += (1.0 if h >> 63 else -1.0) * np.log1p(count)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            return self._embed(sentences)
+        if not len(sentences):
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.stack([self._embed(text) for text in sentences])
+
+
+# --- RERANKER ---
+class LexicalReranker:
+    """
+    Chấm điểm cặp (câu hỏi, đoạn văn) theo độ trùng từ: tỉ lệ từ của câu hỏi có trong đoạn văn,
+    cộng thêm cho các cặp từ liền nhau trùng khớp. Điểm trong [0, 1], cùng giao diện `predict` với CrossEncoder.
+    """
+    def predict(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        return np.asarray([self._score(query, passage) for query, passage in sentences], dtype=np.float32)
+
+    @staticmethod
+    def _score(query: str, passage: str) -> float:
+        query_words, passage_words = _words(query), _words(passage)
+        if not query_words or not passage_words:
+            return 0.0
+        passage_set = set(passage_words)
+        unigram = sum(1 for w in set(query_words) if w in passage_set) / len(set(query_words))
+        query_bigrams = set(zip(query_words, query_words[1:]))
+        if not query_bigrams:
+            return unigram
+        bigram = len(query_bigrams & set(zip(passage_words, passage_words[1:]))) / len(query_bigrams)
+        return 0.7 * unigram + 0.3 * bigram
+
+
+# --- GENERATOR ---
+class SimpleChatTokenizer:
+    """Tokenizer tối thiểu cho backend không dùng mô hình: chat template kiểu Phi-3, token = từ."""
+    bos_token = None
+    eos_token = "<|end|>"
+    pad_token = eos_token
+    pad_token_id = 0
+    padding_side = "right"
+
+    def apply_chat_template(self, messages: List[dict], tokenize: bool = False, add_generation_prompt: bool = False):
+        text = "".join(f"<|{m['role']}|>\n{m['content']}<|end|>\n" for m in messages)
+        if add_generation_prompt:
+            text += "<|assistant|>\n"
+        return self.encode(text) if tokenize else text
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> List[int]:
+        return [_stable_hash(word) % 32000 for word in _words(text)]
+
+
+class LocalModel:
+    """Đứng vào chỗ model transformers cho SingleModel (báo cáo bộ nhớ, thiết bị)."""
+    device = "cpu"
+
+    def get_memory_footprint(self) -> int:
+        return 0
+
+
+class ExtractiveGenerator:
+    """
+    "Sinh" câu trả lời bằng cách trích câu trong Context trùng nhiều từ nhất với câu hỏi; nếu độ
+    trùng thấp hơn EXTRACTIVE_MIN_OVERLAP thì trả lời không tìm thấy. Gọi được như pipeline
+    "text-generation" (cùng tham số và định dạng kết quả); `stopping_criteria` là một hàm không
+    tham số, được gọi sau mỗi từ và dừng khi trả về True.
+    """
+    SEGMENT_SEPARATOR = re.compile(r"\s*(?:\n+|;\s+|(?<=[.!?…])\s+)\s*")
+
+    def __init__(self, min_overlap: float = EXTRACTIVE_MIN_OVERLAP):
+        self.tokenizer = SimpleChatTokenizer()
+        self.model = LocalModel()
+        self.min_overlap = min_overlap
+
+    @staticmethod
+    def _parse_prompt(prompt: str) -> Tuple[str, str]:
+        """Tách context và câu hỏi khỏi lượt user cuối cùng của prompt (định dạng của _build_prompt và eval.jsonl)."""
+        user = prompt.rsplit("<|user|>", 1)[-1].split("<|end|>", 1)[0]
+        context = user.split("'''")[1] if user.count("'''") >= 2 else ""
+        question = user.rsplit("câu hỏi sau:", 1)[-1] if "câu hỏi sau:" in user else user
+        return context, question.strip()
+
+    def answer(self, prompt: str) -> str:
+        return self.extract(*self._parse_prompt(prompt))
+
+    def extract(self, context: str, question: str) -> str:
+        """Câu (đoạn) trong `context` khớp nhất với `question`, hoặc câu trả lời không tìm thấy."""
+        question_words = set(_words(question))
+        best, best_overlap = None, 0.0
+        for segment in self.SEGMENT_SEPARATOR.split(context):
+            if not segment.strip() or segment.strip() == "---":
+                continue
+            overlap = len(question_words & set(_words(segment))) / max(len(question_words), 1)
+            if overlap > best_overlap:
+                best, best_overlap = segment.strip(), overlap
+        return best if best is not None and best_overlap >= self.min_overlap else NOT_FOUND_ANSWER
+
+    def __call__(self, prompt: str, max_new_tokens: int = 512, return_full_text: bool = True,
+                 stopping_criteria=None, **kwargs) -> List[dict]:
+        words = self.answer(prompt).split(" ")[:max_new_tokens]
+        generated = []
+        for i, word in enumerate(words):
+            generated.append(word)
+            if stopping_criteria is not None and stopping_criteria():
+                break
+        text = " ".join(generated)
+        return [{"generated_text": prompt + text if return_full_text else text}]
+
+
+# --- CÁC LOADER "hf" ---
+def _load_sentence_transformer():
+    from sentence_transformers import SentenceTransformer
+    print(f"   -> Đang tải Embedding Model: '{EMBEDDING_MODEL_NAME}' trên '{DEVICE}'...")
+    return SentenceTransformer(EMBEDDING_MODEL_NAME, device=DEVICE)
+
+
+def _load_cross_encoder():
+    from sentence_transformers import CrossEncoder
+    print(f"   -> Đang tải Re-ranker Model: '{RERANKER_MODEL_NAME}' trên '{DEVICE}'...")
+    return CrossEncoder(RERANKER_MODEL_NAME, max_length=512, device=DEVICE)
+
+
+def _load_hf_generator():
+    """
+    Tải LLM lượng tử hoá 4-bit và trả về (handle adapter, pipeline "text-generation").
+    - LORA_SERVING_MODE = "merge": nếu tìm thấy LoRA adapter, adapter được merge vào model gốc;
+      ngược lại dùng model gốc.
+    - LORA_SERVING_MODE = "multi": model gốc được tải một lần và gắn các adapter trong
+      LORA_ADAPTERS theo tên, mỗi request chọn adapter qua tham số `adapter`.
+    """
+    import torch
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, pipeline
+    from src.chatbot.adapters import BASE_ADAPTER, MultiAdapterModel, SingleModel, is_adapter_source
+
+    # Cấu hình quantization phải giống hệt như lúc train
+    bnb_config = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.bfloat16,
+        bnb_4bit_use_double_quant=False,
+    )
+    print(f"   -> Đang tải model gốc: '{LLM_MODEL_NAME}' trên '{DEVICE}'...")
+    base_model = AutoModelForCausalLM.from_pretrained(
+        LLM_MODEL_NAME,
+        quantization_config=bnb_config,
+        device_map=DEVICE,
+        trust_remote_code=True
+    )
+
+    if LORA_SERVING_MODE == "multi":
+        llm = MultiAdapterModel(base_model, LORA_ADAPTERS, DEFAULT_ADAPTER)
+        model = llm.model
+    elif is_adapter_source(LORA_ADAPTER_PATH):
+        print(f"   -> Tìm thấy LoRA adapter! Đang áp dụng từ: '{LORA_ADAPTER_PATH}'")
+        model = PeftModel.from_pretrained(base_model, str(LORA_ADAPTER_PATH))
+        # Hợp nhất các trọng số của adapter vào model gốc để tăng tốc độ inference.
+        print("   -> Đang hợp nhất (merging) LoRA adapter...")
+        model = model.merge_and_unload()
+        print("   -> Hợp nhất thành công!")
+        llm = SingleModel(model, DEFAULT_ADAPTER)
+    else:
+        print("   -> Không tìm thấy LoRA adapter. Sử dụng model gốc.")
+        model = base_model
+        llm = SingleModel(model, BASE_ADAPTER)
+
+    tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_NAME)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "right"
+    return llm, pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+
+def _load_extractive_generator():
+    from src.chatbot.adapters import BASE_ADAPTER, SingleModel
+    print("   -> Dùng bộ sinh trích xuất (không tải LLM).")
+    generator = ExtractiveGenerator()
+    return SingleModel(generator.model, BASE_ADAPTER), generator
+
+
+# --- REGISTRY ---
+# Mỗi loại mô hình: tên backend -> (hàm tải, id mô hình dùng làm khoá cache/manifest)
+EMBEDDERS: Dict[str, Tuple[Callable, Callable[[], str]]] = {
+    "hf": (_load_sentence_transformer, lambda: EMBEDDING_MODEL_NAME),
+    "hashing": (HashingEmbedder, lambda: f"hashing-{HASHING_EMBEDDING_DIM}"),
+}
+RERANKERS: Dict[str, Tuple[Callable, Callable[[], str]]] = {
+    "hf": (_load_cross_encoder, lambda: RERANKER_MODEL_NAME),
+    "lexical": (LexicalReranker, lambda: "lexical-overlap"),
+}
+GENERATORS: Dict[str, Tuple[Callable, Callable[[], str]]] = {
+    "hf": (_load_hf_generator, lambda: LLM_MODEL_NAME),
+    "extractive": (_load_extractive_generator, lambda: "extractive"),
+}
+
+
+def register_backend(registry: dict, name: str, loader: Callable, model_id: Callable[[], str]):
+    """Thêm một backend (vd: một mô hình production nhỏ hơn) vào EMBEDDERS / RERANKERS / GENERATORS."""
+    registry[name] = (loader, model_id)
+
+
+def _lookup(registry: dict, kind: str, name: str):
+    if name not in registry:
+        raise ValueError(f"Không có {kind} backend '{name}'. Các backend: {', '.join(registry)}.")
+    return registry[name]
+
+
+def load_embedder(name: Optional[str] = None):
+    return _lookup(EMBEDDERS, "embedding", name or EMBEDDING_BACKEND)[0]()
+
+
+def load_reranker(name: Optional[str] = None):
+    return _lookup(RERANKERS, "reranker", name or RERANKER_BACKEND)[0]()
+
+
+def load_generator(name: Optional[str] = None):
+    """Trả về (handle adapter: resolve/use/memory_report, pipeline "text-generation" hoặc tương đương)."""
+    return _lookup(GENERATORS, "generator", name or GENERATOR_BACKEND)[0]()
+
+
+def embedding_model_id(name: Optional[str] = None) -> str:
+    """Id của embedder đang cấu hình: khoá của EmbeddingCache và của manifest index (đổi backend -> build lại)."""
+    return _lookup(EMBEDDERS, "embedding", name or EMBEDDING_BACKEND)[1]()
+
+
+def reranker_model_id(name: Optional[str] = None) -> str:
+    return _lookup(RERANKERS, "reranker", name or RERANKER_BACKEND)[1]()
+
+
+def generator_model_id(name: Optional[str] = None) -> str:
+    return _lookup(GENERATORS, "generator", name or GENERATOR_BACKEND)[1]()
+
+
+def load_token_counter(name: Optional[str] = None) -> Callable[[str], int]:
+    """Đếm token theo embedder đang cấu hình (giới hạn độ dài chunk)."""
+    name = name or EMBEDDING_BACKEND
+    if name == "hf":
+        from src.chatbot.chunking import load_token_counter as load_hf_token_counter
+        return load_hf_token_counter(EMBEDDING_MODEL_NAME)
+    return lambda text: len(_words(text))
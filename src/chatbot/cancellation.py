@@ -0,0 +1,82 @@
+# src/chatbot/cancellation.py
+
+import threading
+import time
+from functools import lru_cache
+from typing import Optional
+
+
+class RequestCancelled(Exception):
+    """Được raise giữa các stage khi request đã bị huỷ (người dùng đóng tab, gửi lại, client ngắt kết nối)."""
+    def __init__(self, reason: str):
+        super().__init__(f"Request đã bị huỷ ({reason}).")
+        self.reason = reason
+
+
+class CancellationToken:
+    """
+    Trạng thái huỷ và deadline của một request, được truyền qua get_answer xuống từng stage:
+    - `cancel()`: kết quả không còn ai nhận, công việc còn lại bị bỏ ngay (RequestCancelled).
+    - Deadline (`timeout` giây kể từ khi tạo): dừng các bước tốn kém còn lại và trả về
+      kết quả dở dang (bỏ rerank, câu trả lời đã sinh được, hoặc chỉ các nguồn).
+    An toàn giữa các thread: có thể huỷ từ event loop hay thread của Gradio trong khi
+    request đang chạy ở thread khác.
+    """
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason: Optional[str] = None
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    @property
+    def should_stop(self) -> bool:
+        return self.cancelled or self.expired
+
+    def remaining(self) -> Optional[float]:
+        """Số giây còn lại trước deadline (None nếu không có deadline)."""
+        return None if self.deadline is None else max(self.deadline - time.monotonic(), 0.0)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+
+@lru_cache(maxsize=None)
+def _criteria_class():
+    # Import muộn: chỉ cần transformers khi thực sự sinh câu trả lời
+    import torch
+    from transformers import StoppingCriteria
+
+    class CancellationCriteria(StoppingCriteria):
+        """Dừng `generate` ở token kế tiếp khi request bị huỷ hoặc hết deadline."""
+        def __init__(self, token: CancellationToken):
+            self.token = token
+
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), self.token.should_stop, dtype=torch.bool, device=input_ids.device)
+
+    return CancellationCriteria
+
+
+def stopping_criteria(token: CancellationToken, backend: str = "hf"):
+    """
+    Tham số `stopping_criteria` cho lượt sinh: StoppingCriteriaList cho pipeline "text-generation"
+    của backend "hf"; các backend khác (vd: "extractive") nhận một hàm không tham số trả về True khi
+    cần dừng, nên không cần torch hay transformers.
+    """
+    if backend != "hf":
+        return lambda: token.should_stop
+    from transformers import StoppingCriteriaList
+    return StoppingCriteriaList([_criteria_class()(token)])
@@ -0,0 +1,103 @@
+# src/chatbot/chunking.py
+
+import re
+from typing import Callable, Dict, List
+
+from src.chatbot.config import CHUNK_MAX_TOKENS
+
+# Ranh giới trường: xuống dòng hoặc dấu ';' (các trường ghép trong dữ liệu crawl)
+FIELD_SEPARATOR = re.compile(r"\s*(?:\n+|;\s+)\s*")
+SENTENCE_SEPARATOR = re.compile(r"(?<=[.!?…])\s+")
+CHUNK_ID_SEPARATOR = "#"
+
+
+def load_token_counter(model_name: str) -> Callable[[str], int]:
+    """Đếm token bằng đúng tokenizer của mô hình embedding (không tính token đặc biệt)."""
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def chunk_id(parent_id: str, index: int, n_chunks: int) -> str:
+    """Tài liệu chỉ có một chunk giữ nguyên id gốc, để các id đã có (bộ đánh giá, phiên) vẫn dùng được."""
+    return parent_id if n_chunks == 1 else f"{parent_id}{CHUNK_ID_SEPARATOR}{index}"
+
+
+def _split_long_segment(segment: str, count_tokens: Callable[[str], int], max_tokens: int) -> List[str]:
+    """Chia một đoạn quá dài: trước theo câu, cuối cùng theo từ nếu một câu vẫn vượt ngân sách."""
+    pieces = []
+    for sentence in SENTENCE_SEPARATOR.split(segment):
+        if count_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        words, current = sentence.split(), []
+        for word in words:
+            if current and count_tokens(" ".join(current + [word])) > max_tokens:
+                pieces.append(" ".join(current))
+                current = []
+            current.append(word)
+        if current:
+            pieces.append(" ".join(current))
+    return pieces
+
+
+def split_text(text: str, count_tokens: Callable[[str], int], max_tokens: int = CHUNK_MAX_TOKENS) -> List[str]:
+    """
+    Chia văn bản thành các đoạn không quá `max_tokens` token. Các trường/câu liền
+    nhau được gộp tham lam vào cùng một đoạn; không cắt giữa câu trừ khi bắt buộc.
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    segments = []
+    for field in FIELD_SEPARATOR.split(text):
+        field = field.strip()
+        if not field:
+            continue
+        if count_tokens(field) <= max_tokens:
+            segments.append(field)
+        else:
+            segments.extend(_split_long_segment(field, count_tokens, max_tokens))
+
+    chunks, current = [], ""
+    for segment in segments:
+        candidate = f"{current} {segment}" if current else segment
+        if current and count_tokens(candidate) > max_tokens:
+            chunks.append(current)
+            candidate = segment
+        current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_document(doc: dict, count_tokens: Callable[[str], int], max_tokens: int = CHUNK_MAX_TOKENS) -> List[dict]:
+    """
+    Chia một tài liệu {id, content, metadata} thành các chunk cùng định dạng.
+    Metadata của chunk là metadata gốc cộng thêm `parent_id`, `chunk_index`, `n_chunks`.
+    """
+    texts = split_text(doc['content'], count_tokens, max_tokens)
+    metadata = doc.get('metadata', {})
+    return [
+        {
+            "id": chunk_id(doc['id'], i, len(texts)),
+            "content": text,
+            "metadata": {**metadata, "parent_id": doc['id'], "chunk_index": i, "n_chunks": len(texts)}
+        }
+        for i, text in enumerate(texts)
+    ]
+
+
+def chunk_documents(docs: List[dict], count_tokens: Callable[[str], int],
+                    max_tokens: int = CHUNK_MAX_TOKENS) -> Dict[str, List[dict]]:
+    """Chia nhiều tài liệu, trả về {id tài liệu gốc: [các chunk]}."""
+    return {doc['id']: chunk_document(doc, count_tokens, max_tokens) for doc in docs}
+
+
+def merge_chunks(chunks: List[dict]) -> str:
+    """
+    Ghép các chunk (cùng một tài liệu gốc) lại theo thứ tự `chunk_index`.
+    Dấu phân cách trường/câu ở ranh giới chunk được thay bằng dấu cách.
+    """
+    ordered = sorted(chunks, key=lambda c: c['metadata'].get('chunk_index', 0))
+    return " ".join(c['content'] for c in ordered)
@@ -8,13 +8,17 @@ from pathlib import Path
 ROOT_DIR = Path(__file__).parent.parent.parent
 
 DATA_DIR = ROOT_DIR / "data"
+RAW_DATA_DIR = DATA_DIR / "raw"
 PROCESSED_DATA_DIR = DATA_DIR / "processed"
 VECTOR_STORE_DIR = DATA_DIR / "vector_store"
 CHROMA_PATH = VECTOR_STORE_DIR / "chroma_db"
+EMBEDDING_CACHE_DIR = DATA_DIR / "embedding_cache" # Cache embedding dùng chung cho build, import và đánh giá
+INDEX_VERSIONS_DIR = VECTOR_STORE_DIR / "versions" # Mỗi phiên bản index được build trong một thư mục riêng
+ACTIVE_INDEX_POINTER_PATH = VECTOR_STORE_DIR / "active_index.json" # Alias trỏ tới phiên bản index đang phục vụ
 
 TESTS_DIR = ROOT_DIR / "tests"
 EVAL_RESULTS_DIR = TESTS_DIR / "evaluation_results"
-EVAL_SET_PATH = TESTS_DIR / "evaluation_set.json" # [THAY ĐỔI] Sửa lại đường dẫn cho đúng cấu trúc
+EVAL_SET_PATH = TESTS_DIR / "data" / "evaluation_set.json"
 
 # --- MODEL IDENTIFIERS ---
 # Tên các mô hình được tải từ Hugging Face
@@ -22,6 +26,19 @@ EMBEDDING_MODEL_NAME = "keepitreal/vietnamese-sbert"
 RERANKER_MODEL_NAME = "BAAI/bge-reranker-v2-m3" # [LƯU Ý] Model này lớn, có thể chạy chậm trên CPU miễn phí của Spaces.
 LLM_MODEL_NAME = "microsoft/Phi-3-mini-4k-instruct" # [THAY ĐỔI] Sử dụng model gốc mà bạn đã fine-tune
 
+# --- MODEL BACKENDS ---
+# Chọn cài đặt cho từng mô hình (xem src/chatbot/backends.py):
+# - "hf": các mô hình ở trên, tải từ Hugging Face Hub.
+# - Bản thay thế nhẹ, tất định, chạy offline (CI, benchmark nhanh): embedding "hashing"
+#   (băm từ vào HASHING_EMBEDDING_DIM chiều), reranker "lexical" (độ trùng từ), generator
+#   "extractive" (trích câu trong context trùng nhiều từ nhất với câu hỏi).
+# Đổi embedding backend thì index và cache embedding được build lại (khoá theo id mô hình).
+EMBEDDING_BACKEND = "hf"
+RERANKER_BACKEND = "hf"
+GENERATOR_BACKEND = "hf"
+HASHING_EMBEDDING_DIM = 768
+EXTRACTIVE_MIN_OVERLAP = 0.5 # Tỉ lệ từ của câu hỏi tối thiểu phải có trong câu được trích, nếu không thì trả lời không tìm thấy
+
 # --- FINE-TUNED MODEL PATH ---
 # [THAY ĐỔI] Đây là phần quan trọng nhất để deploy.
 # Nó sẽ trỏ đến ID của adapter trên Hugging Face Hub, không phải đường dẫn cục bộ.
@@ -30,12 +47,51 @@ YOUR_HF_USERNAME = "Keyjun"
 ADAPTER_NAME = "Chatbot-deloy" # Tên repo adapter bạn đã tải lên
 LORA_ADAPTER_PATH = f"{YOUR_HF_USERNAME}/{ADAPTER_NAME}"
 
+# --- LORA SERVING ---
+# "merge": gộp adapter LORA_ADAPTER_PATH vào model gốc (nhanh nhất khi chỉ phục vụ một biến thể).
+# "multi": model gốc 4-bit chỉ tải một lần, các adapter trong LORA_ADAPTERS được gắn vào theo tên
+#          (không merge); mỗi request chọn adapter, thêm một adapter chỉ tốn vài chục MB.
+# Tên adapter "base" luôn có nghĩa là model gốc không dùng adapter.
+LORA_SERVING_MODE = "merge"
+LORA_ADAPTERS = {
+    "default": LORA_ADAPTER_PATH,  # repo trên Hugging Face Hub hoặc đường dẫn cục bộ
+}
+DEFAULT_ADAPTER = "default"
+
 # --- CHROMA DATABASE SETTINGS ---
 COLLECTION_NAME = "tuyensinh"
 
+# --- INDEX VERSIONING ---
+# RetrievalSystem kiểm tra con trỏ alias tối đa mỗi INDEX_POINTER_CHECK_SECONDS giây
+# và chuyển sang phiên bản mới mà không cần khởi động lại tiến trình.
+INDEX_POINTER_CHECK_SECONDS = 5
+INDEX_VALIDATION_MIN_HIT_RATE = 0.8 # Hit Rate@EVAL_TOP_K tối thiểu trên evaluation_set.json để được promote
+INDEX_VERSIONS_TO_KEEP = 3
+
 # --- RAG PIPELINE PARAMETERS ---
 N_RETRIEVE_RESULTS = 10
 N_FINAL_RESULTS = 3
+LLM_MAX_NEW_TOKENS = 512 # Độ dài tối đa (token) của một câu trả lời
+REQUEST_DEADLINE_SECONDS = 60 # Quá thời gian này, request trả về kết quả dở dang (câu trả lời đã sinh được hoặc các nguồn)
+
+# --- CHUNKING PARAMETERS ---
+# Tài liệu dài được chia thành các chunk (theo ranh giới trường/câu) không vượt quá
+# CHUNK_MAX_TOKENS token của tokenizer embedding; vietnamese-sbert chỉ nhận 256 token
+# và reranker còn cần chỗ cho câu hỏi. Index tìm trên chunk, kết quả trả về là tài liệu gốc.
+CHUNK_MAX_TOKENS = 200
+
+# --- FINE-TUNING DATA ---
+# qa.jsonl/eval.jsonl được áp chat template, tokenize và ghép (packing) sẵn thành các chuỗi
+# dài SFT_MAX_SEQ_LENGTH token, lưu dạng mảng memory-map để lần train nào cũng dùng lại.
+SFT_DATASET_DIR = DATA_DIR / "sft"
+SFT_MAX_SEQ_LENGTH = 2048
+
+# --- MULTI-TURN SESSION PARAMETERS ---
+# Câu hỏi nối tiếp (vd: "còn email của thầy ấy?") được chấm điểm lại trên các tài liệu
+# của lượt trước; chỉ khi điểm cosine tốt nhất thấp hơn ngưỡng mới truy xuất lại từ đầu.
+SESSION_REUSE_MIN_SCORE = 0.5
+SESSION_MAX_SESSIONS = 1000
+SESSION_TTL_SECONDS = 30 * 60
 
 # --- EVALUATION PARAMETERS ---
 EVAL_TOP_K = 5
@@ -48,4 +104,68 @@ DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 # Các biến này hiện không được sử dụng trực tiếp nếu bạn dùng Gradio
 # nhưng giữ lại cũng không sao.
 SERVER_HOST = "0.0.0.0"
-SERVER_PORT = 7860 # [THAY ĐỔI] Cổng mặc định của Gradio trên Spaces là 7860
\ No newline at end of file
+SERVER_PORT = 7860 # [THAY ĐỔI] Cổng mặc định của Gradio trên Spaces là 7860
+
+# --- HEADLESS JSON API SETTINGS ---
+# Dịch vụ HTTP JSON (asyncio) cho cổng thông tin trường và tích hợp Zalo.
+# Mỗi stage có số request xử lý đồng thời và độ dài hàng đợi riêng;
+# khi hàng đợi đầy, server trả về HTTP 429 thay vì để request chờ vô hạn.
+API_HOST = "0.0.0.0"
+API_PORT = 8000
+API_RETRIEVE_CONCURRENCY = 4
+API_RETRIEVE_QUEUE_SIZE = 32
+API_GENERATE_CONCURRENCY = 1 # LLM chạy trên CPU/GPU dùng chung, xử lý tuần tự là an toàn nhất
+API_GENERATE_QUEUE_SIZE = 8
+API_MAX_QUERY_CHARS = 2000
+API_RETRY_AFTER_SECONDS = 2
+
+# --- TRACING & METRICS ---
+# Ghi mỗi request (get_answer, /retrieve, /answer) thành một dòng JSONL gồm các span con
+# (embed, truy vấn Chroma, rerank, dựng prompt, sinh câu trả lời) và tổng hợp histogram cho /metrics.
+# Tắt mặc định; khi tắt, các span là no-op nên gần như không tốn chi phí.
+TRACING_ENABLED = False
+LOGS_DIR = ROOT_DIR / "logs"
+TRACE_LOG_PATH = LOGS_DIR / "traces.jsonl"
+TRACE_LOG_MAX_BYTES = 20 * 1024 * 1024 # Xoay file khi vượt 20MB
+TRACE_LOG_BACKUPS = 5
+METRICS_LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# --- MEMORY BUDGET ---
+# Quản lý bộ nhớ cho các instance nhỏ (xem src/chatbot/memory_manager.py): các mô hình trong
+# MEMORY_EVICTION_ORDER bị gỡ khi nhàn rỗi quá MEMORY_IDLE_SECONDS và tải lại khi có request.
+# Khi RSS vượt MEMORY_BUDGET_MB:
+# - "evict": gỡ các mô hình nhàn rỗi theo thứ tự (cả trước khi tải lại một mô hình khác);
+# - "degrade": giữ reranker, chỉ gỡ LLM và trả về tài liệu truy xuất được thay vì câu trả lời sinh.
+MEMORY_MANAGER_ENABLED = False # Tắt: mọi mô hình luôn nằm trong bộ nhớ như trước
+MEMORY_BUDGET_MB = 6144
+MEMORY_IDLE_SECONDS = 20 * 60
+MEMORY_CHECK_SECONDS = 30
+MEMORY_EVICTION_ORDER = ("reranker", "llm")
+MEMORY_PRESSURE_POLICY = "evict"
+
+# --- REQUEST PROFILING ---
+# Profile các request thật của get_answer để điều tra độ trễ đuôi (compaction của Chroma,
+# tokenizer, context dài...). Mỗi capture (cProfile + câu hỏi + config + thời gian từng stage)
+# được lưu trong một thư mục con của PROFILE_DIR; chỉ giữ PROFILE_MAX_CAPTURES capture mới nhất.
+PROFILER_ENABLED = False
+PROFILER_SAMPLE_RATE = 0.01 # Tỉ lệ request được profile ngẫu nhiên
+PROFILER_SLOW_MS = 5000 # Lưu mọi request chậm hơn ngưỡng này (None: chỉ lấy mẫu ngẫu nhiên)
+PROFILER_USE_TORCH = False # Thêm torch profiler (trace Chrome) cho các request được lấy mẫu
+PROFILE_DIR = LOGS_DIR / "profiles"
+PROFILE_MAX_CAPTURES = 50
+
+# --- ADMISSION CONTROL ---
+# Khi đông người dùng (vd: ngày công bố kết quả tuyển sinh), request được phục vụ ở các mức
+# giảm dần thay vì xếp hàng sau LLM (xem src/chatbot/admission.py):
+# full -> shallow (ít ứng viên hơn) -> no_rerank (bỏ reranker) -> extractive (trích câu, không
+# dùng LLM) -> sources_only (chỉ trả về nguồn). Mức được chọn theo số request đang xử lý và
+# độ trễ p95 gần đây so với SLO.
+ADMISSION_ENABLED = False
+ADMISSION_SLO_P95_MS = 10000 # Mục tiêu độ trễ p95 (ms) của một câu trả lời
+ADMISSION_QUEUE_THRESHOLDS = (3, 5, 8, 12) # Số request đang xử lý để chuyển xuống từng mức tiếp theo
+ADMISSION_LATENCY_WINDOW = 50 # Số request gần nhất dùng để tính p95
+ADMISSION_ADJUST_SECONDS = 10 # Khoảng thời gian tối thiểu giữa hai lần đổi mức theo độ trễ
+ADMISSION_RECOVERY_RATIO = 0.5 # Lên lại một mức khi p95 < SLO * tỉ lệ này
+ADMISSION_SHALLOW_RETRIEVE = 5 # Số ứng viên truy xuất ở các mức giảm tải
+ADMISSION_GENERATE_CONCURRENCY = 1 # Số lượt sinh bằng LLM chạy đồng thời; các request khác chờ
+ADMISSION_GRADIO_CONCURRENCY = 16 # Số request Gradio xử lý đồng thời khi bật admission control
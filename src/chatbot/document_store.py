@@ -0,0 +1,163 @@
+# src/chatbot/document_store.py
+
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+
+def index_path_for(store_path: Path) -> Path:
+    """Chỉ mục offset nằm cạnh file JSONL: 'x.jsonl' -> 'x.idx.json'."""
+    store_path = Path(store_path)
+    return store_path.with_name(store_path.stem + ".idx.json")
+
+
+class DocumentStoreWriter:
+    """
+    Ghi lần lượt từng bản ghi {id, content, metadata} thành một dòng JSONL và lập
+    chỉ mục id -> [offset, độ dài] theo byte. Cả hai file được ghi ra file tạm và chỉ
+    được os.replace khi `close()` thành công (chỉ mục thay sau cùng), nên người đọc
+    không bao giờ thấy chỉ mục trỏ vào dữ liệu chưa ghi xong. Id trùng: bản ghi sau thắng.
+    """
+    def __init__(self, store_path: Path):
+        self.store_path = Path(store_path)
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp_store = self.store_path.with_suffix(self.store_path.suffix + ".tmp")
+        self._file = open(self._tmp_store, 'wb')
+        self._offsets = {}
+
+    def add(self, record: dict):
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        self._offsets[record['id']] = [self._file.tell(), len(line)]
+        self._file.write(line)
+
+    def close(self) -> int:
+        size = self._file.tell()
+        self._file.close()
+        index_path = index_path_for(self.store_path)
+        tmp_index = index_path.with_suffix(".json.tmp")
+        with open(tmp_index, 'w', encoding='utf-8') as f:
+            json.dump({"size": size, "offsets": self._offsets}, f, ensure_ascii=False)
+        os.replace(self._tmp_store, self.store_path)
+        os.replace(tmp_index, index_path)
+        return len(self._offsets)
+
+    def abort(self):
+        self._file.close()
+        self._tmp_store.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_document_store(store_path: Path, records: Iterable[dict]) -> int:
+    """Ghi toàn bộ `records` thành một kho tài liệu, trả về số id khác nhau."""
+    writer = DocumentStoreWriter(store_path)
+    try:
+        for record in records:
+            writer.add(record)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+class DocumentStore:
+    """
+    Kho tài liệu chỉ đọc: file JSONL được memory-map, chỉ mục offset được nạp vào
+    bộ nhớ (chỉ gồm id và hai số nguyên mỗi tài liệu). Truy cập ngẫu nhiên một tài
+    liệu chỉ giải mã đúng một dòng; duyệt tuần tự không cần nạp toàn bộ file.
+    """
+    def __init__(self, store_path: Path):
+        self.store_path = Path(store_path)
+        self.index_path = index_path_for(self.store_path)
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self._offsets = index["offsets"]
+        self._signature = self._stat_signature()
+        self._file = open(self.store_path, 'rb')
+        if index["size"] != os.fstat(self._file.fileno()).st_size:
+            self._file.close()
+            raise ValueError(f"Chỉ mục {self.index_path.name} không khớp với {self.store_path.name}.")
+        # mmap không hỗ trợ file rỗng
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if index["size"] else None
+
+    @classmethod
+    def open_if_exists(cls, store_path: Path) -> Optional["DocumentStore"]:
+        if not Path(store_path).exists() or not index_path_for(store_path).exists():
+            return None
+        return cls(store_path)
+
+    def _stat_signature(self):
+        try:
+            stat = self.index_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def is_stale(self) -> bool:
+        """True nếu kho đã được ghi lại (os.replace) kể từ khi mở; khi đó cần mở lại."""
+        return self._stat_signature() != self._signature
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._offsets
+
+    def ids(self) -> List[str]:
+        return list(self._offsets)
+
+    def get(self, doc_id: str) -> Optional[dict]:
+        location = self._offsets.get(doc_id)
+        if location is None:
+            return None
+        offset, length = location
+        return json.loads(self._mmap[offset:offset + length])
+
+    def get_many(self, doc_ids: Iterable[str]) -> List[Optional[dict]]:
+        return [self.get(doc_id) for doc_id in doc_ids]
+
+    def __iter__(self) -> Iterator[dict]:
+        """Duyệt tuần tự theo thứ tự ghi trong file."""
+        if self._mmap is None:
+            return
+        # Không dùng seek/readline để nhiều thread có thể duyệt cùng lúc
+        pos, size = 0, len(self._mmap)
+        while pos < size:
+            end = self._mmap.find(b'\n', pos)
+            end = size if end == -1 else end + 1
+            yield json.loads(self._mmap[pos:end])
+            pos = end
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+def iter_documents(store_path: Path) -> Iterator[dict]:
+    """
+    Duyệt các tài liệu của một kho JSONL. Nếu chưa có file JSONL nhưng còn file
+    mảng JSON cùng tên (định dạng cũ, vd 'faculty_enriched.json') thì đọc file đó.
+    """
+    store_path = Path(store_path)
+    if store_path.exists():
+        with open(store_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    legacy_path = store_path.with_suffix(".json")
+    if legacy_path.exists():
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+        return
+    raise FileNotFoundError(store_path)
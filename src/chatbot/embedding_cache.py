@@ -0,0 +1,151 @@
+# src/chatbot/embedding_cache.py
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+
+from src.chatbot.config import EMBEDDING_CACHE_DIR
+
+
+try:
+    import fcntl  # Không có trên Windows
+except ImportError:
+    fcntl = None
+
+
+class EmbeddingCache:
+    """
+    Cache embedding bền vững trên đĩa, khoá theo (tên mô hình, hash văn bản).
+
+    Mỗi mô hình có một thư mục riêng gồm:
+      - `vectors.f32`: ma trận float32 (n_rows x dim) được đọc qua memory-map,
+      - `index.json`: chỉ mục hash văn bản -> số dòng trong ma trận.
+    Nhiều tiến trình có thể cùng ghi: mỗi lần ghi giữ khoá file `.lock` và đọc lại chỉ mục trên
+    đĩa trước khi ghi thêm, nên không ghi đè các dòng do tiến trình khác vừa thêm. Trong một tiến
+    trình, dùng `get_embedding_cache()` để các module chia sẻ cùng một instance.
+    """
+    def __init__(self, model_name: str, cache_dir: Path = EMBEDDING_CACHE_DIR):
+        self.model_name = model_name
+        self.dir = Path(cache_dir) / model_name.replace("/", "__")
+        self.vectors_path = self.dir / "vectors.f32"
+        self.index_path = self.dir / "index.json"
+        self.lock_path = self.dir / ".lock"
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._dim = None
+        self._matrix = None
+        self._index_signature = None
+        self._load()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _signature(self):
+        try:
+            stat = self.index_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """Đọc lại chỉ mục (và memmap) từ đĩa nếu nó đã thay đổi, vd: do tiến trình khác ghi thêm."""
+        signature = self._signature()
+        if signature is None or signature == self._index_signature:
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self._rows = index["rows"]
+        self._dim = index["dim"]
+        self._index_signature = signature
+        self._open_matrix()
+
+    def _open_matrix(self):
+        if self._rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self._rows), self._dim))
+
+    @contextmanager
+    def _file_lock(self):
+        """Khoá độc quyền giữa các tiến trình (fcntl); chỉ có khoá trong tiến trình nếu không có fcntl."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, hashes: List[str], vectors: np.ndarray):
+        """Ghi thêm vector vào cuối ma trận, sau đó mới cập nhật chỉ mục (an toàn khi bị ngắt giữa chừng)."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._file_lock():
+            # Số dòng lấy từ chỉ mục trên đĩa (tiến trình khác có thể đã ghi thêm), không từ bộ nhớ
+            self._load()
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Kích thước embedding {vectors.shape[1]} khác với cache ({self._dim}).")
+            new = [i for i, h in enumerate(hashes) if h not in self._rows]
+            if not new:
+                return
+
+            n_rows = len(self._rows)
+            self._matrix = None  # Đóng memmap cũ trước khi ghi file
+            with open(self.vectors_path, "ab") as f:
+                # Bỏ phần dữ liệu thừa nếu lần ghi trước bị ngắt trước khi kịp cập nhật chỉ mục
+                f.truncate(n_rows * self._dim * 4)
+                f.write(vectors[new].tobytes())
+
+            for row, i in enumerate(new, start=n_rows):
+                self._rows[hashes[i]] = row
+            tmp_path = self.index_path.with_suffix(".json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"model_name": self.model_name, "dim": self._dim, "rows": self._rows}, f)
+            os.replace(tmp_path, self.index_path)
+            self._index_signature = self._signature()
+            self._open_matrix()
+
+    def get_or_compute(self, texts: List[str], compute_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Trả về embedding (n x dim) cho `texts`. Chỉ những văn bản chưa có trong
+        cache mới được đưa vào `compute_fn` (mỗi văn bản duy nhất một lần).
+        """
+        hashes = [self.text_hash(t) for t in texts]
+        with self._lock:
+            self._load()
+            missing = {}
+            for h, t in zip(hashes, texts):
+                if h not in self._rows and h not in missing:
+                    missing[h] = t
+            if missing:
+                vectors = np.asarray(compute_fn(list(missing.values())))
+                self._append(list(missing.keys()), vectors)
+
+            if not hashes:
+                return np.empty((0, self._dim or 0), dtype=np.float32)
+            return np.array(self._matrix[[self._rows[h] for h in hashes]])
+
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str, cache_dir: Path = EMBEDDING_CACHE_DIR) -> EmbeddingCache:
+    """Một EmbeddingCache dùng chung cho mỗi (mô hình, thư mục) trong tiến trình."""
+    key = (model_name, str(Path(cache_dir).resolve()))
+    with _shared_caches_lock:
+        if key not in _shared_caches:
+            _shared_caches[key] = EmbeddingCache(model_name, cache_dir)
+        return _shared_caches[key]
@@ -0,0 +1,115 @@
+# src/chatbot/index_registry.py
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+from src.chatbot.config import (
+    CHROMA_PATH,
+    COLLECTION_NAME,
+    INDEX_VERSIONS_DIR,
+    INDEX_VERSIONS_TO_KEEP,
+    ACTIVE_INDEX_POINTER_PATH
+)
+
+
+def new_version_name() -> str:
+    """
+    Tên collection cho một phiên bản index mới, vd: 'tuyensinh_v20261019153000'. Thư mục của
+    phiên bản được tạo ngay (nguyên tử) để giữ chỗ: hai lần build bắt đầu trong cùng một giây
+    nhận hai tên khác nhau ('..._2', ...) thay vì ghi chung một collection.
+    """
+    base_name = f"{COLLECTION_NAME}_v{time.strftime('%Y%m%d%H%M%S')}"
+    INDEX_VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+    suffix = 1
+    while True:
+        version_name = base_name if suffix == 1 else f"{base_name}_{suffix}"
+        try:
+            (INDEX_VERSIONS_DIR / version_name).mkdir()
+            return version_name
+        except FileExistsError:
+            suffix += 1
+
+
+def version_chroma_path(version_name: str) -> Path:
+    """Mỗi phiên bản index nằm trong một thư mục ChromaDB riêng."""
+    return INDEX_VERSIONS_DIR / version_name / "chroma_db"
+
+
+def document_store_path(chroma_path: Path, collection_name: str) -> Path:
+    """Kho tài liệu (JSONL) của một collection nằm cạnh thư mục ChromaDB của nó."""
+    return Path(chroma_path).parent / f"{collection_name}_documents.jsonl"
+
+
+def read_pointer() -> Optional[dict]:
+    """Đọc con trỏ alias tới phiên bản index đang hoạt động (None nếu chưa có)."""
+    if not ACTIVE_INDEX_POINTER_PATH.exists():
+        return None
+    with open(ACTIVE_INDEX_POINTER_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_pointer(pointer: dict):
+    """Ghi con trỏ một cách nguyên tử: ghi file tạm rồi os.replace."""
+    ACTIVE_INDEX_POINTER_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = ACTIVE_INDEX_POINTER_PATH.with_suffix(".json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(pointer, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, ACTIVE_INDEX_POINTER_PATH)
+
+
+def get_active_index() -> Tuple[Path, str]:
+    """
+    Trả về (đường dẫn ChromaDB, tên collection) của index đang hoạt động.
+    Khi chưa có phiên bản nào được promote, dùng CHROMA_PATH/COLLECTION_NAME như trước.
+    """
+    pointer = read_pointer()
+    if not pointer or not pointer.get("current"):
+        return CHROMA_PATH, COLLECTION_NAME
+    current = pointer["current"]
+    return version_chroma_path(current["collection"]), current["collection"]
+
+
+def pointer_signature() -> Optional[Tuple[int, int]]:
+    """Chữ ký rẻ (mtime, size) của file con trỏ, dùng để phát hiện việc chuyển phiên bản."""
+    try:
+        stat = ACTIVE_INDEX_POINTER_PATH.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def promote(version_name: str, validation: dict = None):
+    """Chuyển alias sang `version_name`, phiên bản hiện tại được đẩy vào lịch sử để rollback."""
+    if not version_chroma_path(version_name).exists():
+        raise FileNotFoundError(f"Không tìm thấy phiên bản index '{version_name}'.")
+
+    pointer = read_pointer() or {"current": None, "history": []}
+    if pointer.get("current"):
+        # Chỉ giữ lại INDEX_VERSIONS_TO_KEEP phiên bản gần nhất để rollback
+        pointer["history"] = (pointer["history"] + [pointer["current"]])[-INDEX_VERSIONS_TO_KEEP:]
+    pointer["current"] = {
+        "collection": version_name,
+        "promoted_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "validation": validation or {}
+    }
+    _write_pointer(pointer)
+
+
+def rollback() -> Optional[str]:
+    """Quay lại phiên bản đã hoạt động trước đó. Trả về tên phiên bản mới (None nếu không có)."""
+    pointer = read_pointer()
+    if not pointer or not pointer.get("history"):
+        return None
+    pointer["current"] = pointer["history"].pop()
+    _write_pointer(pointer)
+    return pointer["current"]["collection"]
+
+
+def list_versions() -> list:
+    """Liệt kê tên các phiên bản index đã build, mới nhất trước."""
+    if not INDEX_VERSIONS_DIR.exists():
+        return []
+    return sorted((p.name for p in INDEX_VERSIONS_DIR.iterdir() if p.is_dir()), reverse=True)
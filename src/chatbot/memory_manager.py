@@ -0,0 +1,270 @@
+# src/chatbot/memory_manager.py
+
+import gc
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Optional, Tuple
+
+from src.chatbot.config import (
+    MEMORY_MANAGER_ENABLED, MEMORY_BUDGET_MB, MEMORY_IDLE_SECONDS, MEMORY_CHECK_SECONDS,
+    MEMORY_EVICTION_ORDER, MEMORY_PRESSURE_POLICY
+)
+from src.chatbot.tracing import tracer
+
+PRESSURE_POLICIES = ("evict", "degrade")
+DEGRADABLE_COMPONENT = "llm"  # Chính sách "degrade" chỉ gỡ LLM; pipeline trả về tài liệu thay vì câu trả lời sinh
+
+
+def current_rss_mb() -> Optional[float]:
+    """RSS hiện tại của tiến trình (MB): đọc /proc trên Linux, nếu không có thì dùng RSS cao nhất."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def _release_freed_memory():
+    """Thu gom các tham chiếu vòng và trả lại bộ nhớ GPU đã cache (nếu có torch/CUDA)."""
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class ManagedComponent:
+    """Một mô hình được tải theo yêu cầu: ghi lại footprint lúc tải, thời điểm dùng gần nhất và số lần tải lại."""
+    def __init__(self, name: str, loader: Callable):
+        self.name = name
+        self.loader = loader
+        self.value = None
+        self.footprint_mb = 0.0
+        self.last_used = time.monotonic()
+        self.loads = 0
+        self.pins = 0
+        self.lock = threading.RLock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.value is not None
+
+
+class ComponentProxy:
+    """
+    Đứng thay cho một mô hình có thể bị gỡ khỏi bộ nhớ: mọi truy cập thuộc tính được chuyển
+    tới mô hình (tải lại nếu cần). Phương thức đang chạy giữ tham chiếu tới mô hình cũ nên
+    việc gỡ giữa chừng không làm hỏng lời gọi đó.
+    """
+    def __init__(self, manager: "MemoryManager", component: ManagedComponent, part: Optional[int] = None):
+        self._manager = manager
+        self._component = component
+        self._part = part
+
+    def _target(self):
+        value = self._manager.get(self._component.name)
+        return value if self._part is None else value[self._part]
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._target()(*args, **kwargs)
+
+
+class MemoryManager:
+    """
+    Giữ tổng RSS của tiến trình dưới MEMORY_BUDGET_MB:
+    - Các thành phần trong MEMORY_EVICTION_ORDER (reranker, LLM) không được dùng quá
+      MEMORY_IDLE_SECONDS giây sẽ bị gỡ khỏi bộ nhớ và được tải lại ở request kế tiếp.
+    - Khi RSS vượt ngân sách, chính sách "evict" gỡ các thành phần nhàn rỗi theo thứ tự trên
+      (kể cả trước khi tải lại một thành phần khác); chính sách "degrade" giữ reranker trong bộ
+      nhớ, chỉ gỡ LLM và pipeline trả lời bằng các tài liệu truy xuất được cho đến khi đủ bộ nhớ.
+    Khi tắt (`enabled=False`), `register` tải mô hình ngay và trả về chính mô hình đó như trước.
+    """
+    def __init__(self, enabled: bool = MEMORY_MANAGER_ENABLED, budget_mb: float = MEMORY_BUDGET_MB,
+                 idle_seconds: float = MEMORY_IDLE_SECONDS, check_seconds: float = MEMORY_CHECK_SECONDS,
+                 eviction_order: Tuple[str, ...] = MEMORY_EVICTION_ORDER, policy: str = MEMORY_PRESSURE_POLICY):
+        if policy not in PRESSURE_POLICIES:
+            raise ValueError(f"MEMORY_PRESSURE_POLICY không hợp lệ: '{policy}'. Chọn một trong: {', '.join(PRESSURE_POLICIES)}.")
+        self.enabled = enabled
+        self.budget_mb = budget_mb
+        self.idle_seconds = idle_seconds
+        self.check_seconds = check_seconds
+        self.policy = policy
+        self.eviction_order = tuple(eviction_order) if policy == "evict" else (DEGRADABLE_COMPONENT,)
+        self.components: Dict[str, ManagedComponent] = {}
+        self._monitor = None
+
+    # --- ĐĂNG KÝ & TẢI ---
+    def register(self, name: str, loader: Callable, parts: Optional[int] = None):
+        """
+        Tải mô hình `name` bằng `loader` và trả về mô hình (khi tắt) hoặc proxy của nó.
+        `parts` dùng cho loader trả về tuple (vd: LLM trả về (handle, pipeline)): khi đó
+        trả về một proxy cho từng phần, cùng được gỡ và tải lại với nhau.
+        """
+        if not self.enabled:
+            return loader()
+        component = ManagedComponent(name, loader)
+        if name in self.components:
+            self.evict(name, reason="replaced")
+        self.components[name] = component
+        self._load(component)
+        self._start_monitor()
+        if parts is None:
+            return ComponentProxy(self, component)
+        return tuple(ComponentProxy(self, component, part) for part in range(parts))
+
+    def get(self, name: str):
+        """Trả về mô hình đã tải, tải lại nếu nó đã bị gỡ."""
+        component = self.components[name]
+        component.last_used = time.monotonic()
+        value = component.value
+        if value is not None:
+            return value
+        with component.lock:
+            if component.value is None:
+                self._load(component, reload=True)
+            return component.value
+
+    def _load(self, component: ManagedComponent, reload: bool = False):
+        if reload and self.policy == "evict":
+            self._make_room(component)
+        rss_before = current_rss_mb() or 0.0
+        start = time.perf_counter()
+        with tracer.span("reload" if reload else "load", component=component.name):
+            component.value = component.loader()
+        elapsed = time.perf_counter() - start
+        component.footprint_mb = max((current_rss_mb() or 0.0) - rss_before, 0.0) or component.footprint_mb
+        component.last_used = time.monotonic()
+        component.loads += 1
+        if reload:
+            print(f"♻️ Đã tải lại '{component.name}' sau {elapsed:.1f}s (~{component.footprint_mb:.0f} MB, RSS {self._rss_text()}).")
+            tracer.count("memory_events", component=component.name, event="reload")
+
+    # --- GỠ KHỎI BỘ NHỚ ---
+    def evict(self, name: str, reason: str) -> bool:
+        """Gỡ mô hình `name` (nếu đã tải và không bị ghim). Trả về True nếu đã gỡ."""
+        component = self.components.get(name)
+        if component is None:
+            return False
+        # Không chờ khoá: thành phần đang được tải hoặc ghim thì bỏ qua (tránh deadlock khi hai
+        # request cùng tải lại hai thành phần và mỗi bên muốn gỡ thành phần của bên kia)
+        if not component.lock.acquire(blocking=False):
+            return False
+        try:
+            if component.value is None or component.pins:
+                return False
+            idle = time.monotonic() - component.last_used
+            component.value = None
+        finally:
+            component.lock.release()
+        _release_freed_memory()
+        print(f"🧹 Đã gỡ '{name}' khỏi bộ nhớ ({reason}, nhàn rỗi {idle:.0f}s, RSS {self._rss_text()}).")
+        tracer.count("memory_events", component=name, event=f"evict_{reason}")
+        return True
+
+    def _make_room(self, incoming: ManagedComponent):
+        """Chính sách "evict": gỡ các thành phần nhàn rỗi khác cho đến khi mô hình sắp tải vừa ngân sách."""
+        for name in self.eviction_order:
+            rss = current_rss_mb()
+            if rss is None or rss + incoming.footprint_mb <= self.budget_mb:
+                return
+            if name != incoming.name:
+                self.evict(name, reason="pressure")
+        rss = current_rss_mb()
+        if rss is not None and rss + incoming.footprint_mb > self.budget_mb:
+            print(f"⚠️ Tải '{incoming.name}' sẽ vượt ngân sách bộ nhớ ({rss:.0f} + {incoming.footprint_mb:.0f} > {self.budget_mb:.0f} MB).")
+
+    def check(self):
+        """Gỡ các thành phần nhàn rỗi quá lâu, rồi gỡ tiếp theo thứ tự nếu RSS vẫn vượt ngân sách."""
+        now = time.monotonic()
+        for name in self.eviction_order:
+            component = self.components.get(name)
+            if component is not None and component.loaded and now - component.last_used > self.idle_seconds:
+                self.evict(name, reason="idle")
+        for name in self.eviction_order:
+            rss = current_rss_mb()
+            if rss is None or rss <= self.budget_mb:
+                break
+            self.evict(name, reason="pressure")
+
+    def _start_monitor(self):
+        if self._monitor is not None:
+            return
+
+        def monitor():
+            while True:
+                time.sleep(self.check_seconds)
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"[LỖI] Memory manager: {e}")
+
+        self._monitor = threading.Thread(target=monitor, name="memory-manager", daemon=True)
+        self._monitor.start()
+
+    # --- DÙNG TRONG PIPELINE ---
+    def pin(self, name: str):
+        """Giữ mô hình `name` trong bộ nhớ suốt khối `with` (vd: handle và pipeline của LLM phải là cùng một lần tải)."""
+        if not self.enabled or name not in self.components:
+            return nullcontext()
+        return self._pinned(self.components[name])
+
+    @contextmanager
+    def _pinned(self, component: ManagedComponent):
+        with component.lock:
+            component.pins += 1
+        try:
+            self.get(component.name)
+            yield
+        finally:
+            with component.lock:
+                component.pins -= 1
+
+    def is_loaded(self, name: str) -> bool:
+        return not self.enabled or name not in self.components or self.components[name].loaded
+
+    def can_use(self, name: str) -> bool:
+        """
+        False khi dùng `name` đòi hỏi tải lại nhưng chính sách "degrade" không cho phép vì
+        RSS cộng footprint của nó sẽ vượt ngân sách (pipeline khi đó bỏ qua bước này).
+        """
+        if self.is_loaded(name) or self.policy != "degrade":
+            return True
+        rss = current_rss_mb()
+        return rss is None or rss + self.components[name].footprint_mb <= self.budget_mb
+
+    def report(self) -> dict:
+        now = time.monotonic()
+        rss = current_rss_mb()
+        return {
+            "policy": self.policy,
+            "budget_mb": self.budget_mb,
+            "rss_mb": round(rss, 1) if rss is not None else None,
+            "components": {
+                name: {
+                    "loaded": c.loaded,
+                    "footprint_mb": round(c.footprint_mb, 1),
+                    "idle_seconds": round(now - c.last_used, 1),
+                    "loads": c.loads,
+                }
+                for name, c in self.components.items()
+            },
+        }
+
+    def _rss_text(self) -> str:
+        rss = current_rss_mb()
+        return f"{rss:.0f}/{self.budget_mb:.0f} MB" if rss is not None else "không rõ"
+
+
+memory_manager = MemoryManager()
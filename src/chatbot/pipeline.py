@@ -7,78 +7,62 @@ from pathlib import Path
 project_root = Path(__file__).resolve().parent.parent.parent
 sys.path.append(str(project_root))
 
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline, BitsAndBytesConfig
-from peft import PeftModel
-from typing import List
+from typing import List, Optional
 
 # Import RetrievalSystem đã được tách riêng
 from src.chatbot.retrieval_system import RetrievalSystem
+from src.chatbot.session_store import SessionStore
+from src.chatbot import backends
+from src.chatbot.backends import load_generator, ExtractiveGenerator
+from src.chatbot.tracing import tracer
+from src.chatbot.memory_manager import memory_manager
+from src.chatbot.profiler import request_profiler
+from src.chatbot.admission import admission_controller, ServiceTier, FULL_TIER, SOURCES_ONLY_TIER
+from src.chatbot.cancellation import CancellationToken, stopping_criteria
 # Import các cấu hình cần thiết
-from src.chatbot.config import LLM_MODEL_NAME, DEVICE, LORA_ADAPTER_PATH
+from src.chatbot.config import LLM_MAX_NEW_TOKENS
+
+# Câu trả lời khi không dùng được LLM (chính sách bộ nhớ "degrade" hoặc mức "sources_only"
+# của admission control): chỉ trả về các nguồn
+SOURCES_ONLY_ANSWER = (
+    "Hệ thống đang tạm thời quá tải nên chưa thể tạo câu trả lời. "
+    "Dưới đây là các thông tin liên quan nhất tìm được trong tài liệu."
+)
 
 class RAGPipeline:
     """
     Class đóng gói toàn bộ pipeline RAG, sử dụng RetrievalSystem và LLM.
     Phiên bản này có khả năng tải LoRA adapter đã được fine-tune.
     """
-    def __init__(self):
+    def __init__(self, load_retrieval: bool = True):
         """
         Khởi tạo pipeline bằng cách tải RetrievalSystem và mô hình LLM.
+        `load_retrieval=False` chỉ tải LLM (vd: đánh giá câu trả lời trên context cho sẵn).
         """
         print("--- Đang khởi tạo RAG Pipeline (Đầy đủ) ---")
-        self.retrieval_system = RetrievalSystem()
+        self.retrieval_system = RetrievalSystem() if load_retrieval else None
+        self.sessions = SessionStore()
+        self.admission = admission_controller
+        self.extractor = ExtractiveGenerator() # Mức "extractive" của admission control, không cần LLM
         self.llm_pipe = self._load_llm()
+        report = self.memory_report()
+        print(f"   -> Bộ nhớ LLM: {report['total_mb']} MB (model gốc {report['base_model_mb']} MB, adapter {report['adapters_mb']})")
         print("RAG Pipeline đã sẵn sàng!")
 
-    def _load_llm(self) -> pipeline:
+    def _load_llm(self):
         """
-        Tải mô hình ngôn ngữ lớn (LLM).
-        Nếu tìm thấy LoRA adapter đã được fine-tune, nó sẽ được áp dụng.
-        Ngược lại, sẽ sử dụng model gốc.
+        Tải mô hình ngôn ngữ lớn (LLM) theo GENERATOR_BACKEND (xem backends.py). Với backend "hf":
+        - LORA_SERVING_MODE = "merge": nếu tìm thấy LoRA adapter, adapter được merge vào model gốc;
+          ngược lại dùng model gốc.
+        - LORA_SERVING_MODE = "multi": model gốc được tải một lần và gắn các adapter trong
+          LORA_ADAPTERS theo tên, mỗi request chọn adapter qua tham số `adapter`.
         """
-        print(f"4. Đang tải LLM và Tokenizer...")
-
-        # --- BƯỚC 1: TẢI MODEL GỐC VỚI QUANTIZATION 4-BIT ---
-        # Cấu hình quantization phải giống hệt như lúc train
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=torch.bfloat16,
-            bnb_4bit_use_double_quant=False,
-        )
-        
-        print(f"   -> Đang tải model gốc: '{LLM_MODEL_NAME}' trên '{DEVICE}'...")
-        base_model = AutoModelForCausalLM.from_pretrained(
-            LLM_MODEL_NAME,
-            quantization_config=bnb_config,
-            device_map=DEVICE,
-            trust_remote_code=True
-        )
-
-        # --- BƯỚC 2: KIỂM TRA VÀ ÁP DỤNG LoRA ADAPTER ---
-        if LORA_ADAPTER_PATH and LORA_ADAPTER_PATH.exists():
-            print(f"   -> Tìm thấy LoRA adapter! Đang áp dụng từ: '{LORA_ADAPTER_PATH}'")
-            # Tải adapter và áp dụng lên model gốc
-            model = PeftModel.from_pretrained(base_model, str(LORA_ADAPTER_PATH))
-            # Hợp nhất các trọng số của adapter vào model gốc để tăng tốc độ inference.
-            # Sau bước này, model sẽ hoạt động như một model đầy đủ đã được fine-tune.
-            print("   -> Đang hợp nhất (merging) LoRA adapter...")
-            model = model.merge_and_unload()
-            print("   -> Hợp nhất thành công!")
-        else:
-            print("   -> Không tìm thấy LoRA adapter. Sử dụng model gốc.")
-            model = base_model
-        
-        tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_NAME)
-        tokenizer.pad_token = tokenizer.eos_token
-        tokenizer.padding_side = "right"
-
-        return pipeline(
-            "text-generation",
-            model=model,
-            tokenizer=tokenizer
-        )
+        # Backend quyết định dạng `stopping_criteria` truyền vào lượt sinh (xem cancellation.py)
+        self.generator_backend = backends.GENERATOR_BACKEND
+        print(f"4. Đang tải LLM và Tokenizer (backend '{self.generator_backend}')...")
+        # Handle và pipeline của LLM được gỡ và tải lại cùng nhau khi bật MEMORY_MANAGER_ENABLED
+        self.llm, llm_pipe = memory_manager.register("llm", load_generator, parts=2)
+        return llm_pipe
 
     def _build_prompt(self, query: str, context_contents: List[str]) -> str:
         """Xây dựng Prompt để gửi cho LLM."""
@@ -108,39 +92,137 @@ class RAGPipeline:
                 """
             }
         ]
-        return self.llm_pipe.tokenizer.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
+        with tracer.span("prompt_build", n_docs=len(context_contents)) as span:
+            prompt = self.llm_pipe.tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+            if span.recording:
+                # Đếm token chỉ khi bật tracing để không tốn thêm chi phí khi tắt
+                span.set(prompt_tokens=self._count_tokens(prompt))
+        return prompt
+
+    def _count_tokens(self, text: str) -> int:
+        return len(self.llm_pipe.tokenizer.encode(text, add_special_tokens=False))
 
-    def get_answer(self, query: str) -> dict:
+    def memory_report(self) -> dict:
+        """Bộ nhớ của LLM: một model gốc cộng các adapter nhỏ (chế độ "multi") thay vì N model đầy đủ."""
+        return self.llm.memory_report()
+
+    def get_answer(self, query: str, session_id: Optional[str] = None, adapter: Optional[str] = None,
+                   cancel_token: Optional[CancellationToken] = None) -> dict:
         """
         Hàm chính để nhận câu hỏi và trả về câu trả lời cuối cùng từ LLM.
+        Nếu có `session_id`, các tài liệu của lượt trước trong phiên được tái sử dụng
+        cho câu hỏi nối tiếp khi chúng vẫn còn phù hợp. `adapter` chọn LoRA adapter
+        (chế độ "multi"); mặc định là DEFAULT_ADAPTER.
+
+        Khi bật ADMISSION_ENABLED, mức phục vụ (trường "tier" của kết quả) được chọn theo tải hiện tại.
+
+        `cancel_token` cho phép huỷ request từ bên ngoài (raise RequestCancelled) và đặt deadline; khi hết
+        deadline, kết quả dở dang được trả về với `"partial": True`. Mặc định không có deadline: các điểm
+        nhận request (giao diện Gradio, API server) tự đặt REQUEST_DEADLINE_SECONDS.
         """
-        # Bước 1 & 2: Lấy context đã được truy xuất và tái xếp hạng
-        final_ranked_docs = self.retrieval_system.get_ranked_context(query)
-        
+        cancel_token = cancel_token or CancellationToken()
+        # Khi bật PROFILER_ENABLED, một phần request (được lấy mẫu hoặc chậm) được lưu profile
+        with request_profiler.profile(query, session=session_id is not None, adapter=adapter), \
+                self.admission.admit() as tier, \
+                tracer.span("get_answer", session=session_id is not None, adapter=adapter, tier=tier.name):
+            # Kiểm tra adapter trước khi tốn công truy xuất
+            self.resolve_adapter(adapter)
+            # Bước 1 & 2: Lấy context đã được truy xuất và tái xếp hạng
+            final_ranked_docs = self.get_context(query, session_id, tier, cancel_token)
+            return self.answer_from_docs(query, final_ranked_docs, adapter, tier, cancel_token)
+
+    def resolve_adapter(self, adapter: Optional[str] = None) -> Optional[str]:
+        """
+        Chuẩn hoá tên adapter (raise UnknownAdapterError nếu không có). Khi LLM đã bị gỡ và
+        chính sách bộ nhớ không cho tải lại, trả về nguyên `adapter` thay vì tải LLM chỉ để kiểm tra.
+        """
+        if not memory_manager.can_use("llm"):
+            return adapter
+        return self.llm.resolve(adapter)
+
+    def get_context(self, query: str, session_id: Optional[str] = None, tier: ServiceTier = FULL_TIER,
+                    cancel_token: Optional[CancellationToken] = None) -> List[dict]:
+        """Truy xuất context cho câu hỏi, dùng trạng thái của phiên nếu có; `tier` quyết định độ sâu và có rerank hay không."""
+        session = self.sessions.get(session_id) if session_id else None
+        return self.retrieval_system.get_ranked_context(
+            query, session=session, n_retrieve=tier.n_retrieve, rerank=tier.rerank, cancel_token=cancel_token
+        )
+
+    def answer_from_docs(self, query: str, final_ranked_docs: List[dict], adapter: Optional[str] = None,
+                         tier: ServiceTier = FULL_TIER, cancel_token: Optional[CancellationToken] = None) -> dict:
+        """
+        Sinh câu trả lời từ các tài liệu đã được truy xuất và tái xếp hạng.
+        Được tách riêng để API server có thể giới hạn tải cho bước truy xuất
+        và bước sinh câu trả lời một cách độc lập. Ở các mức giảm tải, câu trả lời
+        được trích từ context ("extractive") hoặc chỉ gồm các nguồn ("sources").
+
+        Với `cancel_token`, việc sinh dừng ngay ở token kế tiếp khi request bị huỷ (raise
+        RequestCancelled) hoặc hết deadline (trả về phần đã sinh, `"partial": True`).
+        """
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
         if not final_ranked_docs:
             return {
                 "answer": "Xin lỗi, tôi không tìm thấy bất kỳ thông tin nào liên quan đến câu hỏi của bạn.",
-                "sources": []
+                "sources": [],
+                "tier": tier.name
             }
 
         final_context_contents = [doc['content'] for doc in final_ranked_docs]
-        
-        # Bước 3: Xây dựng prompt
-        prompt = self._build_prompt(query, final_context_contents)
-        
-        # Bước 4: Sinh câu trả lời từ LLM
-        generation_args = {
-            "max_new_tokens": 512,
-            "return_full_text": False,
-            "temperature": 0.1,
-            "do_sample": True,
-        }
-        output = self.llm_pipe(prompt, **generation_args)
-        answer = output[0]['generated_text'].strip()
-        
-        return {
+
+        if tier.answer_mode == "generate" and not memory_manager.can_use("llm"):
+            # Chính sách bộ nhớ "degrade": không đủ bộ nhớ để tải lại LLM, trả về các nguồn đã truy xuất
+            return {"answer": SOURCES_ONLY_ANSWER, "sources": final_context_contents,
+                    "tier": SOURCES_ONLY_TIER.name, "degraded": True}
+        if tier.answer_mode == "sources":
+            return {"answer": SOURCES_ONLY_ANSWER, "sources": final_context_contents, "tier": tier.name}
+        if tier.answer_mode == "extractive":
+            with tracer.span("extract"):
+                answer = self.extractor.extract("\n\n---\n\n".join(final_context_contents), query)
+            return {"answer": answer, "sources": final_context_contents, "tier": tier.name}
+
+        # Ghim LLM để tokenizer (dựng prompt) và model (sinh) thuộc cùng một lần tải;
+        # chỉ ADMISSION_GENERATE_CONCURRENCY lượt sinh chạy cùng lúc khi bật admission control
+        with self.admission.generation_slot(), memory_manager.pin("llm"):
+            # Request có thể đã bị huỷ hoặc hết hạn trong lúc chờ đến lượt sinh
+            cancel_token.raise_if_cancelled()
+            if cancel_token.expired:
+                return {"answer": SOURCES_ONLY_ANSWER, "sources": final_context_contents,
+                        "tier": tier.name, "partial": True}
+
+            # Bước 3: Xây dựng prompt
+            prompt = self._build_prompt(query, final_context_contents)
+
+            # Bước 4: Sinh câu trả lời từ LLM
+            generation_args = {
+                "max_new_tokens": LLM_MAX_NEW_TOKENS,
+                "return_full_text": False,
+                "temperature": 0.1,
+                "do_sample": True,
+                # Dừng ở token kế tiếp khi request bị huỷ hoặc hết deadline thay vì sinh đủ LLM_MAX_NEW_TOKENS
+                "stopping_criteria": stopping_criteria(cancel_token, self.generator_backend),
+            }
+            with tracer.span("generate", adapter=adapter, max_new_tokens=LLM_MAX_NEW_TOKENS) as span:
+                with self.llm.use(adapter):
+                    output = self.llm_pipe(prompt, **generation_args)
+                answer = output[0]['generated_text'].strip()
+                if span.recording:
+                    prompt_tokens, completion_tokens = self._count_tokens(prompt), self._count_tokens(answer)
+                    span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+                    tracer.count("llm_tokens", prompt_tokens, kind="prompt")
+                    tracer.count("llm_tokens", completion_tokens, kind="completion")
+                if cancel_token.should_stop:
+                    span.set(stopped=cancel_token.reason or "deadline")
+
+        # Không ai còn chờ kết quả: bỏ câu trả lời đã sinh
+        cancel_token.raise_if_cancelled()
+        result = {
             "answer": answer,
-            "sources": final_context_contents
-        }
\ No newline at end of file
+            "sources": final_context_contents,
+            "tier": tier.name
+        }
+        if cancel_token.expired:
+            result["partial"] = True
+        return result
\ No newline at end of file
@@ -0,0 +1,153 @@
+# src/chatbot/profiler.py
+
+import cProfile
+import io
+import json
+import platform
+import pstats
+import random
+import shutil
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from src.chatbot import config
+from src.chatbot.config import (
+    PROFILER_ENABLED, PROFILER_SAMPLE_RATE, PROFILER_SLOW_MS, PROFILER_USE_TORCH, PROFILE_DIR, PROFILE_MAX_CAPTURES
+)
+from src.chatbot.tracing import tracer
+
+TOP_FUNCTIONS = 40  # Số hàm (theo thời gian tích luỹ) in ra profile.txt
+
+
+def config_snapshot() -> dict:
+    """Các hằng số cấu hình (chữ in hoa) tại thời điểm capture, để tái hiện request offline."""
+    return {name: value for name, value in vars(config).items() if name.isupper()}
+
+
+class RequestProfiler:
+    """
+    Profile `RAGPipeline.get_answer` cho một tỉ lệ request được lấy mẫu, và giữ lại mọi request
+    chậm hơn `slow_ms`. Vì chỉ biết request có chậm hay không khi nó kết thúc, khi có `slow_ms`
+    mọi request đều chạy dưới cProfile (chi phí nhỏ so với thời gian chạy mô hình) và chỉ những
+    request được lấy mẫu hoặc chậm mới được lưu. Torch profiler tốn kém hơn nên chỉ chạy cho
+    request được lấy mẫu.
+
+    cProfile chỉ cho phép một profiler hoạt động tại một thời điểm: request đến khi đang có
+    request khác được profile sẽ chạy bình thường, không bị profile.
+    """
+    def __init__(self, enabled: bool = PROFILER_ENABLED, sample_rate: float = PROFILER_SAMPLE_RATE,
+                 slow_ms: Optional[float] = PROFILER_SLOW_MS, use_torch: bool = PROFILER_USE_TORCH,
+                 capture_dir: Path = PROFILE_DIR, max_captures: int = PROFILE_MAX_CAPTURES):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.use_torch = use_torch
+        self.capture_dir = Path(capture_dir)
+        self.max_captures = max_captures
+        self._active = threading.Lock()
+
+    def profile(self, query: str, **attrs):
+        """Context manager bao quanh một request; trả về nullcontext khi không profile request này."""
+        if not self.enabled:
+            return nullcontext()
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_ms is None:
+            return nullcontext()
+        if not self._active.acquire(blocking=False):
+            tracer.count("profiles", result="skipped_busy")
+            return nullcontext()
+        return self._profiled(query, sampled, attrs)
+
+    @contextmanager
+    def _profiled(self, query: str, sampled: bool, attrs: dict):
+        profile = cProfile.Profile()
+        torch_profiler, root, error = None, None, None
+        start = time.perf_counter()
+        # `_active` đã được giữ từ profile(): mọi bước từ đây phải nằm trong try/finally để luôn được nhả
+        try:
+            if sampled and self.use_torch:
+                torch_profiler = self._start_torch_profiler()
+            with tracer.capture("profiled_request") as root:
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if torch_profiler is not None:
+                torch_profiler.__exit__(None, None, None)
+            self._active.release()
+            reason = "sampled" if sampled else "slow" if elapsed_ms >= self.slow_ms else None
+            if reason is not None and root is not None:
+                try:
+                    self._save(reason, query, attrs, elapsed_ms, error, profile, torch_profiler, root.trace.spans)
+                except OSError as e:
+                    print(f"[LỖI] Không thể lưu profile: {e}")
+
+    @staticmethod
+    def _start_torch_profiler():
+        try:
+            import torch
+            from torch.profiler import ProfilerActivity, profile
+        except ImportError:
+            return None
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+        torch_profiler = profile(activities=activities)
+        try:
+            torch_profiler.__enter__()
+        except RuntimeError as e:
+            # vd: một torch profiler khác đang chạy; request vẫn được profile bằng cProfile
+            print(f"[Cảnh báo] Không thể khởi động torch profiler: {e}")
+            return None
+        return torch_profiler
+
+    def _save(self, reason: str, query: str, attrs: dict, elapsed_ms: float, error: Optional[str],
+              profile: cProfile.Profile, torch_profiler, spans: list):
+        """Lưu một capture vào thư mục riêng rồi xoá các capture cũ nhất vượt quá `max_captures`."""
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{reason}_{elapsed_ms:.0f}ms_{uuid.uuid4().hex[:6]}"
+        capture = self.capture_dir / name
+        capture.mkdir(parents=True, exist_ok=True)
+
+        profile.dump_stats(str(capture / "profile.pstats"))
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        (capture / "profile.txt").write_text(summary.getvalue(), encoding="utf-8")
+        if torch_profiler is not None:
+            torch_profiler.export_chrome_trace(str(capture / "torch_trace.json"))
+
+        meta = {
+            "reason": reason,
+            "query": query,
+            **attrs,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "error": error,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "stages": sorted(spans, key=lambda s: s["start_ms"]),
+            "config": config_snapshot(),
+            "environment": {"python": sys.version.split()[0], "platform": platform.platform()},
+        }
+        with open(capture / "request.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2, default=str)
+
+        self._prune()
+        tracer.count("profiles", result=reason)
+        print(f"🔬 Đã lưu profile request ({reason}, {elapsed_ms:.0f} ms) vào: {capture}")
+
+    def _prune(self):
+        # Tên thư mục bắt đầu bằng thời điểm capture nên sắp xếp theo tên là theo thời gian
+        captures = sorted(p for p in self.capture_dir.iterdir() if p.is_dir())
+        for old in captures[:max(len(captures) - self.max_captures, 0)]:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+request_profiler = RequestProfiler()
@@ -1,26 +1,35 @@
 # src/chatbot/retrieval_system.py
 
 import sys
+import threading
+import time
 from pathlib import Path
 
 # Thêm thư mục gốc của dự án vào Python Path
 project_root = Path(__file__).resolve().parent.parent.parent
 sys.path.append(str(project_root))
 
-from sentence_transformers import SentenceTransformer, CrossEncoder
 import chromadb
-from typing import List
+import numpy as np
+from typing import List, Optional
 
 # Import các cấu hình từ file config trung tâm
 from src.chatbot.config import (
-    CHROMA_PATH,
-    COLLECTION_NAME,
-    EMBEDDING_MODEL_NAME,
-    RERANKER_MODEL_NAME,
-    DEVICE,
+    EMBEDDING_BACKEND,
+    RERANKER_BACKEND,
     N_RETRIEVE_RESULTS,
-    N_FINAL_RESULTS
+    N_FINAL_RESULTS,
+    SESSION_REUSE_MIN_SCORE,
+    INDEX_POINTER_CHECK_SECONDS
 )
+from src.chatbot.session_store import ConversationState
+from src.chatbot.chunking import merge_chunks
+from src.chatbot.document_store import DocumentStore
+from src.chatbot import index_registry
+from src.chatbot.backends import load_embedder, load_reranker, embedding_model_id, reranker_model_id
+from src.chatbot.tracing import tracer
+from src.chatbot.memory_manager import memory_manager
+from src.chatbot.cancellation import CancellationToken
 
 class RetrievalSystem:
     """
@@ -31,58 +40,255 @@ class RetrievalSystem:
         """Khởi tạo và tải các mô hình cần thiết cho việc truy xuất."""
         print("--- Đang khởi tạo Retrieval System (tinh gọn) ---")
         self.embedder = self._load_embedding_model()
-        self.collection = self._connect_to_chromadb()
+        self._swap_lock = threading.Lock()
+        self._last_index_check = time.monotonic()
+        self._pointer_signature = index_registry.pointer_signature()
+        self.collection_name, self.collection, self.document_store = self._connect_to_chromadb()
         self.reranker = self._load_reranker_model()
         print("✅ Retrieval System đã sẵn sàng!")
 
-    def _load_embedding_model(self) -> SentenceTransformer:
-        """Tải mô hình Bi-Encoder để tạo vector embedding."""
-        print(f"1. Đang tải Embedding Model: '{EMBEDDING_MODEL_NAME}' trên '{DEVICE}'...")
-        return SentenceTransformer(EMBEDDING_MODEL_NAME, device=DEVICE)
+    def _load_embedding_model(self):
+        """Tải mô hình Bi-Encoder để tạo vector embedding (backend theo EMBEDDING_BACKEND)."""
+        print(f"1. Đang tải Embedding Model: '{embedding_model_id()}' (backend '{EMBEDDING_BACKEND}')...")
+        return memory_manager.register("embedder", load_embedder)
 
-    def _connect_to_chromadb(self) -> chromadb.Collection:
-        """Kết nối tới cơ sở dữ liệu vector ChromaDB."""
-        print(f"2. Đang kết nối tới ChromaDB tại: '{CHROMA_PATH}'...")
-        client = chromadb.PersistentClient(path=str(CHROMA_PATH))
-        return client.get_collection(name=COLLECTION_NAME)
+    def _connect_to_chromadb(self) -> tuple:
+        """
+        Kết nối tới phiên bản index đang hoạt động trong ChromaDB, trả về
+        (tên collection, collection, kho tài liệu). Kho tài liệu là None với các
+        index được build trước khi có kho; khi đó nội dung được lấy từ ChromaDB.
+        """
+        chroma_path, collection_name = index_registry.get_active_index()
+        print(f"2. Đang kết nối tới ChromaDB tại: '{chroma_path}' (collection '{collection_name}')...")
+        client = chromadb.PersistentClient(path=str(chroma_path))
+        collection = client.get_collection(name=collection_name)
+        document_store = DocumentStore.open_if_exists(index_registry.document_store_path(chroma_path, collection_name))
+        return collection_name, collection, document_store
+
+    def _reopen_document_store(self):
+        """Mở lại kho tài liệu khi build_database ghi lại kho của collection đang phục vụ."""
+        store = self.document_store
+        if store is None or not store.is_stale():
+            return
+        try:
+            self.document_store = DocumentStore(store.store_path)
+        except (OSError, ValueError) as e:
+            print(f"[LỖI] Không thể mở lại kho tài liệu: {e}")
+
+    def refresh_index(self, force: bool = False) -> bool:
+        """
+        Chuyển sang phiên bản index mới nếu con trỏ alias đã thay đổi (hot swap,
+        không cần khởi động lại). Việc kiểm tra chỉ tốn một lệnh stat và được giới
+        hạn tối đa mỗi INDEX_POINTER_CHECK_SECONDS giây. Trả về True nếu đã chuyển.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_index_check < INDEX_POINTER_CHECK_SECONDS:
+            return False
+        self._last_index_check = now
+
+        self._reopen_document_store()
+        signature = index_registry.pointer_signature()
+        if signature == self._pointer_signature:
+            return False
+
+        with self._swap_lock:
+            if signature == self._pointer_signature:
+                return False
+            try:
+                collection_name, collection, document_store = self._connect_to_chromadb()
+            except Exception as e:
+                # Giữ nguyên phiên bản đang phục vụ nếu phiên bản mới không mở được
+                print(f"[LỖI] Không thể chuyển sang phiên bản index mới: {e}")
+                self._pointer_signature = signature
+                return False
+            # Gán lại tham chiếu là thao tác nguyên tử; các request đang chạy vẫn dùng collection cũ
+            self.collection_name, self.collection, self.document_store = collection_name, collection, document_store
+            self._pointer_signature = signature
+        print(f"✅ Đã chuyển sang phiên bản index '{collection_name}'.")
+        return True
 
-    def _load_reranker_model(self) -> CrossEncoder:
-        """Tải mô hình Cross-Encoder để tái xếp hạng."""
-        print(f"3. Đang tải Re-ranker Model: '{RERANKER_MODEL_NAME}' trên '{DEVICE}'...")
-        return CrossEncoder(RERANKER_MODEL_NAME, max_length=512, device=DEVICE)
+    def _load_reranker_model(self):
+        """Tải mô hình Cross-Encoder để tái xếp hạng (backend theo RERANKER_BACKEND)."""
+        print(f"3. Đang tải Re-ranker Model: '{reranker_model_id()}' (backend '{RERANKER_BACKEND}')...")
+        return memory_manager.register("reranker", load_reranker)
 
-    def get_ranked_context(self, query: str) -> List[dict]:
+    def get_ranked_context(self, query: str, session: Optional[ConversationState] = None,
+                           n_retrieve: Optional[int] = None, rerank: bool = True,
+                           cancel_token: Optional[CancellationToken] = None) -> List[dict]:
         """
-        Thực hiện truy xuất và tái xếp hạng, sau đó trả về
-        thông tin đầy đủ (id, content, metadata) của các tài liệu cuối cùng.
+        Thực hiện truy xuất và tái xếp hạng trên các chunk, sau đó trả về
+        thông tin đầy đủ (id, content, metadata) của các tài liệu gốc cuối cùng
+        (mỗi tài liệu gốc xuất hiện một lần, theo điểm của chunk tốt nhất).
+
+        Nếu có `session`, câu hỏi được chấm điểm lại trên các tài liệu của lượt
+        trước; truy xuất đầy đủ chỉ chạy khi các tài liệu đó không còn phù hợp.
+
+        `n_retrieve` (mặc định N_RETRIEVE_RESULTS) và `rerank=False` dùng khi giảm tải
+        (admission control): bỏ reranker thì giữ thứ tự độ tương đồng của ChromaDB.
+
+        Với `cancel_token`, request đã bị huỷ dừng ở ranh giới giữa các bước (RequestCancelled);
+        request đã hết deadline bỏ qua reranker và trả về kết quả theo thứ tự của ChromaDB.
         """
-        # Bước 1: Truy xuất ban đầu từ ChromaDB
-        query_embedding = self.embedder.encode(query).tolist()
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=N_RETRIEVE_RESULTS,
-            include=["metadatas", "documents"]
-        )
-
-        # Tạo một danh sách các dictionary chứa thông tin tài liệu ban đầu
-        initial_docs = []
-        for i in range(len(results['ids'][0])):
-            initial_docs.append({
-                "id": results['ids'][0][i],
-                "content": results['documents'][0][i],
-                "metadata": results['metadatas'][0][i]
-            })
-
-        if not initial_docs:
-            return []
-
-        # Bước 2: Tái xếp hạng các tài liệu đã truy xuất
-        context_contents = [doc['content'] for doc in initial_docs]
-        pairs = [[query, content] for content in context_contents]
-        scores = self.reranker.predict(pairs)
-        
-        # Sắp xếp lại danh sách tài liệu ban đầu dựa trên điểm số mới
-        reranked_docs = sorted(zip(scores, initial_docs), reverse=True)
-        
-        # Trả về N_FINAL_RESULTS tài liệu tốt nhất
-        return [doc for score, doc in reranked_docs][:N_FINAL_RESULTS]
\ No newline at end of file
+        n_retrieve = n_retrieve or N_RETRIEVE_RESULTS
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
+        self.refresh_index()
+        collection_name, collection, store = self.collection_name, self.collection, self.document_store
+        with tracer.span("retrieve", collection=collection_name) as span:
+            with tracer.span("embed"):
+                query_embedding = self.embedder.encode(query)
+            cancel_token.raise_if_cancelled()
+
+            if session is not None:
+                reused_docs = self._rescore_session_docs(query_embedding, session, collection_name)
+                # Tài liệu của lượt trước còn phù hợp được tính là một lần cache hit
+                cache_result = "hit" if reused_docs is not None else "miss"
+                span.set(session_cache=cache_result)
+                tracer.count("cache_requests", cache="session", result=cache_result)
+                if reused_docs is not None:
+                    span.set(n_final=len(reused_docs))
+                    return reused_docs
+
+            # Bước 1: Truy xuất ban đầu các chunk từ ChromaDB
+            # Nội dung lấy từ kho tài liệu nếu có; embedding chỉ cần khi lưu lại cho phiên hội thoại
+            include = ["metadatas"] + (["documents"] if store is None else []) + (["embeddings"] if session is not None else [])
+            with tracer.span("chroma_query", n_results=n_retrieve) as query_span:
+                results = collection.query(
+                    query_embeddings=[query_embedding.tolist()],
+                    n_results=n_retrieve,
+                    include=include
+                )
+
+                # Tạo một danh sách các dictionary chứa thông tin tài liệu ban đầu
+                initial_docs = []
+                for i in range(len(results['ids'][0])):
+                    initial_docs.append({
+                        "id": results['ids'][0][i],
+                        "content": results['documents'][0][i] if store is None else None,
+                        "metadata": results['metadatas'][0][i]
+                    })
+                if store is not None:
+                    self._fill_chunk_contents(collection, store, initial_docs)
+                query_span.set(n_candidates=len(initial_docs))
+            span.set(n_candidates=len(initial_docs))
+            cancel_token.raise_if_cancelled()
+            if rerank and cancel_token.expired:
+                # Hết deadline: bỏ bước tốn kém nhất còn lại, trả về thứ tự của ChromaDB
+                rerank = False
+                span.set(deadline_skipped_rerank=True)
+
+            if not initial_docs:
+                span.set(n_final=0)
+                return []
+
+            # Bước 2: Tái xếp hạng các chunk đã truy xuất (mỗi cặp bị giới hạn bởi CHUNK_MAX_TOKENS)
+            context_contents = [doc['content'] for doc in initial_docs]
+            pairs = [[query, content] for content in context_contents]
+            if rerank:
+                with tracer.span("rerank", n_pairs=len(pairs)):
+                    scores = self.reranker.predict(pairs)
+            else:
+                # Kết quả của ChromaDB đã được sắp theo độ tương đồng giảm dần
+                scores = [-i for i in range(len(initial_docs))]
+
+            # Sắp xếp lại các chunk theo điểm số mới, giữ chunk tốt nhất của mỗi tài liệu gốc
+            order, seen_parents = [], set()
+            for i in sorted(range(len(initial_docs)), key=lambda i: scores[i], reverse=True):
+                parent_id = self._parent_id(initial_docs[i])
+                if parent_id not in seen_parents:
+                    seen_parents.add(parent_id)
+                    order.append(i)
+                if len(order) == N_FINAL_RESULTS:
+                    break
+            with tracer.span("expand_parents"):
+                final_docs = self._expand_to_parents(collection, store, [initial_docs[i] for i in order])
+            span.set(n_final=len(final_docs))
+
+            if session is not None:
+                doc_embeddings = np.asarray([results['embeddings'][0][i] for i in order], dtype=np.float32)
+                session.remember(query, final_docs, doc_embeddings, collection_name)
+
+            # Trả về N_FINAL_RESULTS tài liệu tốt nhất
+            return final_docs
+
+    @staticmethod
+    def _parent_id(chunk: dict) -> str:
+        # Collection cũ (chưa chia chunk) không có `parent_id`: mỗi bản ghi là một tài liệu
+        return (chunk['metadata'] or {}).get('parent_id', chunk['id'])
+
+    def _fill_chunk_contents(self, collection, store: DocumentStore, chunks: List[dict]):
+        """Điền nội dung chunk từ kho tài liệu; chunk không có trong kho (kho cũ hơn index) lấy từ ChromaDB."""
+        missing = []
+        for chunk in chunks:
+            parent = store.get(self._parent_id(chunk))
+            if parent is None:
+                missing.append(chunk)
+                continue
+            index = (chunk['metadata'] or {}).get('chunk_index', 0)
+            parent_chunks = parent.get('chunks', [parent['content']])
+            chunk['content'] = parent_chunks[index] if index < len(parent_chunks) else parent['content']
+        if missing:
+            results = collection.get(ids=[c['id'] for c in missing], include=["documents"])
+            contents = dict(zip(results['ids'], results['documents']))
+            for chunk in missing:
+                chunk['content'] = contents.get(chunk['id'], "")
+
+    def _expand_to_parents(self, collection, store: Optional[DocumentStore], chunks: List[dict]) -> List[dict]:
+        """
+        Thay mỗi chunk bằng tài liệu gốc của nó: lấy trực tiếp từ kho tài liệu, hoặc
+        (index cũ không có kho) ghép lại từ tất cả các chunk cùng `parent_id` trong ChromaDB.
+        """
+        parents_in_store = {}
+        if store is not None:
+            for chunk in chunks:
+                parent = store.get(self._parent_id(chunk))
+                if parent is not None:
+                    parents_in_store[parent['id']] = parent['content']
+
+        split_parents = [
+            self._parent_id(c) for c in chunks
+            if (c['metadata'] or {}).get('n_chunks', 1) > 1 and self._parent_id(c) not in parents_in_store
+        ]
+        siblings = {}
+        if split_parents:
+            results = collection.get(where={"parent_id": {"$in": split_parents}}, include=["documents", "metadatas"])
+            for doc_id, content, metadata in zip(results['ids'], results['documents'], results['metadatas']):
+                siblings.setdefault(metadata['parent_id'], []).append(
+                    {"id": doc_id, "content": content, "metadata": metadata}
+                )
+
+        parents = []
+        for chunk in chunks:
+            parent_id = self._parent_id(chunk)
+            metadata = {
+                key: value for key, value in (chunk['metadata'] or {}).items()
+                if key not in ("parent_id", "chunk_index", "n_chunks")
+            }
+            if parent_id in parents_in_store:
+                content = parents_in_store[parent_id]
+            elif parent_id in siblings:
+                content = merge_chunks(siblings[parent_id])
+            else:
+                content = chunk['content']
+            parents.append({"id": parent_id, "content": content, "metadata": metadata})
+        return parents
+
+    def _rescore_session_docs(self, query_embedding: np.ndarray, session: ConversationState,
+                              collection_name: str) -> Optional[List[dict]]:
+        """
+        Chấm điểm lại câu hỏi nối tiếp trên các tài liệu đã lưu của phiên bằng
+        độ tương đồng cosine. Trả về None nếu không có tài liệu nào đạt ngưỡng
+        SESSION_REUSE_MIN_SCORE hoặc tài liệu thuộc phiên bản index cũ
+        (khi đó cần truy xuất lại từ đầu).
+        """
+        cached_docs, doc_embeddings, cached_collection = session.snapshot()
+        if not cached_docs or cached_collection != collection_name:
+            return None
+
+        query_vector = query_embedding / max(np.linalg.norm(query_embedding), 1e-12)
+        similarities = doc_embeddings @ query_vector
+        if similarities.max() < SESSION_REUSE_MIN_SCORE:
+            return None
+
+        order = np.argsort(-similarities)
+        return [cached_docs[i] for i in order]
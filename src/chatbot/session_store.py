@@ -0,0 +1,77 @@
+# src/chatbot/session_store.py
+
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from src.chatbot.config import SESSION_MAX_SESSIONS, SESSION_TTL_SECONDS
+
+
+class ConversationState:
+    """
+    Trạng thái của một phiên hội thoại: câu hỏi gần nhất, các tài liệu đã
+    được xếp hạng ở lượt đó và embedding (đã chuẩn hoá L2) của chúng.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.last_query: Optional[str] = None
+        self.ranked_docs: List[dict] = []
+        self.doc_embeddings: Optional[np.ndarray] = None
+        self.collection_name: Optional[str] = None
+
+    def remember(self, query: str, ranked_docs: List[dict], doc_embeddings: np.ndarray, collection_name: str = None):
+        """Lưu kết quả của lượt hỏi hiện tại để tái sử dụng cho câu hỏi nối tiếp."""
+        norms = np.linalg.norm(doc_embeddings, axis=1, keepdims=True)
+        with self._lock:
+            self.last_query = query
+            self.ranked_docs = list(ranked_docs)
+            self.doc_embeddings = doc_embeddings / np.maximum(norms, 1e-12)
+            self.collection_name = collection_name
+
+    def snapshot(self):
+        """Trả về (ranked_docs, doc_embeddings, collection_name) một cách an toàn giữa các thread."""
+        with self._lock:
+            return self.ranked_docs, self.doc_embeddings, self.collection_name
+
+
+class SessionStore:
+    """
+    Bộ nhớ phiên có giới hạn: loại bỏ phiên ít dùng nhất (LRU) khi vượt quá
+    `max_sessions` và loại bỏ các phiên không hoạt động quá `ttl_seconds`.
+    """
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> ConversationState:
+        """Lấy (hoặc tạo mới) trạng thái của phiên và đánh dấu là vừa được sử dụng."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._sessions.pop(session_id, None)
+            state = entry[1] if entry else ConversationState()
+            self._sessions[session_id] = (now, state)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return state
+
+    def clear(self, session_id: str):
+        """Xoá trạng thái của phiên (ví dụ khi người dùng bắt đầu cuộc trò chuyện mới)."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict_expired(self, now: float):
+        # Các phiên được sắp theo thời điểm sử dụng, nên chỉ cần kiểm tra từ đầu danh sách
+        while self._sessions:
+            last_used, _ = next(iter(self._sessions.values()))
+            if now - last_used <= self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
@@ -0,0 +1,142 @@
+# src/chatbot/sft_dataset.py
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+IGNORE_INDEX = -100  # Nhãn bị bỏ qua khi tính loss (quy ước của transformers)
+ARRAYS = {
+    "input_ids": np.int32,
+    "labels": np.int32,
+    "position_ids": np.int32,
+    "segment_ids": np.int16,  # 0 = padding, 1..k = mẫu thứ k trong chuỗi
+}
+MANIFEST_NAME = "manifest.json"
+
+
+def pack_examples(lengths: Sequence[int], max_length: int) -> List[List[int]]:
+    """
+    Ghép các mẫu thành các chuỗi dài tối đa `max_length` token theo First-Fit Decreasing:
+    mẫu dài xếp trước, mỗi mẫu vào chuỗi đầu tiên còn đủ chỗ. Trả về chỉ số mẫu của từng chuỗi.
+    """
+    bins, space = [], []
+    for i in sorted(range(len(lengths)), key=lambda i: (-lengths[i], i)):
+        for b, free in enumerate(space):
+            if lengths[i] <= free:
+                bins[b].append(i)
+                space[b] -= lengths[i]
+                break
+        else:
+            bins.append([i])
+            space.append(max_length - lengths[i])
+    return bins
+
+
+def write_packed_split(split_dir: Path, examples: List[Tuple[List[int], List[int]]], max_length: int,
+                       pad_token_id: int, extra: dict) -> dict:
+    """
+    Ghép các mẫu (input_ids, labels) đã tokenize thành ma trận (số chuỗi x max_length) và
+    ghi từng mảng ra file .npy (đọc lại bằng memory-map). position_ids bắt đầu lại từ 0 ở
+    mỗi mẫu để attention không vượt qua ranh giới mẫu. Manifest được ghi sau cùng,
+    nên thư mục chỉ được coi là hợp lệ khi mọi mảng đã ghi xong.
+    """
+    split_dir = Path(split_dir)
+    split_dir.mkdir(parents=True, exist_ok=True)
+    (split_dir / MANIFEST_NAME).unlink(missing_ok=True)
+
+    bins = pack_examples([len(ids) for ids, _ in examples], max_length)
+    shape = (len(bins), max_length)
+    arrays = {name: np.zeros(shape, dtype=dtype) for name, dtype in ARRAYS.items()}
+    arrays["input_ids"][:] = pad_token_id
+    arrays["labels"][:] = IGNORE_INDEX
+    for row, members in enumerate(bins):
+        pos = 0
+        for segment, i in enumerate(members, start=1):
+            ids, labels = examples[i]
+            end = pos + len(ids)
+            arrays["input_ids"][row, pos:end] = ids
+            arrays["labels"][row, pos:end] = labels
+            arrays["position_ids"][row, pos:end] = np.arange(len(ids))
+            arrays["segment_ids"][row, pos:end] = segment
+            pos = end
+        # Phần padding cuối chuỗi là một đoạn liền (không phải nhiều mẫu dài 1 token)
+        arrays["position_ids"][row, pos:] = np.arange(max_length - pos)
+
+    for name, array in arrays.items():
+        tmp_path = split_dir / f"{name}.tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, split_dir / f"{name}.npy")
+
+    n_tokens = sum(len(ids) for ids, _ in examples)
+    manifest = {
+        **extra,
+        "max_length": max_length,
+        "pad_token_id": pad_token_id,
+        "n_examples": len(examples),
+        "n_sequences": len(bins),
+        "n_tokens": n_tokens,
+        "n_loss_tokens": int((arrays["labels"] != IGNORE_INDEX).sum()),
+        "fill_ratio": round(n_tokens / (len(bins) * max_length), 4) if bins else 0.0,
+        "arrays": {name: str(np.dtype(dtype)) for name, dtype in ARRAYS.items()},
+    }
+    tmp_manifest = split_dir / (MANIFEST_NAME + ".tmp")
+    with open(tmp_manifest, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_manifest, split_dir / MANIFEST_NAME)
+    return manifest
+
+
+def load_manifest(split_dir: Path) -> dict:
+    manifest_path = Path(split_dir) / MANIFEST_NAME
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"Chưa có dữ liệu SFT tại {split_dir}; hãy chạy scripts/build_sft_dataset.py.")
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class PackedSFTDataset(Dataset):
+    """
+    Đọc một split đã được ghép sẵn: mỗi phần tử là một chuỗi dài `max_length` gồm
+    input_ids, labels (IGNORE_INDEX ở mọi token không thuộc câu trả lời), position_ids
+    và segment_ids. Các mảng được memory-map, không nạp toàn bộ vào RAM.
+    """
+    def __init__(self, split_dir: Path):
+        self.split_dir = Path(split_dir)
+        self.manifest = load_manifest(self.split_dir)
+        self._arrays = {}
+        if self.manifest["n_sequences"]:
+            self._arrays = {name: np.load(self.split_dir / f"{name}.npy", mmap_mode="r") for name in ARRAYS}
+
+    def __len__(self) -> int:
+        return self.manifest["n_sequences"]
+
+    def __getitem__(self, index: int) -> Dict[str, torch.Tensor]:
+        return {name: torch.from_numpy(np.array(array[index], dtype=np.int64)) for name, array in self._arrays.items()}
+
+
+def collate_packed(batch: List[Dict[str, torch.Tensor]], block_diagonal_mask: bool = False,
+                   dtype: torch.dtype = torch.bfloat16) -> Dict[str, torch.Tensor]:
+    """
+    Gộp các chuỗi thành batch cho mô hình transformers.
+
+    - Mặc định (attn_implementation="flash_attention_2"): không truyền attention_mask,
+      flash attention tự tách các mẫu tại những vị trí position_ids quay về 0.
+    - `block_diagonal_mask=True` (eager/sdpa): thêm mask 4D dạng cộng (0 / giá trị âm lớn nhất
+      của `dtype`), mỗi token chỉ nhìn thấy các token trước nó trong cùng một mẫu.
+    """
+    out = {name: torch.stack([item[name] for item in batch]) for name in ("input_ids", "labels", "position_ids")}
+    if not block_diagonal_mask:
+        return out
+
+    segments = torch.stack([item["segment_ids"] for item in batch])
+    length = segments.shape[1]
+    causal = torch.ones(length, length, dtype=torch.bool).tril()
+    allowed = (segments[:, :, None] == segments[:, None, :]) & causal
+    mask = torch.zeros(allowed.shape, dtype=dtype).masked_fill(~allowed, torch.finfo(dtype).min)
+    out["attention_mask"] = mask[:, None]
+    return out
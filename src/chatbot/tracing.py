@@ -0,0 +1,222 @@
+# src/chatbot/tracing.py
+
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from src.chatbot.config import (
+    TRACING_ENABLED, TRACE_LOG_PATH, TRACE_LOG_MAX_BYTES, TRACE_LOG_BACKUPS, METRICS_LATENCY_BUCKETS_SECONDS
+)
+
+METRICS_PREFIX = "chatbot"
+
+
+class _NoopSpan:
+    """Span dùng khi tắt tracing: mọi thao tác đều không làm gì (chi phí gần như bằng 0)."""
+    recording = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _Trace:
+    """Một request: span gốc và mọi span con (có thể đến từ nhiều thread của executor)."""
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.perf_counter()
+        self.timestamp = time.time()
+        self.spans = []
+        self.lock = threading.Lock()
+
+
+class Span:
+    """
+    Đo thời gian của một đoạn code. Span đầu tiên (không có trace đang mở trong context) là span
+    gốc: khi kết thúc, cả trace được ghi ra log JSONL. `set(...)` gắn thuộc tính (số ứng viên,
+    số token, cache hit/miss...) vào span.
+    """
+    recording = True
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.trace = None
+        self.parent = None
+        self._tokens = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.parent = self.tracer._current_span.get()
+        self.trace = self.parent.trace if self.parent is not None else _Trace(self.name)
+        self._tokens = self.tracer._current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        self.tracer._current_span.reset(self._tokens)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        record = {
+            "name": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "start_ms": round((self.start - self.trace.start) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            **({"attrs": self.attrs} if self.attrs else {}),
+        }
+        with self.trace.lock:
+            self.trace.spans.append(record)
+        # Span được ghi do `capture()` khi tracing tắt chỉ dành cho người gọi capture
+        if self.tracer.enabled:
+            self.tracer.metrics.observe(self.name, duration)
+            if self.parent is None:
+                self.tracer._write(self.trace, duration)
+        return False
+
+
+class MetricsRegistry:
+    """Histogram thời gian theo tên span và các counter có nhãn, xuất ở định dạng văn bản của Prometheus."""
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_LATENCY_BUCKETS_SECONDS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, dict] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+
+    def observe(self, span_name: str, seconds: float):
+        with self._lock:
+            hist = self._histograms.setdefault(span_name, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @staticmethod
+    def _labels(pairs) -> str:
+        if not pairs:
+            return ""
+        escaped = []
+        for key, value in pairs:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{key}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            metric = f"{METRICS_PREFIX}_span_duration_seconds"
+            lines += [f"# HELP {metric} Thời gian của từng span (request, truy xuất, rerank, sinh câu trả lời...).",
+                      f"# TYPE {metric} histogram"]
+            for span_name, hist in sorted(self._histograms.items()):
+                for bound, count in zip(self.buckets, hist["buckets"]):
+                    lines.append(f"{metric}_bucket{self._labels([('span', span_name), ('le', repr(float(bound)))])} {count}")
+                lines.append(f"{metric}_bucket{self._labels([('span', span_name), ('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{metric}_sum{self._labels([('span', span_name)])} {hist['sum']:.6f}")
+                lines.append(f"{metric}_count{self._labels([('span', span_name)])} {hist['count']}")
+
+            for name in sorted({name for name, _ in self._counters}):
+                metric = f"{METRICS_PREFIX}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f"{metric}{self._labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """
+    Điểm vào duy nhất của tracing. Khi tắt (`enabled=False`), `span()` trả về NOOP_SPAN và
+    `count()` không làm gì, nên code đã gắn span gần như không tốn thêm chi phí.
+    """
+    def __init__(self, enabled: bool = TRACING_ENABLED, log_path: Path = TRACE_LOG_PATH,
+                 max_bytes: int = TRACE_LOG_MAX_BYTES, backups: int = TRACE_LOG_BACKUPS):
+        self.enabled = enabled
+        self.metrics = MetricsRegistry()
+        self._current_span = contextvars.ContextVar("current_span", default=None)
+        self._forced = contextvars.ContextVar("tracing_forced", default=False)
+        self._logger = None
+        if enabled:
+            self._logger = self._open_log(Path(log_path), max_bytes, backups)
+
+    @staticmethod
+    def _open_log(log_path: Path, max_bytes: int, backups: int) -> logging.Logger:
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        logger = logging.getLogger(f"chatbot.trace.{log_path}")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        if not logger.handlers:
+            # RotatingFileHandler an toàn giữa các thread và tự xoay file khi vượt max_bytes
+            handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+        return logger
+
+    def span(self, name: str, **attrs):
+        if not self.enabled and not self._forced.get():
+            return NOOP_SPAN
+        return Span(self, name, attrs)
+
+    @contextmanager
+    def capture(self, name: str, **attrs):
+        """
+        Ghi lại các span trong khối `with` kể cả khi tracing đang tắt (vd: profiler cần thời
+        gian của từng stage). Trả về span gốc; `span.trace.spans` chứa các span con sau khi khối kết thúc.
+        """
+        token = self._forced.set(True)
+        try:
+            with Span(self, name, attrs) as span:
+                yield span
+        finally:
+            self._forced.reset(token)
+
+    def current_trace_id(self) -> Optional[str]:
+        span = self._current_span.get()
+        return span.trace.trace_id if span is not None else None
+
+    def count(self, name: str, value: float = 1, **labels):
+        """Tăng counter `chatbot_<name>_total{labels}` (vd: token, cache hit/miss)."""
+        if self.enabled:
+            self.metrics.inc(name, value, **labels)
+
+    def render_metrics(self) -> str:
+        if not self.enabled:
+            return "# Tracing đang tắt (TRACING_ENABLED = False).\n"
+        return self.metrics.render()
+
+    def _write(self, trace: _Trace, duration: float):
+        record = {
+            "trace_id": trace.trace_id,
+            "name": trace.name,
+            "timestamp": round(trace.timestamp, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "spans": sorted(trace.spans, key=lambda s: s["start_ms"]),
+        }
+        self._logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+tracer = Tracer()
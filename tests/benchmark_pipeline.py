@@ -0,0 +1,377 @@
+# tests/benchmark_pipeline.py
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+# --- THIẾT LẬP ĐƯỜNG DẪN ĐỂ IMPORT TỪ THƯ MỤC `src` ---
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.chatbot.config import (
+    PROCESSED_DATA_DIR, EVAL_RESULTS_DIR, TESTS_DIR, DEVICE, N_RETRIEVE_RESULTS, N_FINAL_RESULTS
+)
+from src.chatbot.backends import embedding_model_id, reranker_model_id, generator_model_id
+from scripts.create_qa_data import NEGATIVE_ANSWER, parse_message_format
+from tests.evaluate_retrieval import latency_summary
+
+QUESTIONS_PATH = PROCESSED_DATA_DIR / "eval.jsonl"
+BASELINE_DIR = TESTS_DIR / "benchmarks"
+MODES = ("retrieval", "full")
+STAGES = ("embed", "chroma", "rerank", "prompt_build", "prefill", "decode", "end_to_end")
+REGRESSION_THRESHOLD = 0.2  # chậm hơn baseline quá 20% thì coi là regression
+MIN_REGRESSION_MS = 2.0  # bỏ qua chênh lệch tuyệt đối nhỏ hơn (nhiễu đo của các stage rất nhanh)
+
+
+def load_questions(path: Path = QUESTIONS_PATH, include_negatives: bool = False) -> List[str]:
+    """Câu hỏi (không trùng lặp, giữ thứ tự) từ eval.jsonl; mặc định bỏ các mẫu tiêu cực."""
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            _, question, answer = parse_message_format(json.loads(line))
+            if include_negatives or answer != NEGATIVE_ANSWER:
+                questions.append(question)
+    return list(dict.fromkeys(questions))
+
+
+# --- ĐO THỜI GIAN THEO STAGE ---
+class StageRecorder:
+    """Cộng dồn thời gian của từng stage cho request đang chạy trên thread hiện tại."""
+    def __init__(self):
+        self._local = threading.local()
+
+    def start_request(self):
+        self._local.samples = {}
+
+    def finish_request(self) -> Dict[str, float]:
+        samples, self._local.samples = self._local.samples, None
+        return samples
+
+    def add(self, stage: str, value: float):
+        samples = getattr(self._local, "samples", None)
+        if samples is not None:  # Lời gọi ngoài request (khởi tạo, warm-up) không được ghi
+            samples[stage] = samples.get(stage, 0.0) + value
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+
+class TimedProxy:
+    """Bọc một đối tượng (embedder, collection, reranker): các phương thức trong `stages` được đo giờ, phần còn lại chuyển thẳng."""
+    def __init__(self, target, recorder: StageRecorder, stages: Dict[str, str]):
+        self._target = target
+        self._recorder = recorder
+        self._stages = stages
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name not in self._stages:
+            return attr
+
+        def timed(*args, **kwargs):
+            with self._recorder.time(self._stages[name]):
+                return attr(*args, **kwargs)
+        return timed
+
+
+class GenerationTimer(StoppingCriteria):
+    """
+    Không bao giờ dừng việc sinh; chỉ ghi thời điểm được gọi. `generate` gọi stopping
+    criteria sau mỗi token mới, nên lần gọi đầu tiên đánh dấu hết prefill (token đầu tiên).
+    """
+    def __init__(self):
+        self.first_token_at = None
+        self.n_tokens = 0
+
+    def tick(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.n_tokens += 1
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.tick()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+
+class TimedGenerator:
+    """Bọc pipeline "text-generation": tách thời gian sinh thành prefill (tới token đầu tiên) và decode."""
+    def __init__(self, llm_pipe, recorder: StageRecorder):
+        self._pipe = llm_pipe
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+    def __call__(self, prompt, **kwargs):
+        timer = GenerationTimer()
+        criteria = kwargs.get("stopping_criteria")
+        if criteria is None or isinstance(criteria, StoppingCriteriaList):
+            kwargs["stopping_criteria"] = StoppingCriteriaList([*(criteria or []), timer])
+        else:
+            # Backend khác "hf" nhận một hàm không tham số (xem cancellation.stopping_criteria)
+            kwargs["stopping_criteria"] = lambda: timer.tick() or criteria()
+        start = time.perf_counter()
+        output = self._pipe(prompt, **kwargs)
+        end = time.perf_counter()
+        first_token_at = timer.first_token_at or end
+        self._recorder.add("prefill", first_token_at - start)
+        self._recorder.add("decode", end - first_token_at)
+        self._recorder.add("tokens", timer.n_tokens)
+        return output
+
+
+def instrument_retrieval(rs, recorder: StageRecorder):
+    """Gắn bộ đo vào RetrievalSystem. Hot swap index bị tắt để collection đã bọc không bị thay giữa chừng."""
+    rs.embedder = TimedProxy(rs.embedder, recorder, {"encode": "embed"})
+    rs.collection = TimedProxy(rs.collection, recorder, {"query": "chroma", "get": "chroma"})
+    rs.reranker = TimedProxy(rs.reranker, recorder, {"predict": "rerank"})
+    rs.refresh_index = lambda force=False: False
+
+
+def instrument_pipeline(pipeline, recorder: StageRecorder):
+    instrument_retrieval(pipeline.retrieval_system, recorder)
+    build_prompt = pipeline._build_prompt
+
+    def timed_build_prompt(*args, **kwargs):
+        with recorder.time("prompt_build"):
+            return build_prompt(*args, **kwargs)
+    pipeline._build_prompt = timed_build_prompt
+    pipeline.llm_pipe = TimedGenerator(pipeline.llm_pipe, recorder)
+
+
+# --- TÀI NGUYÊN ---
+def peak_rss_mb() -> Optional[float]:
+    """RSS cao nhất của tiến trình (MB); None trên hệ điều hành không có module `resource`."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+
+def peak_gpu_mb() -> Optional[float]:
+    if not torch.cuda.is_available():
+        return None
+    return round(torch.cuda.max_memory_allocated() / 1024 ** 2, 1)
+
+
+def environment() -> dict:
+    return {
+        "device": DEVICE,
+        "models": {"embedder": embedding_model_id(), "reranker": reranker_model_id(), "generator": generator_model_id()},
+        "gpu": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+# --- CHẠY BENCHMARK ---
+def run_benchmark(target: Callable[[str], object], questions: List[str], recorder: StageRecorder,
+                  concurrency: int, warmup_questions: List[str] = ()) -> dict:
+    """
+    Gửi các câu hỏi tới `target` với `concurrency` request song song. Các câu hỏi warm-up
+    được chạy tuần tự trước (nạp kernel, cache) và không được tính vào kết quả.
+    """
+    for question in warmup_questions:
+        target(question)
+
+    errors = []
+
+    def one_request(question: str) -> Optional[Dict[str, float]]:
+        recorder.start_request()
+        start = time.perf_counter()
+        try:
+            target(question)
+        except Exception as e:
+            recorder.finish_request()
+            errors.append(f"{question[:60]}: {e}")
+            return None
+        samples = recorder.finish_request()
+        samples["end_to_end"] = time.perf_counter() - start
+        return samples
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        records = [r for r in executor.map(one_request, questions) if r is not None]
+    wall_time = time.perf_counter() - start
+
+    stages = {
+        stage: latency_summary([r[stage] for r in records if stage in r])
+        for stage in STAGES if any(stage in r for r in records)
+    }
+    total_tokens = sum(r.get("tokens", 0) for r in records)
+    decode_time = sum(r.get("decode", 0.0) for r in records)
+    return {
+        "n_requests": len(questions),
+        "n_errors": len(errors),
+        "errors": errors[:10],
+        "wall_time_s": round(wall_time, 2),
+        "throughput_rps": round(len(records) / wall_time, 3) if wall_time else 0.0,
+        "stages": stages,
+        "generated_tokens": int(total_tokens),
+        # Token/giây của mỗi luồng decode (không tính prefill); None ở chế độ chỉ truy xuất
+        "tokens_per_sec": round(total_tokens / decode_time, 2) if decode_time else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_gpu_mb": peak_gpu_mb(),
+    }
+
+
+def build_target(mode: str, recorder: StageRecorder) -> Callable[[str], object]:
+    if mode == "retrieval":
+        from src.chatbot.retrieval_system import RetrievalSystem
+        rs = RetrievalSystem()
+        instrument_retrieval(rs, recorder)
+        return rs.get_ranked_context
+    from src.chatbot.pipeline import RAGPipeline
+    pipeline = RAGPipeline()
+    instrument_pipeline(pipeline, recorder)
+    return pipeline.get_answer
+
+
+# --- SO SÁNH VỚI BASELINE ---
+def compare_to_baseline(result: dict, baseline: dict, threshold: float,
+                        min_ms: float = MIN_REGRESSION_MS) -> List[str]:
+    """
+    Trả về danh sách regression: p50/p95 của một stage tăng quá `threshold` (tương đối) và quá
+    `min_ms` (tuyệt đối), token/giây hoặc throughput giảm quá `threshold`, RSS đỉnh tăng quá `threshold`.
+    """
+    regressions = []
+    # Stage có trong baseline nhưng không có số đo (vd: mọi request đều lỗi trước stage đó)
+    for stage in baseline.get("stages", {}):
+        if stage not in result["stages"]:
+            regressions.append(f"{stage}: có trong baseline nhưng không có số đo trong lần chạy này")
+    for stage, current in result["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if current[key] > base[key] * (1 + threshold) and current[key] - base[key] > min_ms:
+                regressions.append(f"{stage} {key}: {base[key]} -> {current[key]} (+{current[key] / base[key] - 1:.0%})")
+
+    for key in ("tokens_per_sec", "throughput_rps"):
+        if result.get(key) and baseline.get(key) and result[key] < baseline[key] * (1 - threshold):
+            regressions.append(f"{key}: {baseline[key]} -> {result[key]} ({result[key] / baseline[key] - 1:.0%})")
+    for key in ("peak_rss_mb", "peak_gpu_mb"):
+        if result.get(key) and baseline.get(key) and result[key] > baseline[key] * (1 + threshold):
+            regressions.append(f"{key}: {baseline[key]} -> {result[key]} (+{result[key] / baseline[key] - 1:.0%})")
+    return regressions
+
+
+def print_summary(result: dict):
+    print(f"\n--- Kết quả ({result['mode']}, concurrency={result['config']['concurrency']}) ---")
+    print(f"{'Stage':<14}{'p50 (ms)':>12}{'p95 (ms)':>12}{'p99 (ms)':>12}")
+    for stage, summary in result["stages"].items():
+        print(f"{stage:<14}{summary['p50_ms']:>12}{summary['p95_ms']:>12}{summary['p99_ms']:>12}")
+    print(f"Throughput: {result['throughput_rps']} request/s | Token/s (decode): {result['tokens_per_sec']} | "
+          f"RSS đỉnh: {result['peak_rss_mb']} MB | GPU đỉnh: {result['peak_gpu_mb']} MB | Lỗi: {result['n_errors']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark độ trễ từng stage và throughput của RetrievalSystem / RAGPipeline.")
+    parser.add_argument("--mode", choices=MODES, default="retrieval")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=None, help="Số câu hỏi tối đa lấy từ eval.jsonl.")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--include-negatives", action="store_true", help="Gửi cả các câu hỏi của mẫu tiêu cực.")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--baseline", type=Path, default=None, help="Mặc định: tests/benchmarks/baseline_<mode>.json.")
+    parser.add_argument("--update-baseline", action="store_true", help="Ghi kết quả lần chạy này làm baseline mới.")
+    parser.add_argument("--max-error-rate", type=float, default=0.0,
+                        help="Tỉ lệ request lỗi tối đa; vượt quá thì thoát với mã 1 và không ghi baseline.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    questions = load_questions(include_negatives=args.include_negatives)
+    warmup_questions = questions[:args.warmup]
+    if args.limit:
+        questions = questions[:args.limit]
+    print(f"--- Benchmark '{args.mode}': {len(questions)} câu hỏi, concurrency={args.concurrency} ---")
+
+    recorder = StageRecorder()
+    target = build_target(args.mode, recorder)
+    metrics = run_benchmark(target, questions, recorder, args.concurrency, warmup_questions)
+
+    result = {
+        "mode": args.mode,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "concurrency": args.concurrency,
+            "warmup": len(warmup_questions),
+            "include_negatives": args.include_negatives,
+            "n_retrieve_results": N_RETRIEVE_RESULTS,
+            "n_final_results": N_FINAL_RESULTS,
+        },
+        "environment": environment(),
+        **metrics,
+    }
+    print_summary(result)
+
+    EVAL_RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    result_path = EVAL_RESULTS_DIR / f"benchmark_{args.mode}.json"
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu kết quả vào: {result_path}")
+
+    error_rate = result["n_errors"] / result["n_requests"] if result["n_requests"] else 0.0
+    if error_rate > args.max_error_rate:
+        # Số đo của một lần chạy lỗi không đáng tin: không so sánh và không dùng làm baseline
+        print(f"\n❌ {result['n_errors']}/{result['n_requests']} request lỗi "
+              f"(tỉ lệ {error_rate:.0%} > {args.max_error_rate:.0%}):")
+        for line in result["errors"]:
+            print(f"   - {line}")
+        if args.update_baseline:
+            print("Không cập nhật baseline.")
+        sys.exit(1)
+
+    baseline_path = args.baseline or BASELINE_DIR / f"baseline_{args.mode}.json"
+    if args.update_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"✅ Đã cập nhật baseline: {baseline_path}")
+        return
+    if not baseline_path.exists():
+        print(f"[Cảnh báo] Chưa có baseline tại {baseline_path}; chạy lại với --update-baseline để tạo.")
+        return
+
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    base_env = baseline.get("environment", {})
+    if (baseline.get("config") != result["config"] or base_env.get("device") != DEVICE
+            or base_env.get("models") != result["environment"]["models"]):
+        print("[Cảnh báo] Cấu hình hoặc thiết bị khác với baseline; kết quả so sánh chỉ mang tính tham khảo.")
+    regressions = compare_to_baseline(result, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ Chậm hơn baseline ({baseline['timestamp']}) quá {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"   - {line}")
+        sys.exit(1)
+    print(f"\n✅ Không có regression so với baseline ({baseline['timestamp']}, ngưỡng {args.threshold:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# tests/crawl_stub_server.py
+
+import argparse
+import hashlib
+import sys
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+# --- THIẾT LẬP ĐƯỜNG DẪN ĐỂ IMPORT TỪ THƯ MỤC `scripts` ---
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from scripts.crawl_lecture import crawl, reparse
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures" / "crawl"
+EXPECTED_ROWS = 5  # 2 chuyên ngành KTPM + ATTT + TTNT (không có chuyên ngành) + Dược; trang id=999 trả 404
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Máy chủ giả lập trang tuyển sinh: /tuyen-sinh -> index.html,
+    /tuyen-sinh/Page/Education.aspx?id=N -> education_N.html. Hỗ trợ ETag,
+    Last-Modified và trả 304 cho request có điều kiện; `latency` giả lập trang chậm.
+    """
+    latency = 0.0
+    counts = {"200": 0, "304": 0, "404": 0}
+    lock = threading.Lock()
+
+    def _fixture_path(self):
+        parsed = urlparse(self.path)
+        if parsed.path == "/tuyen-sinh":
+            return FIXTURES_DIR / "index.html"
+        if parsed.path == "/tuyen-sinh/Page/Education.aspx":
+            page_id = parse_qs(parsed.query).get("id", [""])[0]
+            return FIXTURES_DIR / f"education_{page_id}.html"
+        return None
+
+    def _count(self, status: int):
+        with self.lock:
+            self.counts[str(status)] += 1
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        path = self._fixture_path()
+        if path is None or not path.exists():
+            self._count(404)
+            self.send_error(404)
+            return
+
+        body = path.read_bytes()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        last_modified = formatdate(path.stat().st_mtime, usegmt=True)
+        if self.headers.get("If-None-Match") == etag:
+            self._count(304)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self._count(200)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Không in log của từng request
+
+
+def start_stub_server(latency: float = 0.0):
+    """Chạy máy chủ giả lập trên một cổng ngẫu nhiên ở thread nền, trả về (server, base_url)."""
+    StubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy crawler ở chế độ async với máy chủ giả lập và các trang mẫu.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Độ trễ giả lập mỗi request (giây).")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=50.0)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.latency)
+    print(f"--- Máy chủ giả lập tại {base_url} (độ trễ {args.latency}s/request) ---")
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        cache_dir, snapshot_dir = tmp_dir / "cache", tmp_dir / "snapshots"
+        output_path = tmp_dir / "majors.csv"
+        runs = [("lần 1 (cache trống)", False), ("lần 2 (request có điều kiện)", False), ("chạy tiếp từ checkpoint", True)]
+        for run, resume in runs:
+            print(f"\n>>> Crawl {run}")
+            StubHandler.counts.update({"200": 0, "304": 0, "404": 0})
+            n_rows = crawl("async", "http", base_url, str(output_path), args.concurrency, args.rate,
+                           cache_dir, snapshot_dir, resume)
+            print(f"   Máy chủ: {StubHandler.counts}")
+            if n_rows != EXPECTED_ROWS:
+                print(f"[LỖI] Mong đợi {EXPECTED_ROWS} dòng, nhận được {n_rows}.")
+                ok = False
+            if not resume and run.startswith("lần 2") and StubHandler.counts["304"] == 0:
+                print("[LỖI] Lần crawl thứ hai không dùng request có điều kiện.")
+                ok = False
+            if resume and StubHandler.counts["200"] + StubHandler.counts["304"] > 0:
+                print("[LỖI] Chạy tiếp vẫn tải lại các trang đã có checkpoint.")
+                ok = False
+
+        print("\n>>> Parse lại từ snapshot")
+        reparse_path = tmp_dir / "majors_reparse.csv"
+        reparse(snapshot_dir, str(reparse_path), workers=2)
+        if reparse_path.read_bytes() != output_path.read_bytes():
+            print("[LỖI] Kết quả parse lại khác kết quả crawl.")
+            ok = False
+    server.shutdown()
+    print("\n✅ Crawler hoạt động đúng với máy chủ giả lập." if ok else "\n❌ Có lỗi.")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
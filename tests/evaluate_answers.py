@@ -0,0 +1,323 @@
+# tests/evaluate_answers.py
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import torch
+from tqdm import tqdm
+
+# --- THIẾT LẬP ĐƯỜNG DẪN ĐỂ IMPORT TỪ THƯ MỤC `src` ---
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.chatbot.config import (
+    PROCESSED_DATA_DIR, EVAL_RESULTS_DIR, LLM_MAX_NEW_TOKENS,
+    LORA_SERVING_MODE, LORA_ADAPTERS, LORA_ADAPTER_PATH
+)
+from src.chatbot.adapters import BASE_ADAPTER
+from src.chatbot.backends import generator_model_id
+from src.chatbot.pipeline import RAGPipeline
+from scripts.create_qa_data import NEGATIVE_ANSWER, parse_message_format
+
+EVAL_DATA_PATH = PROCESSED_DATA_DIR / "eval.jsonl"
+ANSWER_CACHE_PATH = EVAL_RESULTS_DIR / "answer_cache.jsonl"
+BATCH_SIZE = 8
+PROMPT_FORMATS = ("serving", "dataset")
+REFUSAL_MARKERS = ("không tìm thấy thông tin", "không tìm thấy bất kỳ thông tin")
+
+# Các trường thông tin cần có trong câu trả lời (theo các template của create_qa_data.py)
+KEY_FIELD_PATTERNS = [
+    re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"),  # email
+    re.compile(r"\b\d{4,}\b"),                    # mã ngành, năm
+    re.compile(r"\b[A-Z]\d{2}\b"),                # tổ hợp môn (A00, D01, ...)
+    re.compile(r"[Kk]hoa ([^.,;]+)"),             # khoa công tác
+]
+
+
+# --- CHẤM ĐIỂM ---
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFC", text).lower()
+    return " ".join(re.sub(r"[^\w@]+", " ", text).split())
+
+
+def is_refusal(text: str) -> bool:
+    text = unicodedata.normalize("NFC", text).lower()
+    return any(marker in text for marker in REFUSAL_MARKERS)
+
+
+def key_fields(reference: str, question: str) -> List[str]:
+    """Các trường thông tin của đáp án mà câu hỏi chưa nêu (email, mã, năm, tổ hợp môn, khoa)."""
+    question = normalize(question)
+    fields = []
+    for pattern in KEY_FIELD_PATTERNS:
+        for match in pattern.findall(reference):
+            field = normalize(match)
+            if field and field not in question and field not in fields:
+                fields.append(field)
+    return fields
+
+
+def token_f1(prediction: str, reference: str) -> float:
+    pred_tokens, ref_tokens = normalize(prediction).split(), normalize(reference).split()
+    common = sum((Counter(pred_tokens) & Counter(ref_tokens)).values())
+    if not common:
+        return 0.0
+    precision, recall = common / len(pred_tokens), common / len(ref_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def score_answer(prediction: str, reference: str, question: str) -> dict:
+    """
+    Mẫu tiêu cực: chỉ xét mô hình có từ chối hay không. Mẫu tích cực: exact match (sau chuẩn hoá),
+    token F1, và key-field match = mọi trường thông tin của đáp án đều xuất hiện trong câu trả lời
+    (None nếu đáp án không có trường nào ngoài những gì câu hỏi đã nêu).
+    """
+    negative = reference == NEGATIVE_ANSWER
+    refused = is_refusal(prediction)
+    row = {"negative": negative, "refused": refused, "refusal_correct": refused == negative}
+    if not negative:
+        fields = key_fields(reference, question)
+        answer = normalize(prediction)
+        row.update({
+            "exact_match": float(answer == normalize(reference)),
+            "token_f1": token_f1(prediction, reference),
+            "n_key_fields": len(fields),
+            "key_field_match": float(all(f" {field} " in f" {answer} " for field in fields)) if fields else None,
+        })
+    return row
+
+
+# --- CACHE CÂU TRẢ LỜI ---
+def adapter_fingerprint(adapter: str) -> str:
+    """
+    Định danh adapter trong khoá cache. Với thư mục cục bộ, kích thước và thời điểm sửa của
+    các file được đưa vào, nên adapter vừa train lại sẽ không dùng nhầm câu trả lời cũ.
+    Adapter trên Hugging Face Hub chỉ được định danh bằng id repo (dùng --refresh khi repo đổi).
+    """
+    if adapter == BASE_ADAPTER:
+        return BASE_ADAPTER
+    source = str(LORA_ADAPTERS.get(adapter, LORA_ADAPTER_PATH) if LORA_SERVING_MODE == "multi" else LORA_ADAPTER_PATH)
+    path = Path(source)
+    if not path.is_dir():
+        return source
+    stats = sorted((f.name, f.stat().st_size, f.stat().st_mtime_ns) for f in path.iterdir() if f.is_file())
+    return f"{source}@{hashlib.sha1(json.dumps(stats).encode('utf-8')).hexdigest()[:12]}"
+
+
+class AnswerCache:
+    """
+    Cache câu trả lời dạng JSONL chỉ ghi thêm, khoá theo (model, adapter, hash prompt). Mỗi câu
+    trả lời được ghi ngay khi sinh xong, nên lần chạy bị ngắt vẫn giữ được phần đã sinh.
+    """
+    def __init__(self, path: Path = ANSWER_CACHE_PATH):
+        self.path = Path(path)
+        self._answers = {}
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Dòng cuối bị cắt dở khi lần chạy trước bị ngắt
+                    self._answers[record["key"]] = record["answer"]
+
+    @staticmethod
+    def key(model_id: str, prompt: str) -> str:
+        return f"{model_id}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str) -> Optional[str]:
+        return self._answers.get(key)
+
+    def put(self, items: Dict[str, str]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for key, answer in items.items():
+                f.write(json.dumps({"key": key, "answer": answer}, ensure_ascii=False) + "\n")
+        self._answers.update(items)
+
+
+# --- ĐÁNH GIÁ ---
+def load_examples(path: Path = EVAL_DATA_PATH) -> List[dict]:
+    examples = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            context, question, answer = parse_message_format(record)
+            examples.append({"context": context, "question": question, "reference": answer, "messages": record["messages"]})
+    return examples
+
+
+class AnswerEvaluator:
+    """
+    Sinh câu trả lời cho mọi mẫu của eval.jsonl trên chính context của mẫu (không qua truy xuất),
+    theo lô với padding bên trái và giải mã greedy để kết quả lặp lại được, rồi chấm điểm.
+    """
+    def __init__(self, adapter: Optional[str] = None, max_new_tokens: int = LLM_MAX_NEW_TOKENS,
+                 use_cache: bool = True, refresh: bool = False):
+        print("--- Khởi tạo Answer Evaluator ---")
+        self.pipeline = RAGPipeline(load_retrieval=False)
+        self.adapter = self.pipeline.llm.resolve(adapter)
+        self.max_new_tokens = max_new_tokens
+        self.cache = AnswerCache() if use_cache else None
+        self.refresh = refresh
+        identity = {
+            "model": generator_model_id(),
+            "adapter": adapter_fingerprint(self.adapter),
+            "max_new_tokens": max_new_tokens,
+            "do_sample": False,
+        }
+        self.model_id = hashlib.sha1(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        os.makedirs(EVAL_RESULTS_DIR, exist_ok=True)
+
+    def build_prompt(self, example: dict, prompt_format: str) -> str:
+        """"serving": prompt của RAGPipeline (giống khi phục vụ); "dataset": system prompt và định dạng lúc fine-tune."""
+        if prompt_format == "serving":
+            return self.pipeline._build_prompt(example["question"], [example["context"]])
+        return self.pipeline.llm_pipe.tokenizer.apply_chat_template(
+            example["messages"][:-1], tokenize=False, add_generation_prompt=True
+        )
+
+    def generate_batch(self, prompts: List[str]) -> List[str]:
+        llm_pipe = self.pipeline.llm_pipe
+        if not hasattr(llm_pipe.model, "generate"):
+            # Backend không dùng mô hình transformers (vd "extractive"): sinh lần lượt qua pipeline
+            return [llm_pipe(prompt, max_new_tokens=self.max_new_tokens, return_full_text=False)[0]['generated_text'].strip()
+                    for prompt in prompts]
+        tokenizer = llm_pipe.tokenizer
+        # Mô hình decoder-only: pad bên trái để token mới của mọi prompt bắt đầu ở cùng vị trí.
+        # Tokenizer dùng chung với pipeline phục vụ nên phải trả lại giá trị cũ sau khi tokenize
+        previous_padding_side = tokenizer.padding_side
+        tokenizer.padding_side = "left"
+        try:
+            # Chat template có thể đã chứa BOS; tránh thêm BOS lần thứ hai
+            add_special_tokens = not (tokenizer.bos_token and prompts[0].startswith(tokenizer.bos_token))
+            inputs = tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=add_special_tokens)
+        finally:
+            tokenizer.padding_side = previous_padding_side
+
+        with self.pipeline.llm.use(self.adapter) as model, torch.inference_mode():
+            inputs = inputs.to(model.device)
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        return [text.strip() for text in tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
+    def generate(self, prompts: List[str], batch_size: int) -> Tuple[List[str], int]:
+        """
+        Sinh câu trả lời cho các prompt chưa có trong cache; prompt được xếp theo độ dài để giảm
+        padding. Trả về (câu trả lời theo thứ tự `prompts`, số câu trả lời vừa sinh).
+        """
+        keys = [AnswerCache.key(self.model_id, prompt) for prompt in prompts]
+        answers = {} if self.cache is None or self.refresh else {k: self.cache.get(k) for k in keys if self.cache.get(k) is not None}
+        pending = sorted({k: p for k, p in zip(keys, prompts) if k not in answers}.items(), key=lambda item: len(item[1]))
+        print(f"   -> {len(prompts) - len(pending)} câu trả lời lấy từ cache, cần sinh {len(pending)}.")
+
+        for start in tqdm(range(0, len(pending), batch_size), desc="Đang sinh câu trả lời"):
+            batch = dict(pending[start:start + batch_size])
+            generated = dict(zip(batch, self.generate_batch(list(batch.values()))))
+            answers.update(generated)
+            if self.cache is not None:
+                self.cache.put(generated)
+        return [answers[k] for k in keys], len(pending)
+
+    def _summarize(self, df: pd.DataFrame, prompt_format: str, elapsed: float, n_generated: int) -> dict:
+        positives, negatives = df[~df["negative"]], df[df["negative"]]
+        with_fields = positives.dropna(subset=["key_field_match"]) if len(positives) else positives
+        mean = lambda series: round(float(series.mean()), 4) if len(series) else None
+        return {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "model": generator_model_id(),
+            "adapter": self.adapter,
+            "model_id": self.model_id,
+            "prompt_format": prompt_format,
+            "n_examples": len(df),
+            "n_positive": len(positives),
+            "n_negative": len(negatives),
+            "n_generated": n_generated,
+            "elapsed_seconds": round(elapsed, 2),
+            "metrics": {
+                "exact_match": mean(positives["exact_match"]) if len(positives) else None,
+                "token_f1": mean(positives["token_f1"]) if len(positives) else None,
+                "key_field_match": mean(with_fields["key_field_match"]) if len(with_fields) else None,
+                "refusal_accuracy": mean(df["refusal_correct"]),
+                "refusal_recall": mean(negatives["refused"]),        # mẫu tiêu cực được từ chối đúng
+                "false_refusal_rate": mean(positives["refused"]),    # mẫu có đáp án nhưng bị từ chối
+            },
+            "n_key_field_examples": len(with_fields),
+        }
+
+    def run(self, prompt_format: str = "serving", batch_size: int = BATCH_SIZE, limit: Optional[int] = None,
+            eval_path: Path = EVAL_DATA_PATH) -> dict:
+        try:
+            examples = load_examples(eval_path)
+        except FileNotFoundError:
+            print(f"[LỖI] Không tìm thấy file đánh giá tại: {eval_path}")
+            return {}
+        examples = examples[:limit] if limit else examples
+
+        start = time.perf_counter()
+        print(f"\n1. Sinh câu trả lời cho {len(examples)} mẫu (adapter '{self.adapter}', prompt '{prompt_format}', lô {batch_size})...")
+        predictions, n_generated = self.generate([self.build_prompt(ex, prompt_format) for ex in examples], batch_size)
+
+        rows = [
+            {"question": ex["question"], "reference": ex["reference"], "prediction": prediction,
+             **score_answer(prediction, ex["reference"], ex["question"])}
+            for ex, prediction in zip(examples, predictions)
+        ]
+        df = pd.DataFrame(rows)
+        summary = self._summarize(df, prompt_format, time.perf_counter() - start, n_generated)
+        self._generate_report(df, summary)
+        return summary
+
+    def _generate_report(self, df: pd.DataFrame, summary: dict):
+        print("\n" + "="*70)
+        print(f"--- KẾT QUẢ ĐÁNH GIÁ CÂU TRẢ LỜI ({summary['n_positive']} tích cực, {summary['n_negative']} tiêu cực) ---")
+        for metric, value in summary["metrics"].items():
+            print(f"{metric:<20}{value if value is not None else '-':>10}")
+        print("="*70)
+
+        suffix = f"{self.adapter}_{summary['prompt_format']}"
+        csv_path = EVAL_RESULTS_DIR / f"answer_evaluation_details_{suffix}.csv"
+        df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+        print(f"\nĐã lưu kết quả chi tiết vào file: {csv_path}")
+
+        json_path = EVAL_RESULTS_DIR / f"answer_evaluation_{suffix}.json"
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"Đã lưu kết quả tổng hợp vào file: {json_path}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Đánh giá câu trả lời của LLM trên eval.jsonl (context cho sẵn).")
+    parser.add_argument("--adapter", default=None, help="Adapter cần đánh giá (mặc định: DEFAULT_ADAPTER; 'base' = model gốc).")
+    parser.add_argument("--prompt-format", choices=PROMPT_FORMATS, default="serving")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-new-tokens", type=int, default=LLM_MAX_NEW_TOKENS)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--eval-path", type=Path, default=EVAL_DATA_PATH)
+    parser.add_argument("--refresh", action="store_true", help="Sinh lại mọi câu trả lời (vd: sau khi đổi code sinh) và ghi đè cache.")
+    parser.add_argument("--no-cache", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    evaluator = AnswerEvaluator(args.adapter, args.max_new_tokens, use_cache=not args.no_cache, refresh=args.refresh)
+    evaluator.run(args.prompt_format, args.batch_size, args.limit, args.eval_path)
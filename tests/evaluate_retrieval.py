@@ -1,16 +1,18 @@
 # tests/evaluate_retrieval.py
 
+import argparse
 import json
 import os
 import sys
+import time
+from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Callable, Dict, List, Any
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import chromadb
-from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 
 # --- THIẾT LẬP ĐƯỜNG DẪN ĐỂ IMPORT TỪ THƯ MỤC `src` ---
@@ -20,106 +22,252 @@ sys.path.append(str(project_root))
 # --- IMPORT CÁC CẤU HÌNH TỪ FILE CONFIG TRUNG TÂM ---
 from src.chatbot.config import (
     EVAL_SET_PATH,
-    CHROMA_PATH,
-    COLLECTION_NAME,
-    EMBEDDING_MODEL_NAME,
     EVAL_TOP_K,
     EVAL_RESULTS_DIR,
-    DEVICE
+    N_RETRIEVE_RESULTS
 )
+from src.chatbot.embedding_cache import get_embedding_cache
+from src.chatbot.backends import embedding_model_id
+from src.chatbot.retrieval_system import RetrievalSystem
+
+EVAL_K_VALUES = sorted({1, 3, EVAL_TOP_K})
+BATCH_SIZE = 32  # Số câu hỏi mỗi lượt embedding / truy vấn ChromaDB / rerank
+ENCODE_BATCH_SIZE = 64
+RERANK_BATCH_SIZE = 64
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+# --- CHỈ SỐ XẾP HẠNG ---
+def relevant_ids(item: Dict[str, Any]) -> set:
+    """Tài liệu đúng của một câu hỏi: `expected_doc_ids` (nhiều tài liệu) hoặc `expected_doc_id`."""
+    return set(item.get('expected_doc_ids') or [item['expected_doc_id']])
+
+
+def ranking_metrics(ranked_ids: List[str], relevant: set, k_values: List[int] = EVAL_K_VALUES) -> dict:
+    """Hit@k, Recall@k, nDCG@k (độ liên quan nhị phân) và Reciprocal Rank của một danh sách đã xếp hạng."""
+    rank = next((i + 1 for i, doc_id in enumerate(ranked_ids) if doc_id in relevant), 0)
+    metrics = {"rank": rank, "mrr": 1 / rank if rank else 0.0}
+    for k in k_values:
+        found = [i for i, doc_id in enumerate(ranked_ids[:k]) if doc_id in relevant]
+        ideal = sum(1 / np.log2(i + 2) for i in range(min(len(relevant), k)))
+        metrics[f"hit@{k}"] = 1.0 if found else 0.0
+        metrics[f"recall@{k}"] = len(found) / len(relevant)
+        metrics[f"ndcg@{k}"] = sum(1 / np.log2(i + 2) for i in found) / ideal
+    return metrics
+
+
+def latency_summary(samples: List[float]) -> dict:
+    """Phân vị độ trễ (ms) của một stage."""
+    values = np.asarray(samples) * 1000
+    summary = {f"p{p}_ms": round(float(np.percentile(values, p)), 2) for p in LATENCY_PERCENTILES}
+    summary["mean_ms"] = round(float(values.mean()), 2)
+    return summary
+
+
+def unique_parents(candidates: List[dict], order) -> List[str]:
+    """Id tài liệu gốc theo thứ tự `order` của các chunk, mỗi tài liệu một lần."""
+    return list(dict.fromkeys(candidates[i]['parent_id'] for i in order))
+
+
+# --- CÁC CHẾ ĐỘ TRUY XUẤT ---
+# Mỗi chế độ nhận một BatchContext và trả về danh sách id tài liệu gốc đã xếp hạng cho từng câu hỏi.
+# Mọi chế độ dùng chung embedding câu hỏi và cùng tập ứng viên từ ChromaDB (so sánh cùng điều kiện).
+def rank_dense(batch: "BatchContext") -> List[List[str]]:
+    return [unique_parents(candidates, range(len(candidates))) for candidates in batch.candidates]
+
+
+def rank_dense_rerank(batch: "BatchContext") -> List[List[str]]:
+    return [
+        unique_parents(candidates, np.argsort(-np.asarray(scores), kind="stable"))
+        for candidates, scores in zip(batch.candidates, batch.rerank_scores())
+    ]
+
+
+MODES: Dict[str, Callable[["BatchContext"], List[List[str]]]] = {
+    "dense": rank_dense,
+    "dense+rerank": rank_dense_rerank,
+}
+
+
+class BatchContext:
+    """
+    Dữ liệu của một lô câu hỏi dùng chung cho mọi chế độ. Các stage đắt (vd: rerank) chỉ
+    được tính khi có chế độ cần đến và chỉ tính một lần; thời gian được ghi vào `timings`,
+    các stage mà chế độ đang chạy đã dùng được ghi vào `used`.
+    """
+    SHARED_STAGES = ("embed", "retrieve")
+
+    def __init__(self, evaluator: "RetrievalEvaluator", queries: List[str], candidates: List[List[dict]]):
+        self.evaluator = evaluator
+        self.queries = queries
+        self.candidates = candidates
+        self.timings = {}
+        self.used = list(self.SHARED_STAGES)
+        self._rerank_scores = None
+
+    def rerank_scores(self) -> List[List[float]]:
+        self.used.append("rerank")
+        if self._rerank_scores is None:
+            start = time.perf_counter()
+            self._rerank_scores = self.evaluator.rerank(self.queries, self.candidates)
+            self.timings["rerank"] = time.perf_counter() - start
+        return self._rerank_scores
 
 
 class RetrievalEvaluator:
     """
-    Một lớp để đóng gói toàn bộ logic đánh giá hệ thống truy xuất (retrieval).
+    Đánh giá nhiều chế độ truy xuất trong một lượt chạy theo lô trên evaluation_set.json:
+    câu hỏi được embedding theo lô, ChromaDB được truy vấn một lần cho cả lô, và reranker
+    chấm điểm mọi cặp (câu hỏi, chunk) của lô trong một lần gọi.
     """
 
-    def __init__(self):
-        """Khởi tạo Evaluator và tải các tài nguyên cần thiết."""
+    def __init__(self, use_embedding_cache: bool = True):
+        """Khởi tạo Evaluator và tải RetrievalSystem (index đang hoạt động)."""
         print("--- Khởi tạo Retrieval Evaluator ---")
-        self.embedder = self._load_embedding_model()
-        self.collection = self._connect_to_chromadb()
+        self.retrieval_system = RetrievalSystem()
+        self.embedding_cache = get_embedding_cache(embedding_model_id()) if use_embedding_cache else None
         # Đảm bảo thư mục lưu kết quả tồn tại
         os.makedirs(EVAL_RESULTS_DIR, exist_ok=True)
 
-    def _load_embedding_model(self) -> SentenceTransformer:
-        """Tải mô hình embedding."""
-        print(f"1. Đang tải Embedding Model: {EMBEDDING_MODEL_NAME} trên {DEVICE}...")
-        return SentenceTransformer(EMBEDDING_MODEL_NAME, device=DEVICE)
+    # --- CÁC STAGE ---
+    def embed(self, queries: List[str]) -> np.ndarray:
+        encode = lambda texts: self.retrieval_system.embedder.encode(texts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True)
+        if self.embedding_cache is None:
+            return np.asarray(encode(queries))
+        return self.embedding_cache.get_or_compute(queries, encode)
 
-    def _connect_to_chromadb(self) -> chromadb.Collection:
-        """Kết nối tới cơ sở dữ liệu ChromaDB."""
-        print(f"2. Đang kết nối tới ChromaDB tại: {CHROMA_PATH}...")
-        client = chromadb.PersistentClient(path=str(CHROMA_PATH))
-        return client.get_collection(name=COLLECTION_NAME)
+    def retrieve(self, query_embeddings: np.ndarray, depth: int) -> List[List[dict]]:
+        """Truy vấn ChromaDB cho cả lô, trả về các chunk ứng viên (kèm nội dung) theo thứ tự dense."""
+        rs = self.retrieval_system
+        collection, store = rs.collection, rs.document_store
+        include = ["metadatas"] + (["documents"] if store is None else [])
+        results = collection.query(query_embeddings=query_embeddings.tolist(), n_results=depth, include=include)
 
-    def _perform_queries(self, eval_data: List[Dict[str, Any]]) -> pd.DataFrame:
-        """
-        Thực hiện truy vấn cho từng câu hỏi trong bộ đánh giá và thu thập kết quả.
-        """
-        results_data = []
-        print(f"\n3. Thực hiện truy vấn cho {len(eval_data)} câu hỏi (Top K = {EVAL_TOP_K})...")
-
-        for item in tqdm(eval_data, desc="Đang đánh giá"):
-            query = item['query']
-            expected_doc_id = item['expected_doc_id']
-
-            query_embedding = self.embedder.encode(query).tolist()
-            retrieved_results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=EVAL_TOP_K
-            )
-            actual_ids = retrieved_results['ids'][0]
-
-            rank = 0
-            if expected_doc_id in actual_ids:
-                rank = actual_ids.index(expected_doc_id) + 1  # Thứ hạng bắt đầu từ 1
-
-            results_data.append({
-                "query": query,
-                "expected_doc_id": expected_doc_id,
-                "actual_top_k_ids": actual_ids,
-                "rank": "Not Found" if rank == 0 else rank,
-                "hit": 1 if rank > 0 else 0,
-                "reciprocal_rank": 1 / rank if rank > 0 else 0
-            })
-        return pd.DataFrame(results_data)
-
-    def _generate_report(self, df_results: pd.DataFrame):
+        batch_candidates = []
+        for q in range(len(results['ids'])):
+            candidates = [
+                {
+                    "id": doc_id,
+                    "content": results['documents'][q][i] if store is None else None,
+                    "metadata": metadata,
+                    "parent_id": rs._parent_id({"id": doc_id, "metadata": metadata}),
+                }
+                for i, (doc_id, metadata) in enumerate(zip(results['ids'][q], results['metadatas'][q]))
+            ]
+            if store is not None:
+                rs._fill_chunk_contents(collection, store, candidates)
+            batch_candidates.append(candidates)
+        return batch_candidates
+
+    def rerank(self, queries: List[str], batch_candidates: List[List[dict]]) -> List[List[float]]:
+        """Chấm điểm mọi cặp (câu hỏi, chunk) của lô trong một lần gọi reranker."""
+        pairs = [[query, c['content']] for query, candidates in zip(queries, batch_candidates) for c in candidates]
+        if not pairs:
+            return [[] for _ in queries]
+        flat_scores = self.retrieval_system.reranker.predict(pairs, batch_size=RERANK_BATCH_SIZE)
+        scores, offset = [], 0
+        for candidates in batch_candidates:
+            scores.append([float(s) for s in flat_scores[offset:offset + len(candidates)]])
+            offset += len(candidates)
+        return scores
+
+    # --- CHẠY ĐÁNH GIÁ ---
+    def _evaluate(self, eval_data: List[Dict[str, Any]], modes: List[str], batch_size: int, depth: int):
         """
-        Tính toán các chỉ số và in báo cáo ra màn hình.
+        Chạy mọi chế độ trên từng lô. Độ trễ mỗi stage được quy về từng câu hỏi
+        (thời gian của lô / số câu hỏi trong lô); phân vị được tính trên các lô.
         """
-        hit_rate_at_k = df_results['hit'].mean()
-        mrr = df_results['reciprocal_rank'].mean()
+        rows = []
+        latencies = {mode: {} for mode in modes}
+        print(f"\n3. Đánh giá {len(eval_data)} câu hỏi, các chế độ: {', '.join(modes)} (lô {batch_size}, độ sâu {depth})...")
+        for start in tqdm(range(0, len(eval_data), batch_size), desc="Đang đánh giá"):
+            items = eval_data[start:start + batch_size]
+            queries = [item['query'] for item in items]
+
+            t0 = time.perf_counter()
+            query_embeddings = self.embed(queries)
+            t1 = time.perf_counter()
+            candidates = self.retrieve(query_embeddings, depth)
+            t2 = time.perf_counter()
+            batch = BatchContext(self, queries, candidates)
+            batch.timings.update({"embed": t1 - t0, "retrieve": t2 - t1})
+
+            for mode in modes:
+                batch.used = list(BatchContext.SHARED_STAGES)
+                rankings = MODES[mode](batch)
+                # Stage dùng chung giữa các chế độ (vd rerank) được tính vào độ trễ của mọi chế độ dùng nó
+                per_query = {stage: batch.timings[stage] / len(items) for stage in dict.fromkeys(batch.used)}
+                per_query["total"] = sum(per_query.values())
+                for stage, value in per_query.items():
+                    latencies[mode].setdefault(stage, []).append(value)
 
-        print("\n" + "="*50)
-        print("--- KẾT QUẢ ĐÁNH GIÁ TỔNG QUAN ---")
-        print(f"-> Tỷ lệ tìm thấy trong Top-{EVAL_TOP_K} (Hit Rate@{EVAL_TOP_K}): {hit_rate_at_k:.2%}")
-        print(f"-> Thứ hạng Tương hỗ Trung bình (MRR): {mrr:.4f}")
-        print("="*50)
+                for item, ranked_ids in zip(items, rankings):
+                    metrics = ranking_metrics(ranked_ids, relevant_ids(item))
+                    rows.append({
+                        "mode": mode,
+                        "query": item['query'],
+                        "expected_doc_id": item['expected_doc_id'],
+                        "actual_top_k_ids": ranked_ids[:EVAL_TOP_K],
+                        **metrics
+                    })
+        return pd.DataFrame(rows), latencies
 
-        print("\nBảng kết quả chi tiết:")
-        print(df_results[['query', 'expected_doc_id', 'rank']].to_string())
+    def _summarize(self, df_results: pd.DataFrame, latencies: dict, n_queries: int, depth: int, elapsed: float) -> dict:
+        metric_columns = ["mrr"] + [f"{m}@{k}" for m in ("hit", "recall", "ndcg") for k in EVAL_K_VALUES]
+        summary = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "collection": self.retrieval_system.collection_name,
+            "n_queries": n_queries,
+            "k_values": EVAL_K_VALUES,
+            "retrieve_depth": depth,
+            "elapsed_seconds": round(elapsed, 2),
+            "modes": {}
+        }
+        for mode, group in df_results.groupby("mode", sort=False):
+            summary["modes"][mode] = {
+                "metrics": {column: round(float(group[column].mean()), 4) for column in metric_columns},
+                "latency": {stage: latency_summary(samples) for stage, samples in latencies[mode].items()}
+            }
+        return summary
+
+    def _generate_report(self, df_results: pd.DataFrame, summary: dict):
+        """In bảng so sánh các chế độ và lưu CSV chi tiết + JSON tổng hợp."""
+        print("\n" + "="*70)
+        print(f"--- KẾT QUẢ ĐÁNH GIÁ ({summary['n_queries']} câu hỏi, collection '{summary['collection']}') ---")
+        table = pd.DataFrame({
+            mode: {**result["metrics"], "p95_ms": result["latency"]["total"]["p95_ms"]}
+            for mode, result in summary["modes"].items()
+        })
+        print(table.to_string(float_format=lambda v: f"{v:.4f}"))
+        print("="*70)
 
         csv_path = EVAL_RESULTS_DIR / "retrieval_evaluation_details.csv"
         df_results.to_csv(csv_path, index=False, encoding='utf-8-sig')
         print(f"\nĐã lưu kết quả chi tiết vào file: {csv_path}")
 
-    def _create_visualizations(self, df_results: pd.DataFrame):
+        json_path = EVAL_RESULTS_DIR / "retrieval_evaluation.json"
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"Đã lưu kết quả tổng hợp vào file: {json_path}")
+
+    def _create_visualizations(self, df_results: pd.DataFrame, summary: dict):
         """
-        Tạo và lưu các biểu đồ trực quan hóa kết quả.
+        Tạo và lưu các biểu đồ so sánh các chế độ.
         """
         print("\n4. Đang tạo các biểu đồ trực quan...")
-        
-        hit_rate_at_k = df_results['hit'].mean()
-        mrr = df_results['reciprocal_rank'].mean()
-
-        # Biểu đồ 1: Các chỉ số tổng quan
         plt.style.use('seaborn-v0_8-whitegrid')
-        plt.figure(figsize=(8, 5))
-        metrics = {'Hit Rate': hit_rate_at_k, 'MRR': mrr}
-        ax = sns.barplot(x=list(metrics.keys()), y=list(metrics.values()), palette="viridis")
-        ax.bar_label(ax.containers[0], fmt='%.4f') # Thêm nhãn giá trị trên cột
+
+        # Biểu đồ 1: Các chỉ số tổng quan theo chế độ
+        metrics = pd.DataFrame([
+            {"mode": mode, "metric": metric, "value": value}
+            for mode, result in summary["modes"].items()
+            for metric, value in result["metrics"].items()
+            if metric == "mrr" or metric.endswith(f"@{EVAL_TOP_K}")
+        ])
+        plt.figure(figsize=(10, 5))
+        ax = sns.barplot(data=metrics, x="metric", y="value", hue="mode", palette="viridis")
+        for container in ax.containers:
+            ax.bar_label(container, fmt='%.3f', fontsize=8)
         plt.title(f'Tổng quan Chất lượng Truy xuất (Top K = {EVAL_TOP_K})', fontsize=16, pad=20)
         plt.ylabel('Giá trị', fontsize=12)
         plt.ylim(0, 1.1)
@@ -130,9 +278,10 @@ class RetrievalEvaluator:
 
         # Biểu đồ 2: Phân phối thứ hạng của các kết quả đúng
         plt.figure(figsize=(10, 6))
-        found_ranks = df_results[df_results['hit'] == 1]['rank'].astype(int)
-        ax = sns.countplot(x=found_ranks, palette='plasma', order=range(1, EVAL_TOP_K + 1))
-        ax.bar_label(ax.containers[0]) # Thêm nhãn số lượng trên cột
+        found = df_results[(df_results['rank'] > 0) & (df_results['rank'] <= EVAL_TOP_K)]
+        ax = sns.countplot(data=found, x="rank", hue="mode", palette='plasma', order=range(1, EVAL_TOP_K + 1))
+        for container in ax.containers:
+            ax.bar_label(container)
         plt.title('Phân phối Thứ hạng của các Kết quả Đúng', fontsize=16, pad=20)
         plt.xlabel(f'Thứ hạng trong Top-{EVAL_TOP_K}', fontsize=12)
         plt.ylabel('Số lượng câu hỏi', fontsize=12)
@@ -141,23 +290,58 @@ class RetrievalEvaluator:
         print(f"   - Đã lưu biểu đồ phân phối thứ hạng tại: {rank_dist_path}")
         plt.close()
 
-    def run(self):
+        # Biểu đồ 3: Độ trễ p95 của từng stage theo chế độ
+        latency = pd.DataFrame([
+            {"mode": mode, "stage": stage, "p95_ms": values["p95_ms"]}
+            for mode, result in summary["modes"].items()
+            for stage, values in result["latency"].items()
+        ])
+        plt.figure(figsize=(10, 5))
+        ax = sns.barplot(data=latency, x="stage", y="p95_ms", hue="mode", palette="magma")
+        for container in ax.containers:
+            ax.bar_label(container, fmt='%.1f', fontsize=8)
+        plt.title('Độ trễ p95 mỗi câu hỏi theo stage (ms)', fontsize=16, pad=20)
+        plt.ylabel('ms', fontsize=12)
+        latency_chart_path = EVAL_RESULTS_DIR / "latency_by_stage.png"
+        plt.savefig(latency_chart_path, bbox_inches='tight')
+        print(f"   - Đã lưu biểu đồ độ trễ tại: {latency_chart_path}")
+        plt.close()
+
+    def run(self, modes: List[str] = None, batch_size: int = BATCH_SIZE, depth: int = N_RETRIEVE_RESULTS,
+            eval_set_path: Path = EVAL_SET_PATH) -> dict:
         """
         Hàm chính để chạy toàn bộ pipeline đánh giá.
         """
+        modes = modes or list(MODES)
         try:
-            with open(EVAL_SET_PATH, 'r', encoding='utf-8') as f:
+            with open(eval_set_path, 'r', encoding='utf-8') as f:
                 eval_data = json.load(f)
         except FileNotFoundError:
-            print(f"[LỖI] Không tìm thấy file bộ câu hỏi đánh giá tại: {EVAL_SET_PATH}")
-            return
+            print(f"[LỖI] Không tìm thấy file bộ câu hỏi đánh giá tại: {eval_set_path}")
+            return {}
+
+        start = time.perf_counter()
+        depth = max(depth, max(EVAL_K_VALUES))
+        df_results, latencies = self._evaluate(eval_data, modes, batch_size, depth)
+        summary = self._summarize(df_results, latencies, len(eval_data), depth, time.perf_counter() - start)
+        self._generate_report(df_results, summary)
+        self._create_visualizations(df_results, summary)
+        print(f"\n--- QUÁ TRÌNH ĐÁNH GIÁ HOÀN TẤT ({summary['elapsed_seconds']}s) ---")
+        return summary
+
 
-        df_results = self._perform_queries(eval_data)
-        self._generate_report(df_results)
-        self._create_visualizations(df_results)
-        print("\n--- QUÁ TRÌNH ĐÁNH GIÁ HOÀN TẤT ---")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Đánh giá các chế độ truy xuất trên evaluation_set.json.")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--depth", type=int, default=N_RETRIEVE_RESULTS, help="Số chunk ứng viên lấy từ ChromaDB mỗi câu hỏi.")
+    parser.add_argument("--eval-set", type=Path, default=EVAL_SET_PATH)
+    parser.add_argument("--no-embedding-cache", action="store_true",
+                        help="Luôn encode câu hỏi (đo đúng độ trễ embedding thay vì đọc từ cache).")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    evaluator = RetrievalEvaluator()
-    evaluator.run()
\ No newline at end of file
+    args = parse_args()
+    evaluator = RetrievalEvaluator(use_embedding_cache=not args.no_embedding_cache)
+    evaluator.run(args.modes, args.batch_size, args.depth, args.eval_set)
@@ -0,0 +1,224 @@
+# tests/load_test_admission.py
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import List, Tuple
+
+# --- THIẾT LẬP ĐƯỜNG DẪN ĐỂ IMPORT TỪ THƯ MỤC `src` ---
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.chatbot import backends
+from src.chatbot.config import (
+    EVAL_RESULTS_DIR, ADMISSION_SLO_P95_MS, ADMISSION_ADJUST_SECONDS, ADMISSION_GRADIO_CONCURRENCY
+)
+from src.chatbot.admission import AdmissionController, FULL_TIER, SERVICE_TIERS
+from tests.benchmark_pipeline import load_questions
+from tests.evaluate_retrieval import latency_summary
+
+# Mỗi pha là "số request mỗi giây:thời lượng (giây)": bình thường -> cao điểm -> hồi phục
+DEFAULT_PHASES = "0.5:30,4:40,0.5:40"
+RECOVERY_TAIL = 5  # Số request cuối của pha cuối phải được phục vụ lại ở mức "full"
+
+
+# --- ĐỘ TRỄ GIẢ LẬP ---
+class SlowGenerator:
+    """
+    Thêm độ trễ cố định vào mỗi lượt sinh (giả lập LLM trên CPU) khi chạy với backend offline.
+    Như một model thật trên một thiết bị, các lượt sinh chạy lần lượt, không song song.
+    """
+    def __init__(self, llm_pipe, delay_ms: float):
+        self.llm_pipe = llm_pipe
+        self.delay = delay_ms / 1000
+        self._device = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.llm_pipe, name)
+
+    def __call__(self, prompt, **kwargs):
+        with self._device:
+            time.sleep(self.delay)
+            return self.llm_pipe(prompt, **kwargs)
+
+
+class SlowReranker:
+    """Thêm độ trễ theo số cặp (câu hỏi, đoạn văn) vào reranker, để mức "shallow" thực sự rẻ hơn."""
+    def __init__(self, reranker, delay_ms_per_pair: float):
+        self.reranker = reranker
+        self.delay = delay_ms_per_pair / 1000
+
+    def __getattr__(self, name):
+        return getattr(self.reranker, name)
+
+    def predict(self, pairs, **kwargs):
+        time.sleep(self.delay * len(pairs))
+        return self.reranker.predict(pairs, **kwargs)
+
+
+def parse_phases(spec: str) -> List[Tuple[float, float]]:
+    phases = []
+    for part in spec.split(","):
+        rate, duration = part.split(":")
+        phases.append((float(rate), float(duration)))
+    return phases
+
+
+# --- BỘ TẠO TẢI ---
+def run_load(pipeline, questions: List[str], phases: List[Tuple[float, float]], workers: int, seed: int) -> List[dict]:
+    """
+    Gửi request theo quá trình Poisson (tải mở: tốc độ gửi không phụ thuộc tốc độ phục vụ) vào
+    một pool `workers` thread, giống Gradio với ADMISSION_GRADIO_CONCURRENCY. Độ trễ được tính
+    từ lúc request đến, nên gồm cả thời gian chờ trong pool.
+    """
+    rng = random.Random(seed)
+    records, lock = [], threading.Lock()
+
+    def one_request(phase: int, question: str, arrived: float):
+        try:
+            tier = pipeline.get_answer(question).get("tier", FULL_TIER.name)
+        except Exception as e:
+            print(f"[LỖI] Request thất bại: {e}")
+            tier = "error"
+        with lock:
+            records.append({
+                "phase": phase,
+                "tier": tier,
+                "arrived_s": round(arrived - start, 3),
+                "latency_ms": round((time.perf_counter() - arrived) * 1000, 1),
+            })
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = next_arrival = time.perf_counter()
+        for phase, (rate, duration) in enumerate(phases):
+            phase_end = next_arrival + duration
+            print(f"-> Pha {phase}: {rate} request/s trong {duration:.0f}s")
+            while True:
+                next_arrival += rng.expovariate(rate)
+                if next_arrival >= phase_end:
+                    next_arrival = phase_end
+                    break
+                time.sleep(max(next_arrival - time.perf_counter(), 0))
+                executor.submit(one_request, phase, rng.choice(questions), next_arrival)
+    return sorted(records, key=lambda r: r["arrived_s"])
+
+
+def summarize(records: List[dict], phases: List[Tuple[float, float]], slo_ms: float) -> List[dict]:
+    summary = []
+    for phase, (rate, duration) in enumerate(phases):
+        rows = [r for r in records if r["phase"] == phase]
+        if not rows:
+            continue
+        latency = latency_summary([r["latency_ms"] / 1000 for r in rows])
+        summary.append({
+            "phase": phase,
+            "rate_rps": rate,
+            "duration_s": duration,
+            "n_requests": len(rows),
+            "tiers": dict(Counter(r["tier"] for r in rows)),
+            **latency,
+            "slo_met": latency["p95_ms"] <= slo_ms,
+        })
+    return summary
+
+
+def check(records: List[dict], summary: List[dict], admission: bool) -> List[str]:
+    """Các điều kiện admission control phải đạt; trả về danh sách lỗi."""
+    failures = []
+    if any(r["tier"] == "error" for r in records):
+        failures.append("Có request bị lỗi.")
+    if not admission or not summary:
+        return failures
+    peak = max(summary, key=lambda s: s["rate_rps"])
+    if set(peak["tiers"]) <= {FULL_TIER.name}:
+        failures.append(f"Pha cao điểm {peak['phase']} không có request nào được giảm tải.")
+    if not peak["slo_met"]:
+        failures.append(f"Pha cao điểm {peak['phase']} vượt SLO: p95 = {peak['p95_ms']:.0f} ms.")
+    last_phase = summary[-1]["phase"]
+    tail = [r["tier"] for r in records if r["phase"] == last_phase][-RECOVERY_TAIL:]
+    if any(tier != FULL_TIER.name for tier in tail):
+        failures.append(f"Chưa hồi phục về mức '{FULL_TIER.name}' ở cuối pha cuối: {tail}.")
+    return failures
+
+
+def build_pipeline(args):
+    # Import muộn để --help chạy được mà không cần tải mô hình
+    from src.chatbot.pipeline import RAGPipeline
+    if args.offline:
+        backends.EMBEDDING_BACKEND, backends.RERANKER_BACKEND, backends.GENERATOR_BACKEND = "hashing", "lexical", "extractive"
+    pipeline = RAGPipeline()
+    if args.llm_delay_ms:
+        pipeline.llm_pipe = SlowGenerator(pipeline.llm_pipe, args.llm_delay_ms)
+    if args.rerank_delay_ms:
+        rs = pipeline.retrieval_system
+        rs.reranker = SlowReranker(rs.reranker, args.rerank_delay_ms)
+    pipeline.admission = AdmissionController(
+        enabled=not args.no_admission, slo_p95_ms=args.slo_ms, adjust_seconds=args.adjust_seconds
+    )
+    return pipeline
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tạo tải giả lập để kiểm tra admission control của RAGPipeline.")
+    parser.add_argument("--phases", default=DEFAULT_PHASES, help="Các pha 'rps:giây' cách nhau bởi dấu phẩy.")
+    parser.add_argument("--workers", type=int, default=ADMISSION_GRADIO_CONCURRENCY,
+                        help="Số request xử lý đồng thời (như concurrency của Gradio).")
+    parser.add_argument("--slo-ms", type=float, default=ADMISSION_SLO_P95_MS)
+    parser.add_argument("--adjust-seconds", type=float, default=ADMISSION_ADJUST_SECONDS)
+    parser.add_argument("--offline", action="store_true", help="Dùng backend hashing/lexical/extractive thay vì mô hình thật.")
+    parser.add_argument("--llm-delay-ms", type=float, default=0, help="Độ trễ giả lập thêm vào mỗi lượt sinh.")
+    parser.add_argument("--rerank-delay-ms", type=float, default=0, help="Độ trễ giả lập cho mỗi cặp được rerank.")
+    parser.add_argument("--no-admission", action="store_true", help="Tắt admission control (để so sánh).")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    phases = parse_phases(args.phases)
+    questions = load_questions()
+    pipeline = build_pipeline(args)
+    admission = not args.no_admission
+    print(f"--- Load test admission control ({'bật' if admission else 'tắt'}): SLO p95 {args.slo_ms:.0f} ms, "
+          f"{args.workers} worker ---")
+
+    records = run_load(pipeline, questions, phases, args.workers, args.seed)
+    summary = summarize(records, phases, args.slo_ms)
+
+    tier_names = [t.name for t in SERVICE_TIERS]
+    for s in summary:
+        tiers = ", ".join(f"{name}={s['tiers'][name]}" for name in tier_names if name in s["tiers"])
+        print(f"Pha {s['phase']} ({s['rate_rps']} rps, {s['n_requests']} request): p50 {s['p50_ms']:.0f} ms, "
+              f"p95 {s['p95_ms']:.0f} ms {'✅' if s['slo_met'] else '❌'} | {tiers}")
+
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {**{k: v for k, v in vars(args).items() if k != "phases"}, "phases": phases},
+        "phases": summary,
+        "requests": records,
+    }
+    EVAL_RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    result_path = EVAL_RESULTS_DIR / f"admission_load_test{'' if admission else '_baseline'}.json"
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu kết quả vào: {result_path}")
+
+    failures = check(records, summary, admission)
+    if failures:
+        print("\n❌ Admission control chưa đạt yêu cầu:")
+        for line in failures:
+            print(f"   - {line}")
+        sys.exit(1)
+    if admission:
+        print("\n✅ Giảm tải khi cao điểm, giữ được SLO và hồi phục về mức 'full' khi hết tải.")
+
+
+if __name__ == "__main__":
+    main()
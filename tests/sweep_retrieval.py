@@ -0,0 +1,266 @@
+# tests/sweep_retrieval.py
+
+import argparse
+import hashlib
+import itertools
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from tqdm import tqdm
+
+# --- THIẾT LẬP ĐƯỜNG DẪN ĐỂ IMPORT TỪ THƯ MỤC `src` ---
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.chatbot.config import (
+    EVAL_SET_PATH, EVAL_RESULTS_DIR, N_RETRIEVE_RESULTS, N_FINAL_RESULTS
+)
+from src.chatbot.backends import embedding_model_id, reranker_model_id
+from scripts.build_database import manifest_path
+from tests.evaluate_retrieval import BATCH_SIZE, EVAL_K_VALUES, RetrievalEvaluator, ranking_metrics, relevant_ids
+
+RETRIEVE_GRID = sorted({5, 10, 15, 20, 30, 40, 50, N_RETRIEVE_RESULTS})
+FINAL_GRID = sorted({1, 2, 3, 5, N_FINAL_RESULTS})
+SWEEP_CACHE_DIR = EVAL_RESULTS_DIR / "sweep_cache"
+BENCHMARK_RESULT_PATH = EVAL_RESULTS_DIR / "benchmark_full.json"
+METRICS = ("hit", "recall", "ndcg")
+
+
+# --- CHẠY CÁC STAGE ĐẮT MỘT LẦN ---
+def index_fingerprint(retrieval_system) -> list:
+    """
+    Nội dung của index đang phục vụ, không chỉ tên collection: build tăng dần cập nhật collection
+    tại chỗ, nên dùng hash của manifest (đổi khi có tài liệu thay đổi) và số chunk trong collection.
+    """
+    path = manifest_path(retrieval_system.collection_name)
+    manifest_hash = hashlib.sha1(path.read_bytes()).hexdigest() if path.exists() else None
+    return [retrieval_system.collection_name, manifest_hash, retrieval_system.collection.count()]
+
+
+def cache_path(eval_set_path: Path, index_key: list, depth: int) -> Path:
+    """Điểm đã tính phụ thuộc vào bộ câu hỏi, nội dung index, hai mô hình và độ sâu tối đa."""
+    with open(eval_set_path, 'rb') as f:
+        eval_hash = hashlib.sha1(f.read()).hexdigest()
+    key = json.dumps([eval_hash, index_key, embedding_model_id(), reranker_model_id(), depth])
+    return SWEEP_CACHE_DIR / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.json"
+
+
+def score_at_max_depth(evaluator: RetrievalEvaluator, eval_data: List[dict], depth: int, batch_size: int) -> dict:
+    """
+    Embedding, truy vấn ChromaDB ở độ sâu `depth` và rerank toàn bộ ứng viên, một lần cho mọi
+    cấu hình. Trả về (theo từng câu hỏi) id tài liệu gốc của các chunk theo thứ tự dense và điểm
+    rerank của chúng, kèm thời gian đo được của từng stage.
+    """
+    queries, timings = [], {"embed": 0.0, "retrieve": 0.0, "rerank": 0.0}
+    n_pairs = 0
+    for start in tqdm(range(0, len(eval_data), batch_size), desc="Đang truy xuất + rerank"):
+        items = eval_data[start:start + batch_size]
+        texts = [item['query'] for item in items]
+        t0 = time.perf_counter()
+        query_embeddings = evaluator.embed(texts)
+        t1 = time.perf_counter()
+        candidates = evaluator.retrieve(query_embeddings, depth)
+        t2 = time.perf_counter()
+        scores = evaluator.rerank(texts, candidates)
+        t3 = time.perf_counter()
+        timings["embed"] += t1 - t0
+        timings["retrieve"] += t2 - t1
+        timings["rerank"] += t3 - t2
+        n_pairs += sum(len(c) for c in candidates)
+        for item, query_candidates, query_scores in zip(items, candidates, scores):
+            queries.append({
+                "relevant": sorted(relevant_ids(item)),
+                "parent_ids": [c['parent_id'] for c in query_candidates],
+                "rerank_scores": query_scores,
+            })
+    return {
+        "depth": depth,
+        "queries": queries,
+        "cost_ms": {
+            "embed_per_query": timings["embed"] / len(eval_data) * 1000,
+            "retrieve_per_query": timings["retrieve"] / len(eval_data) * 1000,
+            "rerank_per_pair": timings["rerank"] / max(n_pairs, 1) * 1000,
+        },
+    }
+
+
+def load_or_score(evaluator: RetrievalEvaluator, eval_data: List[dict], eval_set_path: Path, depth: int,
+                  batch_size: int, refresh: bool) -> dict:
+    path = cache_path(eval_set_path, index_fingerprint(evaluator.retrieval_system), depth)
+    if path.exists() and not refresh:
+        print(f"   -> Dùng lại điểm đã tính: {path}")
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    scored = score_at_max_depth(evaluator, eval_data, depth, batch_size)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(scored, f, ensure_ascii=False)
+    tmp_path.replace(path)
+    return scored
+
+
+# --- MÔ PHỎNG TỪNG CẤU HÌNH ---
+def final_ranking(parent_ids: List[str], scores: List[float], n_retrieve: int, n_final: int) -> List[str]:
+    """
+    Kết quả của get_ranked_context với N_RETRIEVE_RESULTS = n_retrieve: ChromaDB trả về tiền tố
+    n_retrieve của danh sách dense, reranker chấm từng cặp độc lập nên điểm không đổi; giữ chunk
+    tốt nhất của mỗi tài liệu gốc và cắt ở n_final tài liệu.
+    """
+    order = sorted(range(min(n_retrieve, len(parent_ids))), key=lambda i: scores[i], reverse=True)
+    return list(dict.fromkeys(parent_ids[i] for i in order))[:n_final]
+
+
+def prefill_ms_per_doc_from_benchmark(path: Path = BENCHMARK_RESULT_PATH) -> Optional[float]:
+    """Ước lượng chi phí prefill của mỗi tài liệu trong prompt từ kết quả benchmark_pipeline.py --mode full."""
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        result = json.load(f)
+    prefill = result.get("stages", {}).get("prefill")
+    n_final = result.get("config", {}).get("n_final_results")
+    return prefill["p50_ms"] / n_final if prefill and n_final else None
+
+
+def sweep(scored: dict, retrieve_grid: List[int], final_grid: List[int], k_values: List[int],
+          prefill_ms_per_doc: float) -> pd.DataFrame:
+    """
+    Chất lượng và chi phí mô hình hoá (ms/câu hỏi) của mọi tổ hợp (n_retrieve, n_final, k), k <= n_final.
+    Chi phí = embed + truy vấn ChromaDB + n_retrieve x rerank một cặp + n_final x prefill một tài liệu.
+    """
+    cost = scored["cost_ms"]
+    rows = []
+    for n_retrieve, n_final in itertools.product(retrieve_grid, final_grid):
+        if n_retrieve > scored["depth"]:
+            continue
+        rankings = [final_ranking(q["parent_ids"], q["rerank_scores"], n_retrieve, n_final) for q in scored["queries"]]
+        cost_ms = (cost["embed_per_query"] + cost["retrieve_per_query"]
+                   + n_retrieve * cost["rerank_per_pair"] + n_final * prefill_ms_per_doc)
+        per_query = [ranking_metrics(ranked, set(q["relevant"]), k_values) for ranked, q in zip(rankings, scored["queries"])]
+        for k in k_values:
+            if k > n_final:
+                continue
+            row = {"n_retrieve": n_retrieve, "n_final": n_final, "k": k, "cost_ms": round(cost_ms, 3)}
+            for metric in METRICS:
+                row[metric] = round(float(np.mean([m[f"{metric}@{k}"] for m in per_query])), 4)
+            row["mrr"] = round(float(np.mean([m["mrr"] for m in per_query])), 4)
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def pareto_frontier(df: pd.DataFrame, metric: str) -> pd.DataFrame:
+    """Với mỗi k: các cấu hình không bị cấu hình nào khác vừa rẻ hơn (hoặc bằng) vừa tốt hơn (hoặc bằng) lấn át."""
+    frontiers = []
+    for _, group in df.groupby("k"):
+        best = -1.0
+        keep = []
+        for index, row in group.sort_values(["cost_ms", metric], ascending=[True, False]).iterrows():
+            if row[metric] > best:
+                best = row[metric]
+                keep.append(index)
+        frontiers.append(df.loc[keep])
+    return pd.concat(frontiers) if frontiers else df.iloc[0:0]
+
+
+# --- BÁO CÁO ---
+def plot_frontier(df: pd.DataFrame, frontier: pd.DataFrame, metric: str, path: Path):
+    plt.style.use('seaborn-v0_8-whitegrid')
+    plt.figure(figsize=(10, 6))
+    for k, group in df.groupby("k"):
+        points = plt.scatter(group["cost_ms"], group[metric], alpha=0.35, label=f"k = {k}")
+        front = frontier[frontier["k"] == k].sort_values("cost_ms")
+        plt.plot(front["cost_ms"], front[metric], marker="o", color=points.get_facecolor()[0][:3])
+        for _, row in front.iterrows():
+            plt.annotate(f"{row['n_retrieve']}/{row['n_final']}", (row["cost_ms"], row[metric]), fontsize=7,
+                         textcoords="offset points", xytext=(3, 3))
+    plt.title(f'{metric}@k theo chi phí mô hình hoá (nhãn: N_RETRIEVE/N_FINAL)', fontsize=14, pad=15)
+    plt.xlabel('Chi phí ước lượng mỗi câu hỏi (ms)', fontsize=12)
+    plt.ylabel(f'{metric}@k', fontsize=12)
+    plt.legend()
+    plt.savefig(path, bbox_inches='tight')
+    plt.close()
+
+
+def parse_int_list(value: str) -> List[int]:
+    return sorted({int(v) for v in value.split(",") if v.strip()})
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Quét N_RETRIEVE_RESULTS / N_FINAL_RESULTS / k: chất lượng và chi phí, xuất biên Pareto.")
+    parser.add_argument("--retrieve", type=parse_int_list, default=RETRIEVE_GRID, help="Các giá trị N_RETRIEVE_RESULTS, vd: 5,10,20.")
+    parser.add_argument("--final", type=parse_int_list, default=FINAL_GRID, help="Các giá trị N_FINAL_RESULTS.")
+    parser.add_argument("--k", type=parse_int_list, default=EVAL_K_VALUES, help="Các ngưỡng cắt k để tính chỉ số.")
+    parser.add_argument("--metric", choices=METRICS, default="hit", help="Chỉ số dùng để dựng biên Pareto.")
+    parser.add_argument("--prefill-ms-per-doc", type=float, default=None,
+                        help="Chi phí prefill mỗi tài liệu trong prompt; mặc định ước lượng từ benchmark_full.json (nếu có), không thì 0.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--eval-set", type=Path, default=EVAL_SET_PATH)
+    parser.add_argument("--refresh", action="store_true", help="Bỏ qua điểm đã cache, truy xuất và rerank lại.")
+    parser.add_argument("--no-embedding-cache", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        with open(args.eval_set, 'r', encoding='utf-8') as f:
+            eval_data = json.load(f)
+    except FileNotFoundError:
+        print(f"[LỖI] Không tìm thấy file bộ câu hỏi đánh giá tại: {args.eval_set}")
+        return
+
+    prefill_ms_per_doc = args.prefill_ms_per_doc
+    if prefill_ms_per_doc is None:
+        prefill_ms_per_doc = prefill_ms_per_doc_from_benchmark()
+        if prefill_ms_per_doc is None:
+            print("[Cảnh báo] Chưa có benchmark_full.json; chi phí prefill theo N_FINAL_RESULTS được tính là 0.")
+            prefill_ms_per_doc = 0.0
+
+    depth = max(args.retrieve)
+    evaluator = RetrievalEvaluator(use_embedding_cache=not args.no_embedding_cache)
+    print(f"\n1. Truy xuất ở độ sâu tối đa {depth} và rerank mọi ứng viên ({len(eval_data)} câu hỏi)...")
+    scored = load_or_score(evaluator, eval_data, args.eval_set, depth, args.batch_size, args.refresh)
+    cost = scored["cost_ms"]
+    print(f"   -> Chi phí đo được: embed {cost['embed_per_query']:.2f} ms/câu, ChromaDB {cost['retrieve_per_query']:.2f} ms/câu, "
+          f"rerank {cost['rerank_per_pair']:.3f} ms/cặp, prefill {prefill_ms_per_doc:.2f} ms/tài liệu")
+
+    print(f"2. Mô phỏng {len(args.retrieve) * len(args.final)} cấu hình...")
+    df = sweep(scored, args.retrieve, args.final, args.k, prefill_ms_per_doc)
+    frontier = pareto_frontier(df, args.metric)
+
+    print("\n" + "="*70)
+    print(f"--- BIÊN PARETO ({args.metric}@k theo chi phí) ---")
+    print(frontier.to_string(index=False))
+    current = df[(df["n_retrieve"] == N_RETRIEVE_RESULTS) & (df["n_final"] == N_FINAL_RESULTS)]
+    if len(current):
+        print(f"\nCấu hình hiện tại (N_RETRIEVE_RESULTS={N_RETRIEVE_RESULTS}, N_FINAL_RESULTS={N_FINAL_RESULTS}):")
+        print(current.to_string(index=False))
+    print("="*70)
+
+    EVAL_RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    csv_path = EVAL_RESULTS_DIR / "retrieval_sweep.csv"
+    df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+    json_path = EVAL_RESULTS_DIR / "retrieval_sweep_pareto.json"
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "collection": evaluator.retrieval_system.collection_name,
+            "n_queries": len(eval_data),
+            "metric": args.metric,
+            "cost_ms": {**cost, "prefill_per_doc": prefill_ms_per_doc},
+            "frontier": frontier.to_dict(orient="records"),
+        }, f, ensure_ascii=False, indent=2)
+    chart_path = EVAL_RESULTS_DIR / "retrieval_sweep_pareto.png"
+    plot_frontier(df, frontier, args.metric, chart_path)
+    print(f"\nĐã lưu: {csv_path}, {json_path}, {chart_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,26 @@
+import sys
+from pathlib import Path
+
 import chromadb
-from sentence_transformers import SentenceTransformer
 
-COLLECTION_NAME = "tuyensinh"
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.chatbot.config import CHROMA_PATH, COLLECTION_NAME
+from src.chatbot.embedding_cache import get_embedding_cache
+from src.chatbot.backends import load_embedder, embedding_model_id
 
 # Load model embedding
-embedder = SentenceTransformer("keepitreal/vietnamese-sbert")
+embedder = load_embedder()
+embedding_cache = get_embedding_cache(embedding_model_id())
 
 # Kết nối ChromaDB (persistent)
-chroma_client = chromadb.PersistentClient(path="data/vector_store/chroma_db")
+chroma_client = chromadb.PersistentClient(path=str(CHROMA_PATH))
 collection = chroma_client.get_collection(COLLECTION_NAME)
 
 def embed_text(text: str):
-    return embedder.encode([text])[0].tolist()
+    # Dùng cache embedding chung để không encode lại các câu hỏi đã gặp
+    return embedding_cache.get_or_compute([text], lambda texts: embedder.encode(texts))[0].tolist()
 
 queries = [
         "Ngành An toàn thông tin xét tuyển những tổ hợp môn nào?",